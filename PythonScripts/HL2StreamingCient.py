@@ -1,81 +1,94 @@
 import sys, os
 import socket
-import struct
-from collections import namedtuple
-import numpy as np
-import cv2
 from multiprocessing import Process
 import argparse
 from datetime import datetime
-import pandas as pd
+from connection import StreamConnection
+from frame_gate import FrameGate
+from sensor_protocol import SENSOR_FRAME_STRUCTURE, SensorFrameHeader
+from stream_stats import StreamStats
+from worker_pool import BACKPRESSURE_POLICIES
+
+# The viewer (OpenCV), image writer, recorder and asyncio client are imported
+# by the features using them, so a headless client starts on the socket and
+# NumPy core only
 
 
 HundredsOfNsToMilliseconds = 1e-4
 MillisecondsToSeconds = 1e-3
 
-# Define the viewer distance in meter for Depth image
-VIEW_DEPTH_DISTANCE = 2.0
-CV_ALPHA = 255 / (VIEW_DEPTH_DISTANCE * 1000)
-
 
 class SensorStreamingClient:
-    # Protocol Header Format
-    # see https://docs.python.org/2/library/struct.html#format-characters
-    SENSOR_FRAME_STRUCTURE = {
-        "color": {
-            "port": 10090,
-            "header_format": "@qIIII20f",
-            "header_data": namedtuple(
-                "SensorFrameStreamHeader",
-                "Timestamp ImageWidth ImageHeight PixelStride RowStride "
-                "fx fy cx cy "
-                "PV2WorldTransformM11 PV2WorldTransformM12 PV2WorldTransformM13 PV2WorldTransformM14 "
-                "PV2WorldTransformM21 PV2WorldTransformM22 PV2WorldTransformM23 PV2WorldTransformM24 "
-                "PV2WorldTransformM31 PV2WorldTransformM32 PV2WorldTransformM33 PV2WorldTransformM34 "
-                "PV2WorldTransformM41 PV2WorldTransformM42 PV2WorldTransformM43 PV2WorldTransformM44 ",
-            ),
-        },
-        "depth": {
-            "port": 10091,
-            "header_format": "@qIIII16f",
-            "header_data": namedtuple(
-                "SensorFrameStreamHeader",
-                "Timestamp ImageWidth ImageHeight PixelStride RowStride "
-                "Rig2WorldTransformM11 Rig2WorldTransformM12 Rig2WorldTransformM13 Rig2WorldTransformM14 "
-                "Rig2WorldTransformM21 Rig2WorldTransformM22 Rig2WorldTransformM23 Rig2WorldTransformM24 "
-                "Rig2WorldTransformM31 Rig2WorldTransformM32 Rig2WorldTransformM33 Rig2WorldTransformM34 "
-                "Rig2WorldTransformM41 Rig2WorldTransformM42 Rig2WorldTransformM43 Rig2WorldTransformM44 ",
-            ),
-        },
-    }
+    SENSOR_FRAME_STRUCTURE = SENSOR_FRAME_STRUCTURE
 
     def __init__(
-        self, host, sensorType, output_folder, save_image=False, verbose=False
+        self,
+        host,
+        sensorType,
+        output_folder,
+        save_image=False,
+        verbose=False,
+        save_workers=2,
+        save_queue_size=32,
+        save_policy="block",
+        record=False,
+        stats_interval=5.0,
+        stats_file=None,
+        stats_histogram=False,
+        headless=False,
+        display_fps=30.0,
+        display_downsample=1,
+        rcvbuf=None,
+        waitall=False,
+        busy_poll=None,
+        save_rate=None,
+        record_rate=None,
     ) -> None:
         assert sensorType.lower() in ["color", "depth", "all"], print(
             "Wrong sensorType!!!"
         )
 
         self.save_image = save_image
+        self.record = record
         self.verbose = verbose
         self.output_folder = output_folder
         self.sensor_type = sensorType
         self.host = host
         self.port = self.SENSOR_FRAME_STRUCTURE[self.sensor_type]["port"]
-        self.header_format = self.SENSOR_FRAME_STRUCTURE[self.sensor_type][
-            "header_format"
-        ]
-        self.header_data = self.SENSOR_FRAME_STRUCTURE[self.sensor_type]["header_data"]
-        self.header_size = struct.calcsize(self.header_format)
+        # Reusable header record, decoded in place for every frame
+        self.latest_header = SensorFrameHeader(self.sensor_type)
+        self.header_size = self.latest_header.size
 
         # define socket parameters
         self.socket = None
+        self.reader = None
         self.default_timeout = 3.0
         socket.setdefaulttimeout(self.default_timeout)
 
-        self.latest_header = None
         self.latest_image = None
+        # Frames are drawn by a capped-rate display thread, depth frames are
+        # only colorized when drawn or saved
+        self.viewer = None
+        if not headless:
+            from frame_viewer import FrameViewer
+
+            self.viewer = FrameViewer(max_fps=display_fps, downsample=display_downsample)
+        self.depth_lut = None
+        self.image_writer = None
         if self.save_image:
+            from frame_viewer import depth_colormap_lut
+            from image_writer import AsyncImageWriter
+            from pose_log import PoseLogWriter
+
+            # Headless sessions save the raw 16-bit depth, others the
+            # colorized depth shown in the viewer
+            self.depth_lut = None if headless else depth_colormap_lut()
+            # Encode and write images off the receive loop
+            self.image_writer = AsyncImageWriter(
+                num_workers=save_workers,
+                queue_size=save_queue_size,
+                policy=save_policy,
+            )
             os.makedirs(os.path.join(output_folder, self.sensor_type), exist_ok=True)
             self.camPose_file = os.path.join(
                 self.output_folder,
@@ -83,156 +96,196 @@ class SensorStreamingClient:
                 if self.sensor_type == "color"
                 else "rig2worldTransform.csv",
             )
-            self.camPose_dict = {}
-            self.streamData = {}
+            # Poses (and color intrinsics) are appended as frames arrive
+            self.pose_log = PoseLogWriter(
+                self.camPose_file, with_intrinsics=self.sensor_type == "color"
+            )
             self.image_name_format = os.path.join(
                 self.output_folder,
                 self.sensor_type,
                 "color_{}.jpg" if self.sensor_type == "color" else "depth_{}.png",
             )
 
-        self.start()
+        # Per-stage timing, FPS/bandwidth and device-to-host latency
+        self.stats_histogram = stats_histogram
+        self.stats = StreamStats(
+            self.sensor_type,
+            report_interval=stats_interval,
+            log=lambda line: print(f"==> [INFO] {line}"),
+            dump_path=(
+                stats_file.format(sensor_type=self.sensor_type) if stats_file else None
+            ),
+        )
 
-    def create_tcp_socket(self):
-        while True:
-            try:
-                self.socket = socket.socket(
-                    family=socket.AF_INET, type=socket.SOCK_STREAM
-                )
-                break
-            except socket.error as err:
-                print("==> [ERROR] Create socket failed!!!")
-                print(f"  *{err}")
+        # Reconnects with backoff and resyncs corrupt headers
+        self.connection = StreamConnection(
+            self.host,
+            self.port,
+            timeout=self.default_timeout,
+            stats=self.stats.connection,
+            rcvbuf=rcvbuf,
+            waitall=waitall,
+            busy_poll=busy_poll,
+        )
+        # Duplicate and stale frames are dropped before their payload is
+        # used, saving and recording can run below the stream rate
+        self.gate = FrameGate(
+            self.stats.gate, rates={"save": save_rate, "record": record_rate}
+        )
 
-    def close_tcp_socket(self):
-        self.socket.close()
-        print("==> [INFO] Socket close succeed...")
+        self.recorder = None
+        if self.record:
+            # Raw header + payload frames, replayed with RecordingReader
+            from frame_recorder import FrameRecorder
 
-    def receive_data(self, data_size):
-        data = bytes()
-        while len(data) < data_size:
-            remaining_bytes = data_size - len(data)
-            try:
-                data_chunk = self.socket.recv(remaining_bytes)
-                data += data_chunk
-            except Exception:
-                break
-        return data
+            os.makedirs(self.output_folder, exist_ok=True)
+            self.recorder = FrameRecorder(
+                os.path.join(self.output_folder, f"{self.sensor_type}.hl2rec"),
+                self.sensor_type,
+            )
+
+        self.start()
+
+    def close_tcp_socket(self):
+        if self.socket is not None:
+            self.connection.disconnect("stop")
+            self.socket = None
+            print("==> [INFO] Socket close succeed...")
 
     def parse_header(self, header_data):
-        header = struct.unpack(self.header_format, header_data)
-        self.latest_header = self.header_data(*header)
+        self.latest_header.decode(header_data)
 
     def parse_image(self, image_data):
-        if self.latest_header.PixelStride == 2:  # depth image
-            img = np.frombuffer(image_data, dtype=np.uint16)
-            img = img.reshape(
-                (self.latest_header.ImageHeight, self.latest_header.ImageWidth, -1)
-            )
-            self.latest_image = cv2.applyColorMap(
-                cv2.convertScaleAbs(img, alpha=CV_ALPHA),
-                cv2.COLORMAP_JET,
-            )
-        if self.latest_header.PixelStride == 3:  # BGR8 image
-            img = np.frombuffer(image_data, dtype=np.uint8)
-            self.latest_image = img.reshape(
-                (self.latest_header.ImageHeight, self.latest_header.ImageWidth, -1)
-            )
-        if self.latest_header.PixelStride == 4:  # BGRA8 image
-            img = np.frombuffer(image_data, dtype=np.uint8)
-            self.latest_image = img.reshape(
-                (self.latest_header.ImageHeight, self.latest_header.ImageWidth, -1)
-            )
+        # zero-copy view of the receive buffer, uint16 depth or BGR8 / BGRA8
+        self.latest_image = self.latest_header.image_view(image_data)
 
     def get_pv2world_from_header(self, header):
-        pv2world = np.array(header[9:26]).reshape((4, 4)).T
-        return pv2world
+        return header.pose
 
     def get_rig2world_from_header(self, header):
-        rig2world = np.array(header[5:22]).reshape((4, 4)).T
-        return rig2world
+        return header.pose
 
     def get_intrinsics_from_header(self, header):
-        intrinsics = np.array(
-            [[header.fx, 0, header.cx], [0, header.fy, header.cy], [0, 0, 1]],
-            dtype=np.float32,
-        )
-        return intrinsics
+        return header.camera_matrix
 
     def stop(self):
-        cv2.destroyAllWindows()
+        if self.viewer is not None:
+            self.viewer.close()
+            print(f"==> [INFO] Viewer stats: {self.viewer.stats()}")
         self.close_tcp_socket()
-        if self.save_image:
-            df_stream_data = pd.DataFrame.from_dict(
-                self.streamData, orient="columns", dtype="str"
+        if self.stats.dump_path is not None:
+            self.stats.dump(self.stats.dump_path)
+        if self.stats_histogram:
+            print(self.stats.histogram_report())
+        if self.record:
+            self.recorder.close()
+            print(
+                f"==> [INFO] Recorded {self.recorder.num_frames} frames to "
+                f"{self.recorder.file_path}"
             )
-            df_stream_data.to_html(
-                os.path.join(self.output_folder, f"{self.sensor_type}_stream_data.html")
+        if self.save_image:
+            self.image_writer.close()
+            print(f"==> [INFO] Image writer stats: {self.image_writer.stats()}")
+            self.pose_log.close()
+            print(
+                f"==> [INFO] Logged {self.pose_log.num_frames} poses to "
+                f"{self.pose_log.file_path}"
             )
         sys.exit()
 
     def start(self):
-        timeout_counter = 0
-        while True:
-            self.create_tcp_socket()
-            try:
-                self.socket.connect((self.host, self.port))
-                print(
-                    f"==> [INFO] Connection create succeed... ({self.host}:{self.port})"
-                )
-            except Exception:
-                self.socket.close()
-                timeout_counter += 1
-                print(
-                    f"==> [ERROR] Connection create failed!!! ({self.host}:{self.port})"
-                )
-                print(f"  * Try to reconnect {self.default_timeout} seconds later...")
-                continue
-
+        try:
             while True:
-                header_data = self.receive_data(self.header_size)
-                if len(header_data) != self.header_size:
-                    print("==> [ERROR] Failed to receive header data!!!")
-                    break
-                self.parse_header(header_data)
-                if self.verbose:
-                    print(self.latest_header)
-
-                img_bytes_size = (
-                    self.latest_header.ImageHeight * self.latest_header.RowStride
+                self.socket = self.connection.connect()
+                self.reader = self.connection.create_reader(
+                    self.socket, self.header_size
                 )
-                image_data = self.receive_data(img_bytes_size)
-                if len(image_data) != img_bytes_size:
-                    print("==> [ERROR] Failed to receive image data!!!")
-                    break
-                self.parse_image(image_data)
-
-                if self.save_image:
-                    cv2.imwrite(
-                        self.image_name_format.format(self.latest_header.Timestamp),
-                        self.latest_image,
+                while True:
+                    t = self.stats.start_frame()
+                    syscalls = self.reader.syscalls
+                    header_data = self.reader.read_header()
+                    if header_data is None:
+                        print(
+                            "==> [ERROR] Failed to receive header data!!! "
+                            f"({self.reader.describe_status()})"
+                        )
+                        break
+                    t = self.stats.lap("receive_header", t)
+                    self.parse_header(header_data)
+                    problem = self.latest_header.check()
+                    if problem is not None:
+                        print(f"==> [ERROR] Invalid header ({problem}), resyncing...")
+                        header_data = self.connection.resync(
+                            self.reader, self.latest_header
+                        )
+                        if header_data is None:
+                            break
+                    if self.verbose:
+                        print(self.latest_header)
+                    t = self.stats.lap("parse_header", t)
+
+                    img_bytes_size = self.latest_header.image_size
+                    image_data = self.reader.read_payload(img_bytes_size)
+                    if image_data is None:
+                        print(
+                            "==> [ERROR] Failed to receive image data!!! "
+                            f"({self.reader.describe_status()})"
+                        )
+                        break
+                    self.connection.frame_received(self.latest_header)
+                    t = self.stats.lap("receive_image", t)
+                    # only complete frames go through the gate
+                    timestamp = self.latest_header.Timestamp
+                    if not self.gate.admit(timestamp):
+                        # duplicate or stale frame, the payload is not used
+                        continue
+                    if self.record and self.gate.due("record", timestamp):
+                        self.recorder.write(header_data, image_data)
+                        t = self.stats.lap("record", t)
+                    # frames skipped by every output are not parsed
+                    save = self.save_image and self.gate.due("save", timestamp)
+                    if save or self.viewer is not None:
+                        self.parse_image(image_data)
+                        t = self.stats.lap("parse_image", t)
+                    is_depth = self.latest_header.PixelStride == 2
+
+                    if save:
+                        # the raw depth is copied, and colorized by the writer
+                        # unless headless
+                        self.image_writer.submit(
+                            self.image_name_format.format(self.latest_header.Timestamp),
+                            self.latest_image,
+                            colormap=self.depth_lut if is_depth else None,
+                        )
+                        self.pose_log.write(
+                            self.latest_header.Timestamp,
+                            self.latest_header.pose,
+                            self.latest_header.intrinsics,
+                        )
+                        t = self.stats.lap("save", t)
+
+                    # Display image
+                    if self.viewer is not None:
+                        self.viewer.show(
+                            f"Hololen2 {self.sensor_type} Sensor",
+                            self.latest_image,
+                            depth=is_depth,
+                        )
+                        if self.viewer.stop_requested:
+                            self.stop()
+                        self.stats.lap("display", t)
+                    self.stats.end_frame(
+                        self.header_size + img_bytes_size,
+                        self.latest_header.Timestamp,
+                        self.reader.syscalls - syscalls,
                     )
-                    if self.sensor_type == "color":
-                        stream_data = {
-                            "pv2world": self.get_pv2world_from_header(
-                                self.latest_header
-                            ).tolist(),
-                            "intrinsics": self.get_intrinsics_from_header(
-                                self.latest_header
-                            ).tolist(),
-                        }
-                    if self.sensor_type == "depth":
-                        stream_data = {
-                            "rig2world": self.get_rig2world_from_header(
-                                self.latest_header
-                            ).tolist(),
-                        }
-                    self.streamData[str(self.latest_header.Timestamp)] = stream_data
-
-                # Display image
-                cv2.imshow(f"Hololen2 {self.sensor_type} Sensor", self.latest_image)
-                if cv2.waitKey(1) & 0xFF == ord("q"):
-                    self.stop()
+                # the old socket is closed before reconnecting
+                self.connection.disconnect(self.reader.status.value)
+                self.socket = None
+        except KeyboardInterrupt:
+            # Ctrl-C, e.g. with --headless, still closes every output
+            print("==> [INFO] Interrupted, stopping...")
+            self.stop()
 
 
 def parse_args():
@@ -249,6 +302,104 @@ def parse_args():
     parser.add_argument(
         "--save_image", help="Save image to local", action="store_true", default=False
     )
+    parser.add_argument(
+        "--record",
+        help="Record raw frames to <output_folder>/<sensor_type>.hl2rec",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--save_workers",
+        help="Number of threads encoding and writing saved images",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--save_queue_size",
+        help="Maximum number of images waiting to be saved",
+        default=32,
+        type=int,
+    )
+    parser.add_argument(
+        "--save_policy",
+        help="What to do when the save queue is full",
+        choices=BACKPRESSURE_POLICIES,
+        default="block",
+    )
+    parser.add_argument(
+        "--stats_interval",
+        help="Seconds between stats lines, 0 to disable",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--stats_file",
+        help="Periodically dump stats to this file, Prometheus text for .prom "
+        "and JSON otherwise ('{sensor_type}' is replaced by the sensor type)",
+        default=None,
+    )
+    parser.add_argument(
+        "--stats_histogram",
+        help="Print timing histograms at shutdown",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        help="Socket receive buffer (SO_RCVBUF) in MB, OS autotuning if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--waitall",
+        help="Receive each header and payload in one MSG_WAITALL call "
+        "(not with --single_process)",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--busy_poll",
+        help="SO_BUSY_POLL in microseconds (Linux)",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--save_rate",
+        help="Save at most this many frames per second, every frame if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--record_rate",
+        help="Record at most this many frames per second, every frame if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--headless",
+        help="Do not open viewer windows, save raw 16-bit depth PNGs",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--display_fps",
+        help="Refresh rate cap of the viewer windows",
+        default=30.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--display_downsample",
+        help="Show every n-th row and column in the viewer windows",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--single_process",
+        help="Receive every stream in one asyncio event loop instead of "
+        "one process per sensor",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "--verbose", help="Print header information", action="store_true", default=False
     )
@@ -262,6 +413,9 @@ def parse_args():
         ),
     )
     args = parser.parse_args()
+    if args.waitall and args.single_process:
+        # the asyncio client reads from non-blocking sockets
+        parser.error("--waitall is not available with --single_process")
     return args
 
 
@@ -271,6 +425,55 @@ if __name__ == "__main__":
     sensor_type = args.sensor_type
     save_image = args.save_image
     output_folder = args.output_folder
+    client_options = {
+        "verbose": args.verbose,
+        "save_workers": args.save_workers,
+        "save_queue_size": args.save_queue_size,
+        "save_policy": args.save_policy,
+        "record": args.record,
+        "stats_interval": args.stats_interval,
+        "stats_file": args.stats_file,
+        "stats_histogram": args.stats_histogram,
+        "headless": args.headless,
+        "display_fps": args.display_fps,
+        "display_downsample": args.display_downsample,
+        "rcvbuf": int(args.rcvbuf * 2**20) if args.rcvbuf else None,
+        "waitall": args.waitall,
+        "busy_poll": args.busy_poll,
+        "save_rate": args.save_rate,
+        "record_rate": args.record_rate,
+    }
+
+    if args.single_process:
+        import asyncio
+        from async_client import build_client
+
+        client = build_client(
+            [host],
+            sensor_type,
+            output_folder,
+            record=args.record,
+            save_image=save_image,
+            save_workers=args.save_workers,
+            save_queue_size=args.save_queue_size,
+            save_policy=args.save_policy,
+            stats_interval=args.stats_interval,
+            headless=args.headless,
+            display_fps=args.display_fps,
+            display_downsample=args.display_downsample,
+            rcvbuf=client_options["rcvbuf"],
+            busy_poll=args.busy_poll,
+            save_rate=args.save_rate,
+            record_rate=args.record_rate,
+            stats_file=args.stats_file,
+            stats_histogram=args.stats_histogram,
+            verbose=args.verbose,
+        )
+        try:
+            asyncio.run(client.run())
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
 
     process_pool = []
 
@@ -284,6 +487,7 @@ if __name__ == "__main__":
                     output_folder,
                     save_image,
                 ),
+                kwargs=client_options,
                 name="ColorViewer",
             )
         )
@@ -298,6 +502,7 @@ if __name__ == "__main__":
                     output_folder,
                     save_image,
                 ),
+                kwargs=client_options,
                 name="DepthViewer",
             )
         )
@@ -312,6 +517,7 @@ if __name__ == "__main__":
                     output_folder,
                     save_image,
                 ),
+                kwargs=client_options,
                 name="ColorViewer",
             )
         )
@@ -324,6 +530,7 @@ if __name__ == "__main__":
                     output_folder,
                     save_image,
                 ),
+                kwargs=client_options,
                 name="DepthViewer",
             )
         )
@@ -332,4 +539,10 @@ if __name__ == "__main__":
         p.start()
 
     for p in process_pool:
-        p.join()
+        while True:
+            try:
+                p.join()
+                break
+            except KeyboardInterrupt:
+                # the children got the same SIGINT and are closing their outputs
+                pass
@@ -1,80 +1,94 @@
 # from copy import copy
-import os, sys, struct
+import os, sys
 import socket
-from collections import namedtuple
-import yaml
 import numpy as np
-from scipy.spatial.transform import Rotation as Rot
 import argparse
-import rospy, cv_bridge, tf2_ros
-from sensor_msgs.msg import Image, CameraInfo, PointCloud2, PointField
+import rospy, tf2_ros
+from sensor_msgs.msg import Image, CameraInfo, CompressedImage, PointCloud2, PointField
 from geometry_msgs.msg import TransformStamped
+from connection import StreamConnection
+from frame_gate import FrameGate
+from image_codecs import (
+    COLOR_CODECS,
+    DEPTH_CODECS,
+    CompressedImagePool,
+    compressed_format,
+)
+from point_cloud import DepthUnprojector, load_depth_lut
+from pose_filter import PoseFilter
+from pose_utils import (
+    DEFAULT_RIG2DEPTH,
+    HOLO_PV_TO_ROS_CAM,
+    HOLO_WORLD_TO_ROS_WORLD,
+    PoseChain,
+    load_depth_extrinsics_from_yaml,
+    transform_to_tf,
+)
+from sensor_protocol import SENSOR_FRAME_STRUCTURE, UNIX_EPOCH, SensorFrameHeader
+from stream_stats import StreamStats
 
 
 class HoloLensMessagePublisher:
-    UNIX_EPOCH = 11644473600
-    # Set Header infomation
-    SENSOR_FRAME_STRUCTURE = {
-        "color": {
-            "port": 10090,
-            "header_format": "@qIIII20f",
-            "header_data": namedtuple(
-                "SensorFrameStreamHeader",
-                "Timestamp ImageWidth ImageHeight PixelStride RowStride "
-                "fx fy cx cy "
-                "PV2WorldTransformM11 PV2WorldTransformM12 PV2WorldTransformM13 PV2WorldTransformM14 "
-                "PV2WorldTransformM21 PV2WorldTransformM22 PV2WorldTransformM23 PV2WorldTransformM24 "
-                "PV2WorldTransformM31 PV2WorldTransformM32 PV2WorldTransformM33 PV2WorldTransformM34 "
-                "PV2WorldTransformM41 PV2WorldTransformM42 PV2WorldTransformM43 PV2WorldTransformM44 ",
-            ),
-        },
-        "depth": {
-            "port": 10091,
-            "header_format": "@qIIII16f",
-            "header_data": namedtuple(
-                "SensorFrameStreamHeader",
-                "Timestamp ImageWidth ImageHeight PixelStride RowStride "
-                "Rig2WorldTransformM11 Rig2WorldTransformM12 Rig2WorldTransformM13 Rig2WorldTransformM14 "
-                "Rig2WorldTransformM21 Rig2WorldTransformM22 Rig2WorldTransformM23 Rig2WorldTransformM24 "
-                "Rig2WorldTransformM31 Rig2WorldTransformM32 Rig2WorldTransformM33 Rig2WorldTransformM34 "
-                "Rig2WorldTransformM41 Rig2WorldTransformM42 Rig2WorldTransformM43 Rig2WorldTransformM44 ",
-            ),
-        },
-    }
+    UNIX_EPOCH = UNIX_EPOCH
+    SENSOR_FRAME_STRUCTURE = SENSOR_FRAME_STRUCTURE
 
     # Rotate the HoloLens World coordinate system to match ROS World coordinate system
-    # HoloLens World coordinate system: x left, y up, z backward
-    # ROS World coordinate system: x forward, y left, z up
-    HoloWorld2RosWorld = np.array(
-        [[0, 0, -1, 0], [-1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]],
-        dtype=np.float32,
-    )
+    HoloWorld2RosWorld = HOLO_WORLD_TO_ROS_WORLD
     # Rotate the HoloLens Camera coordinate system to match ROS Camera coordinate system
-    # HoloLens Camera coordinate system: x left, y up, z backward
-    # ROS Camera coordinate system: x left, y down, z forward
-    HoloPV2RosCam = np.array(
-        [[1, 0, 0, 0], [0, -1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]],
-        dtype=np.float32,
-    )
-
-    def __init__(self, sensor_type, host, rig2depth, holo_serial="hololens2") -> None:
+    HoloPV2RosCam = HOLO_PV_TO_ROS_CAM
+
+    def __init__(
+        self,
+        sensor_type,
+        host,
+        rig2depth,
+        holo_serial="hololens2",
+        stats_interval=5.0,
+        stats_file=None,
+        stats_histogram=False,
+        depth_lut=None,
+        cloud_stride=1,
+        cloud_roi=None,
+        cloud_min_depth=0.0,
+        cloud_max_depth=None,
+        use_cv_bridge=False,
+        latch_camera_info=False,
+        compressed_codec=None,
+        compressed_quality=None,
+        compress_workers=2,
+        rcvbuf=None,
+        waitall=False,
+        busy_poll=None,
+        tf_smoothing=0.0,
+        tf_prediction=None,
+        tf_window=8,
+        image_rate=None,
+        compressed_rate=None,
+        cloud_rate=None,
+    ) -> None:
         self.serial = holo_serial
         self.sensor_type = sensor_type
-        self.preTimeStamp = 0
-        # Initialize CvBridge
-        self.bridge = cv_bridge.CvBridge()
+        # Images are built from the received payload, CvBridge is the fallback
+        # and only imported when used
+        self.use_cv_bridge = use_cv_bridge
+        self.bridge = None
+        if use_cv_bridge:
+            import cv_bridge
+
+            self.bridge = cv_bridge.CvBridge()
+        self.msgImage = None
         # Calibration information
         self.pv2world = None
         self.rig2world = None
         self.depth2rig = np.linalg.inv(rig2depth)
-        # Streaming Frame Header
-        self.stream_header_format = self.SENSOR_FRAME_STRUCTURE[self.sensor_type][
-            "header_format"
-        ]
-        self.stream_header = self.SENSOR_FRAME_STRUCTURE[self.sensor_type][
-            "header_data"
-        ]
-        self.header_size = struct.calcsize(self.stream_header_format)
+        # Constant factors of the camera_to_world chain, folded once
+        self.cam2world_chain = PoseChain(
+            self.HoloWorld2RosWorld,
+            self.HoloPV2RosCam if self.sensor_type == "color" else self.depth2rig,
+        )
+        # Streaming Frame Header, decoded in place for every frame
+        self.latest_header = SensorFrameHeader(self.sensor_type)
+        self.header_size = self.latest_header.size
         # Varialbles for TCP stream socket
         self.host = host
         self.port = self.SENSOR_FRAME_STRUCTURE[self.sensor_type]["port"]
@@ -88,6 +102,45 @@ class HoloLensMessagePublisher:
             if self.sensor_type == "color"
             else None
         )
+        self.pointCloudTopic = f"/{self.serial}/sensor_depth/points"
+        # image_transport topic names: compressed color, compressedDepth depth
+        self.compressedTopic = self.imageTopic + (
+            "/compressed" if self.sensor_type == "color" else "/compressedDepth"
+        )
+
+        # Point cloud from the AHaT LUT, rays are cached once
+        self.unprojector = None
+        if self.sensor_type == "depth" and depth_lut is not None:
+            self.unprojector = DepthUnprojector(
+                load_depth_lut(depth_lut),
+                stride=cloud_stride,
+                roi=cloud_roi,
+                min_depth=cloud_min_depth,
+                max_depth=cloud_max_depth,
+            )
+        self.msgPointCloud = None
+        # TF poses are smoothed and predicted over a ring of recent poses,
+        # published as received when both are off
+        self.poseFilter = None
+        if tf_smoothing or tf_prediction is not None:
+            self.poseFilter = PoseFilter(
+                smoothing=tf_smoothing, prediction=tf_prediction, window=tf_window
+            )
+        # CameraInfo is rebuilt only when the intrinsics or image size change,
+        # latched CameraInfo is only published on such changes
+        self.latch_camera_info = latch_camera_info
+        self.msgCamInfo = None
+        self.camInfoKey = None
+        # Compressed images are encoded on worker threads, off the receive loop
+        self.compressed_codec = compressed_codec
+        self.compressed_quality = compressed_quality
+        self.compress_workers = compress_workers
+        if compressed_codec is not None and compressed_codec not in (
+            COLOR_CODECS if self.sensor_type == "color" else DEPTH_CODECS
+        ):
+            raise ValueError(
+                f"Codec '{compressed_codec}' is not available for {self.sensor_type} images"
+            )
 
         # Initialize node
         try:
@@ -97,44 +150,101 @@ class HoloLensMessagePublisher:
             rospy.loginfo_once("Node '{}' initialized failed!!!".format(self.node_id))
             sys.exit(0)
 
+        # Per-stage timing, FPS/bandwidth and device-to-host latency
+        self.stats_histogram = stats_histogram
+        self.stats = StreamStats(
+            f"{self.serial}_{self.sensor_type}",
+            report_interval=stats_interval,
+            log=rospy.loginfo,
+            dump_path=stats_file,
+        )
+        rospy.on_shutdown(self.report_stats)
+        # Duplicate and stale frames are dropped on their header, the image
+        # outputs can be published below the stream rate (TF is not limited)
+        self.gate = FrameGate(
+            self.stats.gate,
+            rates={
+                "image": image_rate,
+                "compressed": compressed_rate,
+                "cloud": cloud_rate,
+            },
+        )
+        # Reconnects with backoff and resyncs corrupt headers
+        self.connection = StreamConnection(
+            self.host,
+            self.port,
+            timeout=3.0,
+            stats=self.stats.connection,
+            rcvbuf=rcvbuf,
+            waitall=waitall,
+            busy_poll=busy_poll,
+            log_info=rospy.loginfo,
+            log_error=rospy.logerr,
+        )
+
         # Create message Publishers
         self.imagePub = rospy.Publisher(self.imageTopic, Image, queue_size=2)
         self.tfBroadcaster = tf2_ros.TransformBroadcaster()
         self.camInfoPub = (
-            rospy.Publisher(self.camInfoTopic, CameraInfo, queue_size=2)
+            rospy.Publisher(
+                self.camInfoTopic,
+                CameraInfo,
+                queue_size=2,
+                latch=self.latch_camera_info,
+            )
             if self.sensor_type == "color"
             else None
         )
+        self.pointCloudPub = (
+            rospy.Publisher(self.pointCloudTopic, PointCloud2, queue_size=2)
+            if self.unprojector is not None
+            else None
+        )
+        self.compressedPub = None
+        self.compressPool = None
+        if self.compressed_codec is not None:
+            self.compressedPub = rospy.Publisher(
+                self.compressedTopic, CompressedImage, queue_size=2
+            )
+            self.compressPool = CompressedImagePool(
+                self.publish_compressed_image_message,
+                num_workers=self.compress_workers,
+            )
+            rospy.on_shutdown(self.compressPool.close)
 
     def run(self):
         socket.setdefaulttimeout(3)
-        timeout_counter = 0
         try:
             while not rospy.is_shutdown():
-                # Initialize the TCP stream socket
-                self.socket = self.create_tcp_stream_socket()
-                # Connect to (host, port)
-                try:
-                    self.socket.connect((self.host, self.port))
-                    rospy.loginfo('Connected to "{}:{}"'.format(self.host, self.port))
-                except Exception:
-                    self.socket.close()
-                    timeout_counter += 1
-                    rospy.logerr(
-                        "Connection failed {}!!! ({}:{}). Try again 3 seconds later...".format(
-                            timeout_counter, self.host, self.port
-                        )
-                    )
-                    continue
-
+                # Connect to (host, port), retrying with backoff
+                self.socket = self.connection.connect(rospy.is_shutdown)
+                if self.socket is None:
+                    break
+
+                # payload slots hold exactly one frame, for Image messages
+                self.reader = self.connection.create_reader(
+                    self.socket, self.header_size, exact_payload=True
+                )
                 while not rospy.is_shutdown():
                     # Receive header
-                    try:
-                        reply = self.receive_data_in_chunks(self.header_size)
-                    except Exception:
-                        self.socket.close()
-                        rospy.logerr("Cannot receive Header")
+                    t = self.stats.start_frame()
+                    syscalls = self.reader.syscalls
+                    reply = self.reader.read_header()
+                    if reply is None:
+                        rospy.logerr(
+                            "Cannot receive Header ({})".format(
+                                self.reader.describe_status()
+                            )
+                        )
                         break
+                    # A header out of bounds means the stream lost sync
+                    problem = self.latest_header.decode(reply).check()
+                    if problem is not None:
+                        rospy.logerr(f"Invalid header ({problem}), resyncing...")
+                        reply = self.connection.resync(self.reader, self.latest_header)
+                        if reply is None:
+                            break
+                    t = self.stats.lap("receive_header", t)
 
                     # Compute camera_to_world matrix
                     # for ROS coordinate system
@@ -145,133 +255,163 @@ class HoloLensMessagePublisher:
                         self.latest_header, self.pv2world = self.color_header_parser(
                             reply
                         )
-                        cam2world = np.matmul(
-                            self.HoloWorld2RosWorld,
-                            np.matmul(self.pv2world, self.HoloPV2RosCam),
-                        )
+                        cam2world = self.cam2world_chain.apply(self.pv2world)
 
                     if self.sensor_type == "depth":
                         self.latest_header, self.rig2world = self.depth_header_parser(
                             reply
                         )
-                        cam2world = np.matmul(
-                            self.HoloWorld2RosWorld,
-                            np.matmul(self.rig2world, self.depth2rig),
-                        )
+                        cam2world = self.cam2world_chain.apply(self.rig2world)
 
                     rospy.logdebug("Header:\n", self.latest_header)
+                    timestamp = self.latest_header.Timestamp
+                    t = self.stats.lap("parse_header", t)
+
+                    # admitted by the gate once the payload has arrived
+                    if self.gate.accepts(timestamp):
+                        # Create Timestamp
+                        self.msgTimestamp = rospy.Time.from_sec(
+                            timestamp / 1e7 - self.UNIX_EPOCH
+                        )
+                        rospy.logdebug("msgTimestamp={}".format(self.msgTimestamp))
+
+                        # publish camera pose before the image is received,
+                        # TF listeners get it one payload transfer earlier
+                        self.publish_stamped_transformation_message(
+                            cam2world,
+                            self.world_frame_id,
+                            self.frame_id,
+                        )
+                        t = self.stats.lap("publish_tf", t)
 
                     # Receive the image
-                    img_bytes_size = (
-                        self.latest_header.ImageHeight * self.latest_header.RowStride
-                    )
-                    try:
-                        image_data = self.receive_data_in_chunks(img_bytes_size)
-                    except Exception:
-                        self.socket.close()
-                        rospy.logerr("Cannot receive Image data...")
+                    img_bytes_size = self.latest_header.image_size
+                    image_data = self.reader.read_payload(img_bytes_size)
+                    if image_data is None:
+                        rospy.logerr(
+                            "Cannot receive Image data... ({})".format(
+                                self.reader.describe_status()
+                            )
+                        )
                         break
+                    self.connection.frame_received(self.latest_header)
+                    t = self.stats.lap("receive_image", t)
+                    if not self.gate.admit(timestamp):
+                        # duplicate or stale frame, the payload is not used
+                        continue
 
                     # Prepare messages for publishing
                     rospy.loginfo_once("Start publishing messages...")
 
-                    # Create Timestamp
-                    self.msgTimestamp = rospy.Time.from_sec(
-                        self.latest_header.Timestamp / 1e7 - self.UNIX_EPOCH
-                    )
-                    rospy.logdebug("msgTimestamp={}".format(self.msgTimestamp))
+                    # frames above the rate of an output skip it, the image
+                    # view costs nothing until an output uses it
+                    image_array, encoding = self.image_data_parser(image_data)
+                    publish_image = self.gate.due("image", timestamp)
 
-                    # publish camera pose
-                    self.publish_stamped_transformation_message(
-                        cam2world,
-                        self.world_frame_id,
-                        self.frame_id,
-                    )
                     # publish image message
-                    image_array, encoding = self.image_data_parser(image_data)
-                    self.publish_stamped_image_message(image_array, encoding)
+                    if publish_image:
+                        if self.use_cv_bridge:
+                            self.publish_stamped_image_message(image_array, encoding)
+                        else:
+                            self.publish_stamped_payload_image_message(image_data)
+                        t = self.stats.lap("publish_image", t)
+
+                    # queue compressed image, encoded and published by the pool
+                    if self.compressPool is not None and self.gate.due(
+                        "compressed", timestamp
+                    ):
+                        self.compressPool.submit(
+                            self.compressed_codec,
+                            image_array,
+                            context=(self.msgTimestamp, encoding),
+                            quality=self.compressed_quality,
+                        )
+                        t = self.stats.lap("queue_compressed", t)
 
                     # publish camera info message with camInfo publisher
-                    if self.camInfoPub is not None:
+                    if self.camInfoPub is not None and publish_image:
                         self.publish_stamped_camera_info_message(
                             self.latest_header.fx,
                             self.latest_header.fy,
                             self.latest_header.cx,
                             self.latest_header.cy,
                         )
+                        t = self.stats.lap("publish_camera_info", t)
+
+                    # publish point cloud in the world frame
+                    if self.pointCloudPub is not None and self.gate.due(
+                        "cloud", timestamp
+                    ):
+                        self.publish_point_cloud_message(image_array, cam2world)
+                        t = self.stats.lap("publish_point_cloud", t)
+                    self.stats.end_frame(
+                        self.header_size + img_bytes_size,
+                        timestamp,
+                        self.reader.syscalls - syscalls,
+                    )
+                # the old socket is closed before reconnecting
+                self.connection.disconnect(self.reader.status.value)
 
         except KeyboardInterrupt:
             rospy.signal_shutdown("Node shutdown by user...")
-            self.socket.close()
+            self.connection.disconnect("stop")
             sys.exit()
 
+    def report_stats(self):
+        if self.compressPool is not None:
+            rospy.loginfo(f"Compressed image stats: {self.compressPool.stats()}")
+        if self.stats.dump_path is not None:
+            self.stats.dump(self.stats.dump_path)
+        if self.stats_histogram:
+            rospy.loginfo(self.stats.histogram_report())
+
     def color_header_parser(self, reply):
-        header_data = struct.unpack(self.stream_header_format, reply)
-        header = self.stream_header(*header_data)
-        pv2world = np.array(header[9:26], dtype=np.float32).reshape((4, 4)).transpose()
-        return header, pv2world
+        header = self.latest_header.decode(reply)
+        # pv2world is a view of the header record, updated in place
+        return header, header.pose
 
     def depth_header_parser(self, reply):
-        header_data = struct.unpack(self.stream_header_format, reply)
-        header = self.stream_header(*header_data)
-        rig2world = np.array(header[5:22], dtype=np.float32).reshape((4, 4)).transpose()
-        return header, rig2world
+        header = self.latest_header.decode(reply)
+        # rig2world is a view of the header record, updated in place
+        return header, header.pose
 
     def image_data_parser(self, reply):
-        if self.latest_header.PixelStride == 2:  # depth image: 'Gray16'
-            image_array = np.frombuffer(reply, dtype=np.uint16).reshape(
-                (
-                    self.latest_header.ImageHeight,
-                    self.latest_header.ImageWidth,
-                    -1,
-                )
-            )
-            encoding = "16UC1"
-        if self.latest_header.PixelStride == 3:  # color image 'Bgr8'
-            image_array = np.frombuffer(reply, dtype=np.uint8).reshape(
-                (
-                    self.latest_header.ImageHeight,
-                    self.latest_header.ImageWidth,
-                    -1,
-                )
-            )
-            encoding = "bgr8"
-        if self.latest_header.PixelStride == 4:  # color image 'Bgra8'
-            image_array = np.frombuffer(reply, dtype=np.uint8).reshape(
-                (
-                    self.latest_header.ImageHeight,
-                    self.latest_header.ImageWidth,
-                    -1,
-                )
-            )
-            encoding = "bgra8"
-        return image_array, encoding
-
-    def receive_data_in_chunks(self, data_size):
-        """
-        Function to receive data in chunks.
-        Especially useful for large datagrams
-        """
-        data = bytes()
-        while len(data) < data_size:
-            remaining_bytes = data_size - len(data)
-            data_chunk = self.socket.recv(remaining_bytes)
-            data += data_chunk
-        return data
+        # zero-copy view of the receive buffer
+        image_array = self.latest_header.image_view(reply)
+        return image_array, self.latest_header.encoding
 
     def publish_stamped_image_message(self, image_array, encoding):
         msgImage = self.create_msgImage(image_array, encoding)
         self.imagePub.publish(msgImage)
 
+    def publish_stamped_payload_image_message(self, payload):
+        msgImage = self.create_msgImage_from_payload(payload)
+        self.imagePub.publish(msgImage)
+
+    def publish_compressed_image_message(self, context, codec, data):
+        # called on a CompressedImagePool worker thread
+        timestamp, encoding = context
+        msg = CompressedImage()
+        msg.header.stamp = timestamp
+        msg.header.frame_id = self.frame_id
+        msg.format = compressed_format(codec, encoding)
+        msg.data = data
+        self.compressedPub.publish(msg)
+
     def publish_stamped_transformation_message(
         self, transform_mat, reference_frame, child_frame
     ):
-        trans = transform_mat[:3, 3]
-        quat = Rot.from_matrix(transform_mat[:3, :3]).as_quat()
+        trans, quat = transform_to_tf(transform_mat)
+        timestamp = self.msgTimestamp
+        if self.poseFilter is not None:
+            stamp, trans, quat = self.poseFilter.update(
+                self.latest_header.Timestamp, trans, quat
+            )
+            timestamp = rospy.Time.from_sec(stamp / 1e7 - self.UNIX_EPOCH)
 
         # Create & publish stamped transformation message
         self.msgTransformStamped = self.create_msgTransformStamped(
-            timestamp=self.msgTimestamp,
+            timestamp=timestamp,
             reference_frame=reference_frame,
             child_frame=child_frame,
             translation=trans,
@@ -280,10 +420,38 @@ class HoloLensMessagePublisher:
         self.tfBroadcaster.sendTransform(self.msgTransformStamped)
 
     def publish_stamped_camera_info_message(self, fx, fy, ppx, ppy):
-        projection_matrix = [fx, 0, ppx, 0, 0, fy, ppy, 0, 0, 0, 1, 0]
-        # create camera info message
-        msgCamInfo = self.create_msgCamInfo(P=projection_matrix)
-        self.camInfoPub.publish(msgCamInfo)
+        key = (
+            fx,
+            fy,
+            ppx,
+            ppy,
+            self.latest_header.ImageWidth,
+            self.latest_header.ImageHeight,
+        )
+        if key == self.camInfoKey:
+            if self.latch_camera_info:
+                return
+            self.msgCamInfo.header.stamp = self.msgTimestamp
+        else:
+            rospy.loginfo(
+                "Camera intrinsics fx={:.2f} fy={:.2f} cx={:.2f} cy={:.2f} ({}x{})".format(
+                    *key
+                )
+            )
+            # create camera info message, no distortion is streamed
+            self.msgCamInfo = self.create_msgCamInfo(
+                D=[0.0, 0.0, 0.0, 0.0, 0.0],
+                K=[fx, 0, ppx, 0, fy, ppy, 0, 0, 1],
+                R=[1, 0, 0, 0, 1, 0, 0, 0, 1],
+                P=[fx, 0, ppx, 0, 0, fy, ppy, 0, 0, 0, 1, 0],
+            )
+            self.camInfoKey = key
+        self.camInfoPub.publish(self.msgCamInfo)
+
+    def publish_point_cloud_message(self, depth_array, cam2world):
+        points = self.unprojector.unproject(depth_array, cam2world)
+        msgPointCloud = self.create_msgPointCloud2(points, self.world_frame_id)
+        self.pointCloudPub.publish(msgPointCloud)
 
     def create_msgImage(self, image_array, encoding):
         """
@@ -301,6 +469,35 @@ class HoloLensMessagePublisher:
         msg.header.frame_id = self.frame_id
         return msg
 
+    def create_msgImage_from_payload(self, payload):
+        """
+        Fill the reused Image message straight from the received payload.
+
+        `step` is the header RowStride, so padded rows are sent as they are
+        instead of being repacked. rospy serializes the message inside
+        `publish`, so the message can be reused for the next frame.
+        :param payload: received image bytes, ImageHeight * RowStride long,
+            a view of a reader slot sized to the payload
+
+        :returns msgImage
+        """
+        msg = self.msgImage
+        if msg is None:
+            msg = self.msgImage = Image()
+            msg.header.frame_id = self.frame_id
+            msg.is_bigendian = 0
+        header = self.latest_header
+        msg.header.stamp = self.msgTimestamp
+        msg.height = header.ImageHeight
+        msg.width = header.ImageWidth
+        msg.encoding = header.encoding
+        msg.step = header.RowStride
+        # genpy packs uint8[] from bytes or bytearray but not memoryview: the
+        # reader slot itself is sent, serialized by `publish` before reuse
+        data = payload.obj
+        msg.data = data if len(data) == len(payload) else bytes(payload)
+        return msg
+
     def create_msgTransformStamped(
         self, timestamp, translation, quaternion, reference_frame, child_frame
     ):
@@ -327,6 +524,32 @@ class HoloLensMessagePublisher:
         msg.transform.rotation.w = quaternion[3]
         return msg
 
+    def create_msgPointCloud2(self, points, frame_id):
+        """
+        ref: http://docs.ros.org/en/noetic/api/sensor_msgs/html/msg/PointCloud2.html
+        :param points: contiguous (N, 3) float32 array of x, y, z
+        :param frame_id: frame of the points
+
+        :returns: PointCloud2, reused between frames
+        """
+        msg = self.msgPointCloud
+        if msg is None:
+            msg = self.msgPointCloud = PointCloud2()
+            msg.height = 1
+            msg.fields = [
+                PointField(name=name, offset=4 * i, datatype=PointField.FLOAT32, count=1)
+                for i, name in enumerate("xyz")
+            ]
+            msg.is_bigendian = False
+            msg.point_step = 12
+            msg.is_dense = True
+        msg.header.stamp = self.msgTimestamp
+        msg.header.frame_id = frame_id
+        msg.width = len(points)
+        msg.row_step = msg.point_step * len(points)
+        msg.data = points.tobytes()
+        return msg
+
     def create_msgCamInfo(self, D=None, K=None, R=None, P=None):
         """
         ref: http://docs.ros.org/en/noetic/api/sensor_msgs/html/msg/CameraInfo.html
@@ -363,20 +586,7 @@ class HoloLensMessagePublisher:
             msg.P = P
         return msg
 
-    def create_tcp_stream_socket(self):
-        try:
-            ss = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
-            return ss
-        except:
-            rospy.logerr("TCP stream socket initialization failed... ")
-            sys.exit()
-
-    @staticmethod
-    def load_depth_extrinsics_from_yaml(file_path):
-        with open(file_path, "r") as f:
-            data = yaml.load(f, Loader=yaml.SafeLoader)
-        extr = np.array(data["extrinsics"], dtype=np.float32).reshape((4, 4))
-        return extr
+    load_depth_extrinsics_from_yaml = staticmethod(load_depth_extrinsics_from_yaml)
 
 
 def parse_args():
@@ -394,6 +604,144 @@ def parse_args():
     parser.add_argument(
         "--holo_serial", help="HoloLens serial", default="hololens2", type=str
     )
+    parser.add_argument(
+        "--stats_interval",
+        help="Seconds between stats lines, 0 to disable",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--stats_file",
+        help="Periodically dump stats to this file, Prometheus text for .prom "
+        "and JSON otherwise",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--stats_histogram",
+        help="Log timing histograms at shutdown",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--depth_lut",
+        help="Depth AHaT_lut.bin of the device, enables the point cloud topic",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--cloud_stride",
+        help="Keep every n-th depth row and column in the point cloud",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--cloud_roi",
+        help="Depth pixel region of the point cloud as x y width height",
+        nargs=4,
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--cloud_min_depth",
+        help="Drop points closer than this (meters)",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--cloud_max_depth",
+        help="Drop points farther than this (meters)",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--use_cv_bridge",
+        help="Build Image messages with cv_bridge instead of from the payload",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--latch_camera_info",
+        help="Latch camera_info and publish it only when the intrinsics change",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--compressed_codec",
+        help="Also publish CompressedImage: jpeg/webp for color, "
+        "png/rvl (lossless compressedDepth) for depth",
+        choices=COLOR_CODECS + DEPTH_CODECS,
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--compressed_quality",
+        help="JPEG/WebP quality (0-100) or PNG compression level (0-9)",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--compress_workers",
+        help="Threads encoding compressed images",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        help="Socket receive buffer (SO_RCVBUF) in MB, OS autotuning if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--waitall",
+        help="Receive each header and payload in one MSG_WAITALL call",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--busy_poll",
+        help="SO_BUSY_POLL in microseconds (Linux)",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--tf_smoothing",
+        help="Smooth TF poses with this time constant in seconds, 0 to disable",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--tf_prediction",
+        help="Publish TF poses predicted this many seconds past the frame "
+        "Timestamp (0 only cancels the smoothing lag)",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--tf_window",
+        help="Recent poses kept for TF smoothing",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--image_rate",
+        help="Publish image_raw and camera_info at most this many times per "
+        "second, every frame if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--compressed_rate",
+        help="Publish compressed images at most this many times per second",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--cloud_rate",
+        help="Publish point clouds at most this many times per second",
+        default=None,
+        type=float,
+    )
     args = parser.parse_args()
     return args
 
@@ -404,33 +752,35 @@ if __name__ == "__main__":
     sensor_type = args.sensor_type.lower()
     holo_serial = args.holo_serial.lower()
 
-    rig2depth = np.array(
-        [
-            0.022715600207448006,
-            -0.9995700120925903,
-            -0.018523599952459335,
-            -0.05916620045900345,
-            0.9609990119934082,
-            0.026939600706100464,
-            -0.27523499727249146,
-            -0.015487399883568287,
-            0.27561599016189575,
-            -0.011549100279808044,
-            0.9611979722976685,
-            -0.01788480021059513,
-            0.0,
-            0.0,
-            0.0,
-            1.0,
-        ],
-        dtype=np.float32,
-    ).reshape((4, 4))
+    rig2depth = DEFAULT_RIG2DEPTH
 
     holo_publisher = HoloLensMessagePublisher(
         holo_serial=holo_serial,
         sensor_type=sensor_type,
         host=host,
         rig2depth=rig2depth,
+        stats_interval=args.stats_interval,
+        stats_file=args.stats_file,
+        stats_histogram=args.stats_histogram,
+        depth_lut=args.depth_lut,
+        cloud_stride=args.cloud_stride,
+        cloud_roi=args.cloud_roi,
+        cloud_min_depth=args.cloud_min_depth,
+        cloud_max_depth=args.cloud_max_depth,
+        use_cv_bridge=args.use_cv_bridge,
+        latch_camera_info=args.latch_camera_info,
+        compressed_codec=args.compressed_codec,
+        compressed_quality=args.compressed_quality,
+        compress_workers=args.compress_workers,
+        rcvbuf=int(args.rcvbuf * 2**20) if args.rcvbuf else None,
+        waitall=args.waitall,
+        busy_poll=args.busy_poll,
+        tf_smoothing=args.tf_smoothing,
+        tf_prediction=args.tf_prediction,
+        tf_window=args.tf_window,
+        image_rate=args.image_rate,
+        compressed_rate=args.compressed_rate,
+        cloud_rate=args.cloud_rate,
     )
 
     holo_publisher.run()
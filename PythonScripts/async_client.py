@@ -0,0 +1,687 @@
+import os
+import asyncio
+import inspect
+import argparse
+from datetime import datetime
+from connection import Backoff, StreamConnection
+from frame_gate import FrameGate, RateLimiter
+from frame_reader import FrameReader, ReadStatus
+from pipeline import StopStreaming, StreamFrame
+from sensor_protocol import SENSOR_FRAME_STRUCTURE
+from stream_stats import StreamStats
+
+
+class AsyncFrameReader(FrameReader):
+    """
+    FrameReader for non-blocking sockets driven by an asyncio event loop.
+
+    Same buffers and statuses, but `read_header`, `read_payload` and
+    `recv_exact` are coroutines built on `loop.sock_recv_into`.
+    """
+
+    def __init__(
+        self, sock, header_size, payload_size=0, num_slots=2, timeout=None
+    ) -> None:
+        """
+        :param timeout: seconds allowed for one header or payload read
+        """
+        super().__init__(sock, header_size, payload_size, num_slots)
+        self.socket.setblocking(False)
+        self.timeout = timeout
+
+    async def read_header(self):
+        if await self.recv_exact(self._header_view) is not ReadStatus.OK:
+            return None
+        return self._header_view
+
+    async def read_payload(self, data_size):
+        view = self._next_payload_view(data_size)
+        if await self.recv_exact(view, frame_start=False) is not ReadStatus.OK:
+            return None
+        return view
+
+    async def resync(
+        self, anchor, anchor_offset, is_header, max_bytes, chunk_size=65536
+    ):
+        window = self._start_resync()
+        chunk = bytearray(chunk_size)
+        loop = asyncio.get_running_loop()
+        skipped = 0
+        while True:
+            offset, dropped = self._find_header(window, anchor, anchor_offset, is_header)
+            skipped += dropped
+            if offset is not None:
+                self.bytes_skipped += skipped
+                return self._end_resync(window, offset)
+            del window[:dropped]
+            if skipped > max_bytes:
+                self.bytes_skipped += skipped
+                self.status = ReadStatus.DESYNC
+                return None
+            try:
+                nbytes = await asyncio.wait_for(
+                    loop.sock_recv_into(self.socket, chunk), self.timeout
+                )
+            except asyncio.TimeoutError as err:
+                self.last_error = err
+                self.status = ReadStatus.TIMEOUT
+                nbytes = None
+            except OSError as err:
+                self.last_error = err
+                self.status = ReadStatus.ERROR
+                nbytes = None
+            if not nbytes:
+                if nbytes == 0:
+                    self.status = ReadStatus.SHORT_READ
+                self.bytes_skipped += skipped
+                return None
+            self.recv_calls += 1
+            self.bytes_received += nbytes
+            window += memoryview(chunk)[:nbytes]
+
+    async def recv_exact(self, view, frame_start=True):
+        if self.timeout is None:
+            return await self._recv_exact(view, frame_start)
+        try:
+            return await asyncio.wait_for(
+                self._recv_exact(view, frame_start), self.timeout
+            )
+        except asyncio.TimeoutError as err:
+            self.last_error = err
+            self.status = ReadStatus.TIMEOUT
+            return self.status
+
+    async def _recv_exact(self, view, frame_start):
+        loop = asyncio.get_running_loop()
+        data_size = len(view)
+        received = pending = self._take_pending(view)
+        self.last_error = None
+        try:
+            while received < data_size:
+                nbytes = await loop.sock_recv_into(self.socket, view[received:])
+                self.recv_calls += 1
+                if nbytes == 0:
+                    self.status = (
+                        ReadStatus.EOF
+                        if received == 0 and frame_start
+                        else ReadStatus.SHORT_READ
+                    )
+                    return self.status
+                received += nbytes
+        except OSError as err:
+            self.last_error = err
+            self.status = ReadStatus.ERROR
+            return self.status
+        finally:
+            self.bytes_received += received - pending
+        self.status = ReadStatus.OK
+        return self.status
+
+
+class AsyncSensorStream:
+    """
+    Receive one sensor stream of one device inside the client event loop.
+    """
+
+    def __init__(
+        self,
+        client,
+        host,
+        sensor_type,
+        device=None,
+        port=None,
+        timeout=3.0,
+        backoff=None,
+        stats_interval=5.0,
+        stats_file=None,
+        rcvbuf=None,
+        busy_poll=None,
+        verbose=False,
+    ) -> None:
+        """
+        :param stats_file: see `AsyncStreamingClient`
+        :param verbose: print every header
+        """
+        self.client = client
+        self.host = host
+        self.sensor_type = sensor_type
+        self.device = device or host
+        self.port = (
+            SENSOR_FRAME_STRUCTURE[sensor_type]["port"] if port is None else port
+        )
+        self.timeout = timeout
+        self.verbose = verbose
+        self.frame = StreamFrame(self.device, sensor_type)
+        self.stats = StreamStats(
+            f"{self.device}/{sensor_type}",
+            report_interval=stats_interval,
+            log=lambda line: print(f"==> [INFO] {line}"),
+            dump_path=(
+                stats_file.format(device=self.device, sensor_type=sensor_type)
+                if stats_file
+                else None
+            ),
+        )
+        # Reconnects with backoff and resyncs corrupt headers
+        self.connection = StreamConnection(
+            self.host,
+            self.port,
+            timeout=timeout,
+            backoff=backoff or Backoff(),
+            stats=self.stats.connection,
+            rcvbuf=rcvbuf,
+            busy_poll=busy_poll,
+        )
+        # Duplicate and stale frames are not dispatched
+        self.gate = FrameGate(self.stats.gate)
+
+    @property
+    def connected(self):
+        return self.stats.connection.connected
+
+    @property
+    def connections(self):
+        return self.stats.connection.connects
+
+    async def run(self):
+        while True:
+            sock = await self.connection.connect_async()
+            reason = "stop"
+            try:
+                reason = await self._receive_frames(sock)
+            finally:
+                # the socket is closed even when the task is cancelled
+                self.connection.disconnect(reason)
+
+    async def _receive_frames(self, sock):
+        """
+        :returns: ReadStatus value of the read that ended the connection
+        """
+        frame = self.frame
+        header = frame.header
+        connection = self.connection
+        reader = AsyncFrameReader(sock, header.size, timeout=self.timeout)
+        while True:
+            t = self.stats.start_frame()
+            syscalls = reader.syscalls
+            header_data = await reader.read_header()
+            if header_data is None:
+                print(
+                    f"==> [ERROR] Failed to receive {self.device} {self.sensor_type} "
+                    f"header data!!! ({reader.describe_status()})"
+                )
+                return reader.status.value
+            problem = header.decode(header_data).check()
+            if problem is not None:
+                print(
+                    f"==> [ERROR] Invalid {self.device} {self.sensor_type} header "
+                    f"({problem}), resyncing..."
+                )
+                header_data = await connection.resync_async(reader, header)
+                if header_data is None:
+                    return reader.status.value
+            if self.verbose:
+                print(header)
+            t = self.stats.lap("receive_header", t)
+
+            payload = await reader.read_payload(header.image_size)
+            if payload is None:
+                print(
+                    f"==> [ERROR] Failed to receive {self.device} {self.sensor_type} "
+                    f"image data!!! ({reader.describe_status()})"
+                )
+                return reader.status.value
+            connection.frame_received(header)
+            t = self.stats.lap("receive_image", t)
+
+            if self.gate.admit(header.Timestamp):
+                frame.raw_header = header_data
+                frame.payload = payload
+                await self.client.dispatch(frame)
+                self.stats.lap("dispatch", t)
+                self.stats.end_frame(
+                    header.size + header.image_size,
+                    header.Timestamp,
+                    reader.syscalls - syscalls,
+                )
+            # sock_recv_into does not yield while data is ready, let the
+            # other streams run
+            await asyncio.sleep(0)
+
+
+class AsyncStreamingClient:
+    """
+    Multiplex any number of sensor streams, from any number of HoloLens
+    devices, in one asyncio event loop.
+
+    Every received frame is passed to the consumers in order. A consumer is a
+    callable taking a StreamFrame, may be a coroutine function, may raise
+    StopStreaming, and may define `close()` to be called on shutdown.
+    """
+
+    def __init__(
+        self,
+        consumers=None,
+        timeout=3.0,
+        stats_interval=5.0,
+        rcvbuf=None,
+        busy_poll=None,
+        stats_file=None,
+        stats_histogram=False,
+        verbose=False,
+    ) -> None:
+        """
+        :param rcvbuf: SO_RCVBUF of the stream sockets in bytes
+        :param busy_poll: SO_BUSY_POLL of the stream sockets in microseconds
+        :param stats_file: stats dump of every stream, '{device}' and
+            '{sensor_type}' are replaced
+        :param stats_histogram: print timing histograms at shutdown
+        :param verbose: print every header
+        """
+        self.consumers = list(consumers or [])
+        self.timeout = timeout
+        self.stats_interval = stats_interval
+        self.rcvbuf = rcvbuf
+        self.busy_poll = busy_poll
+        self.stats_file = stats_file
+        self.stats_histogram = stats_histogram
+        self.verbose = verbose
+        self.streams = []
+        self._tasks = []
+
+    def add_stream(self, host, sensor_type, device=None, port=None):
+        stream = AsyncSensorStream(
+            self,
+            host,
+            sensor_type,
+            device=device,
+            port=port,
+            timeout=self.timeout,
+            stats_interval=self.stats_interval,
+            stats_file=self.stats_file,
+            rcvbuf=self.rcvbuf,
+            busy_poll=self.busy_poll,
+            verbose=self.verbose,
+        )
+        self.streams.append(stream)
+        return stream
+
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+        return consumer
+
+    async def dispatch(self, frame):
+        for consumer in self.consumers:
+            result = consumer(frame)
+            if inspect.isawaitable(result):
+                await result
+
+    async def run(self):
+        self._tasks = [asyncio.ensure_future(stream.run()) for stream in self.streams]
+        try:
+            await asyncio.gather(*self._tasks)
+        except StopStreaming:
+            pass
+        finally:
+            self.stop()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            for stream in self.streams:
+                if stream.stats.dump_path is not None:
+                    stream.stats.dump(stream.stats.dump_path)
+                if self.stats_histogram:
+                    print(stream.stats.histogram_report())
+            for consumer in self.consumers:
+                close = getattr(consumer, "close", None)
+                if close is not None:
+                    close()
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+def stream_file_name(device, sensor_type):
+    return f"{device.replace('.', '_').replace(':', '_')}_{sensor_type}"
+
+
+class RateLimitedConsumer:
+    """
+    Pass at most `rate` frames per second of every stream to `consumer`,
+    decided on the header Timestamp (see RateLimiter).
+    """
+
+    def __init__(self, consumer, rate, name=None) -> None:
+        self.consumer = consumer
+        self.rate = rate
+        self.name = name or type(consumer).__name__
+        self.limiters = {}
+        self.skipped = 0
+
+    def __call__(self, frame):
+        limiter = self.limiters.get(frame.key)
+        if limiter is None:
+            limiter = self.limiters[frame.key] = RateLimiter(self.rate)
+        if limiter.due(frame.header.Timestamp):
+            return self.consumer(frame)
+        self.skipped += 1
+
+    def close(self):
+        close = getattr(self.consumer, "close", None)
+        if close is not None:
+            close()
+        print(
+            f"==> [INFO] {self.name} skipped {self.skipped} frames above "
+            f"{self.rate} FPS"
+        )
+
+
+class DisplayConsumer:
+    """
+    Show every stream in its own OpenCV window, press "q" to stop.
+
+    Windows are drawn by a FrameViewer at most `max_fps` times per second,
+    so the event loop mostly copies the latest frame of each stream (it also
+    draws them outside Linux, where the viewer has no display thread).
+    """
+
+    def __init__(self, view_depth_distance=2.0, max_fps=30.0, downsample=1) -> None:
+        from frame_viewer import FrameViewer
+
+        self.viewer = FrameViewer(max_fps, downsample, view_depth_distance)
+
+    def __call__(self, frame):
+        self.viewer.show(
+            f"Hololen2 {frame.device} {frame.sensor_type} Sensor",
+            frame.image,
+            depth=frame.header.PixelStride == 2,
+        )
+        if self.viewer.stop_requested:
+            raise StopStreaming()
+
+    def close(self):
+        self.viewer.close()
+
+
+class RecordConsumer:
+    """
+    Record every stream to `<output_folder>/<device>_<sensor_type>.hl2rec`.
+    """
+
+    def __init__(self, output_folder) -> None:
+        from frame_recorder import FrameRecorder
+
+        self.FrameRecorder = FrameRecorder
+        self.output_folder = output_folder
+        self.recorders = {}
+        os.makedirs(output_folder, exist_ok=True)
+
+    def __call__(self, frame):
+        recorder = self.recorders.get(frame.key)
+        if recorder is None:
+            recorder = self.recorders[frame.key] = self.FrameRecorder(
+                os.path.join(
+                    self.output_folder,
+                    stream_file_name(frame.device, frame.sensor_type) + ".hl2rec",
+                ),
+                frame.sensor_type,
+            )
+        recorder.write(frame.raw_header, frame.payload)
+
+    def close(self):
+        for recorder in self.recorders.values():
+            recorder.close()
+            print(
+                f"==> [INFO] Recorded {recorder.num_frames} frames to "
+                f"{recorder.file_path}"
+            )
+
+
+class SaveImageConsumer:
+    """
+    Save images and poses like `SensorStreamingClient --save_image`, one
+    folder and pose log per stream, with a shared AsyncImageWriter. Depth is
+    saved colorized, or as 16-bit PNGs if `raw_depth`.
+    """
+
+    def __init__(
+        self,
+        output_folder,
+        num_workers=2,
+        queue_size=32,
+        policy="block",
+        view_depth_distance=2.0,
+        raw_depth=False,
+    ) -> None:
+        from frame_viewer import depth_colormap_lut
+        from image_writer import AsyncImageWriter
+        from pose_log import PoseLogWriter
+
+        self.PoseLogWriter = PoseLogWriter
+        self.depth_lut = None if raw_depth else depth_colormap_lut(view_depth_distance)
+        self.output_folder = output_folder
+        self.image_writer = AsyncImageWriter(num_workers, queue_size, policy)
+        self.streams = {}
+
+    def _open_stream(self, frame):
+        name = stream_file_name(frame.device, frame.sensor_type)
+        os.makedirs(os.path.join(self.output_folder, name), exist_ok=True)
+        pose_log = self.PoseLogWriter(
+            os.path.join(
+                self.output_folder,
+                f"{name}_pv2WorldTransform.csv"
+                if frame.sensor_type == "color"
+                else f"{name}_rig2worldTransform.csv",
+            ),
+            with_intrinsics=frame.sensor_type == "color",
+        )
+        image_name_format = os.path.join(
+            self.output_folder,
+            name,
+            "color_{}.jpg" if frame.sensor_type == "color" else "depth_{}.png",
+        )
+        return image_name_format, pose_log
+
+    def __call__(self, frame):
+        stream = self.streams.get(frame.key)
+        if stream is None:
+            stream = self.streams[frame.key] = self._open_stream(frame)
+        image_name_format, pose_log = stream
+        header = frame.header
+
+        # depth images are colorized by the writer unless raw_depth
+        self.image_writer.submit(
+            image_name_format.format(header.Timestamp),
+            frame.image,
+            colormap=self.depth_lut if header.PixelStride == 2 else None,
+        )
+        pose_log.write(header.Timestamp, header.pose, header.intrinsics)
+
+    def close(self):
+        self.image_writer.close()
+        print(f"==> [INFO] Image writer stats: {self.image_writer.stats()}")
+        for _, pose_log in self.streams.values():
+            pose_log.close()
+
+
+def build_client(
+    hosts,
+    sensor_type,
+    output_folder,
+    headless=False,
+    record=False,
+    save_image=False,
+    save_workers=2,
+    save_queue_size=32,
+    save_policy="block",
+    stats_interval=5.0,
+    display_fps=30.0,
+    display_downsample=1,
+    rcvbuf=None,
+    busy_poll=None,
+    save_rate=None,
+    record_rate=None,
+    stats_file=None,
+    stats_histogram=False,
+    verbose=False,
+):
+    """
+    Client for `sensor_type` ("color", "depth" or "all") of every host, with
+    the consumers selected by the command line flags.
+    """
+    sensor_types = ["color", "depth"] if sensor_type == "all" else [sensor_type]
+    client = AsyncStreamingClient(
+        stats_interval=stats_interval,
+        rcvbuf=rcvbuf,
+        busy_poll=busy_poll,
+        stats_file=stats_file,
+        stats_histogram=stats_histogram,
+        verbose=verbose,
+    )
+    for host in hosts:
+        for sensor_type in sensor_types:
+            client.add_stream(host, sensor_type)
+    if record:
+        consumer = RecordConsumer(output_folder)
+        if record_rate:
+            consumer = RateLimitedConsumer(consumer, record_rate)
+        client.add_consumer(consumer)
+    if save_image:
+        consumer = SaveImageConsumer(
+            output_folder,
+            save_workers,
+            save_queue_size,
+            save_policy,
+            raw_depth=headless,
+        )
+        if save_rate:
+            consumer = RateLimitedConsumer(consumer, save_rate)
+        client.add_consumer(consumer)
+    if not headless:
+        client.add_consumer(
+            DisplayConsumer(max_fps=display_fps, downsample=display_downsample)
+        )
+    return client
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host",
+        help="Address(es) of the HoloLens device(s) to connect",
+        nargs="+",
+        default=["192.168.50.210"],
+    )
+    parser.add_argument(
+        "--sensor_type",
+        help="Sensor type to subscribe, all/depth/color",
+        choices=["color", "depth", "all"],
+        default="all",
+    )
+    parser.add_argument(
+        "--headless",
+        help="Do not open viewer windows, save raw 16-bit depth PNGs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        help="Socket receive buffer (SO_RCVBUF) in MB, OS autotuning if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--busy_poll",
+        help="SO_BUSY_POLL in microseconds (Linux)",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--display_fps",
+        help="Refresh rate cap of the viewer windows",
+        default=30.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--display_downsample",
+        help="Show every n-th row and column in the viewer windows",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--record",
+        help="Record raw frames to <output_folder>/<device>_<sensor_type>.hl2rec",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--save_image", help="Save image to local", action="store_true", default=False
+    )
+    parser.add_argument(
+        "--save_rate",
+        help="Save at most this many frames per second, every frame if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--record_rate",
+        help="Record at most this many frames per second, every frame if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--stats_interval",
+        help="Seconds between stats lines, 0 to disable",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--stats_file",
+        help="Periodically dump stats to this file, Prometheus text for .prom "
+        "and JSON otherwise ('{device}' and '{sensor_type}' are replaced)",
+        default=None,
+    )
+    parser.add_argument(
+        "--stats_histogram",
+        help="Print timing histograms at shutdown",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--verbose", help="Print header information", action="store_true", default=False
+    )
+    parser.add_argument(
+        "--output_folder",
+        help="Output folder for recordings and saved images",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "output",
+            datetime.now().strftime("%Y%m%d_%H%M%S"),
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client = build_client(
+        args.host,
+        args.sensor_type,
+        args.output_folder,
+        headless=args.headless,
+        record=args.record,
+        save_image=args.save_image,
+        stats_interval=args.stats_interval,
+        display_fps=args.display_fps,
+        display_downsample=args.display_downsample,
+        rcvbuf=int(args.rcvbuf * 2**20) if args.rcvbuf else None,
+        busy_poll=args.busy_poll,
+        save_rate=args.save_rate,
+        record_rate=args.record_rate,
+        stats_file=args.stats_file,
+        stats_histogram=args.stats_histogram,
+        verbose=args.verbose,
+    )
+    try:
+        asyncio.run(client.run())
+    except KeyboardInterrupt:
+        pass
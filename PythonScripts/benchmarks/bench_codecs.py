@@ -0,0 +1,96 @@
+"""
+Bytes per frame and encode/decode latency of the CompressedImage codecs on
+PV color (JPEG, WebP) and AHaT depth (PNG, RVL) frames.
+
+Frames come from `--record` recordings, or from the synthetic replay source
+when none is given. Synthetic frames are much smoother than real ones, so
+use recordings for representative sizes.
+
+    python3 benchmarks/bench_codecs.py --recording output/<date>/color.hl2rec output/<date>/depth.hl2rec
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_recorder import RecordingReader
+from image_codecs import COLOR_CODECS, DEPTH_CODECS, decode_image, encode_image
+from replay_server import SyntheticFrameSource
+from sensor_protocol import SensorFrameHeader, unix_to_filetime
+
+
+def recorded_frames(file_path, max_frames):
+    reader = RecordingReader(file_path)
+    step = max(len(reader) // max_frames, 1)
+    images = [reader.frame(i)[1].copy() for i in range(0, len(reader), step)]
+    sensor_type = reader.sensor_type
+    reader.close()
+    return sensor_type, images[:max_frames]
+
+
+def synthetic_frames(sensor_type, max_frames):
+    source = SyntheticFrameSource(sensor_type)
+    header = SensorFrameHeader(sensor_type)
+    images = []
+    for i in range(min(max_frames, len(source))):
+        header_data, payload = source.frame(i, unix_to_filetime(time.time()))
+        header.decode(header_data)
+        images.append(header.image_view(payload).copy())
+    return sensor_type, images
+
+
+def measure(codec, images, quality):
+    encode_times, decode_times, sizes = [], [], []
+    for image in images:
+        start = time.perf_counter()
+        data = encode_image(codec, image, quality)
+        encoded_at = time.perf_counter()
+        decoded = decode_image(codec, data)
+        decoded_at = time.perf_counter()
+        if codec in DEPTH_CODECS:
+            assert np.array_equal(decoded.reshape(image.shape), image), codec
+        encode_times.append(encoded_at - start)
+        decode_times.append(decoded_at - encoded_at)
+        sizes.append(len(data))
+    raw_size = images[0].nbytes
+    encode_ms = np.array(encode_times) * 1e3
+    print(
+        f"==> [INFO] {codec:<5} {np.mean(sizes) / 1024:8.1f} KiB/frame "
+        f"({raw_size / np.mean(sizes):5.1f}x) encode {encode_ms.mean():6.2f} ms "
+        f"(p99 {np.percentile(encode_ms, 99):6.2f}) decode "
+        f"{np.mean(decode_times) * 1e3:6.2f} ms"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--recording", help=".hl2rec recordings to sample", nargs="*", default=[]
+    )
+    parser.add_argument("--frames", help="Frames per recording", default=50, type=int)
+    parser.add_argument(
+        "--quality",
+        help="JPEG/WebP quality or PNG level, codec default if not set",
+        default=None,
+        type=int,
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.recording:
+        datasets = [recorded_frames(path, args.frames) for path in args.recording]
+    else:
+        datasets = [synthetic_frames(sensor, args.frames) for sensor in ("color", "depth")]
+    for sensor_type, images in datasets:
+        height, width = images[0].shape[:2]
+        print(
+            f"==> [INFO] {sensor_type} {width}x{height}, {len(images)} frames, "
+            f"{images[0].nbytes / 1024:.1f} KiB raw"
+        )
+        for codec in COLOR_CODECS if sensor_type == "color" else DEPTH_CODECS:
+            quality = None if codec == "rvl" else args.quality
+            measure(codec, images, quality)
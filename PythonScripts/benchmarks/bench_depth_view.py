@@ -0,0 +1,137 @@
+"""
+Depth visualization cost on synthetic 512x512 AHaT frames: colorization with
+cv2.convertScaleAbs + applyColorMap against the depth colormap lookup table,
+and the receive loop cost of drawing inline against handing the frames to a
+FrameViewer display thread.
+
+No windows are opened unless --display is set, imshow/waitKey are replaced
+by no-ops so the display thread still runs on machines without a display.
+
+    python3 benchmarks/bench_depth_view.py --frames 450
+"""
+import os, sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_viewer import (
+    VIEW_DEPTH_DISTANCE,
+    FrameViewer,
+    colorize_depth,
+    depth_colormap_lut,
+)
+from replay_server import SyntheticFrameSource
+from sensor_protocol import SensorFrameHeader
+
+CV_ALPHA = 255 / (VIEW_DEPTH_DISTANCE * 1000)
+FPS = 45.0
+
+
+def synthetic_depth():
+    source = SyntheticFrameSource("depth")
+    header = SensorFrameHeader("depth")
+    frames = []
+    for i in range(len(source)):
+        header_data, payload = source.frame(i, 0)
+        header.decode(header_data)
+        frames.append(header.image_view(payload).copy())
+    return frames
+
+
+def measure(name, function, frames, count):
+    start = time.perf_counter()
+    for i in range(count):
+        function(frames[i % len(frames)])
+    elapsed = (time.perf_counter() - start) / count
+    print(f"==> [INFO] {name:<34} {elapsed * 1e3:7.3f} ms/frame")
+    return elapsed
+
+
+def paced(name, function, frames, count):
+    """
+    Call `function` at the depth stream rate and measure the time it takes.
+    """
+    busy = 0.0
+    next_frame = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        function(frames[i % len(frames)])
+        busy += time.perf_counter() - start
+        next_frame += 1 / FPS
+        delay = next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    print(
+        f"==> [INFO] {name:<34} {busy / count * 1e3:7.3f} ms/frame in the "
+        f"receive loop at {FPS:.0f} FPS"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Frames per measurement", default=450, type=int)
+    parser.add_argument(
+        "--display", help="Open the viewer windows", action="store_true", default=False
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.display:
+        cv2.imshow = lambda name, image: None
+        cv2.waitKey = lambda delay: -1
+        cv2.destroyAllWindows = lambda: None
+    frames = synthetic_depth()
+    lut = depth_colormap_lut()
+
+    reference = cv2.applyColorMap(
+        cv2.convertScaleAbs(frames[0], alpha=CV_ALPHA), cv2.COLORMAP_JET
+    )
+    colorized = colorize_depth(frames[0], lut)[:, :, :3]
+    mismatched = np.count_nonzero(reference != colorized)
+    print(f"==> [INFO] {mismatched} values differ from applyColorMap")
+
+    buffer = np.empty(frames[0].shape[:2], dtype=np.uint32)
+    measure(
+        "cv2 convertScaleAbs+applyColorMap",
+        lambda depth: cv2.applyColorMap(
+            cv2.convertScaleAbs(depth, alpha=CV_ALPHA), cv2.COLORMAP_JET
+        ),
+        frames,
+        args.frames,
+    )
+    measure(
+        "lookup table",
+        lambda depth: colorize_depth(depth, lut, buffer),
+        frames,
+        args.frames,
+    )
+    measure(
+        "lookup table, downsample 2",
+        lambda depth: colorize_depth(depth[::2, ::2], lut),
+        frames,
+        args.frames,
+    )
+
+    def inline(depth):
+        image = cv2.applyColorMap(
+            cv2.convertScaleAbs(depth, alpha=CV_ALPHA), cv2.COLORMAP_JET
+        )
+        cv2.imshow("depth", image)
+        cv2.waitKey(1)
+
+    paced("inline colorize + imshow", inline, frames, args.frames)
+    for max_fps, downsample in ((30.0, 1), (15.0, 2)):
+        viewer = FrameViewer(max_fps, downsample)
+        paced(
+            f"FrameViewer {max_fps:.0f} FPS downsample {downsample}",
+            lambda depth: viewer.show("depth", depth, depth=True),
+            frames,
+            args.frames,
+        )
+        viewer.close()
+        print(f"==> [INFO]   viewer stats: {viewer.stats()}")
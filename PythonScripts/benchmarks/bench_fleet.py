@@ -0,0 +1,126 @@
+"""
+Aggregate receive rate of N emulated devices with the single-process asyncio
+client versus FleetIngest (one worker process per device, shared memory
+handoff). Every device is a pair of replay servers running in their own
+process on 127.0.0.<2+i>, at the device frame rates (30 FPS color, 45 FPS
+depth) or with `--max_rate` as fast as the client drains them.
+
+Paced devices show how many of the device frames each client keeps up with;
+at max rate the fleet workers drop frames instead of slowing the device
+down, so compare the two with at least one core per device.
+
+    python3 benchmarks/bench_fleet.py --devices 8 --seconds 10
+"""
+import os, sys
+import time
+import asyncio
+import argparse
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from async_client import AsyncStreamingClient, StopStreaming
+from fleet import FleetDevice, FleetIngest
+from replay_server import ReplayServer, SyntheticFrameSource
+
+SENSOR_TYPES = ["color", "depth"]
+
+
+def serve_device(host, fps, ports, stop_event):
+    servers = [
+        ReplayServer(SyntheticFrameSource(sensor_type), host=host, port=0, fps=fps).start()
+        for sensor_type in SENSOR_TYPES
+    ]
+    ports.update({server.sensor_type: server.port for server in servers})
+    stop_event.wait()
+    for server in servers:
+        server.stop()
+
+
+def start_devices(num_devices, fps):
+    manager = mp.Manager()
+    stop_event = mp.Event()
+    devices, processes = [], []
+    for i in range(num_devices):
+        host = f"127.0.0.{2 + i}"
+        ports = manager.dict()
+        process = mp.Process(target=serve_device, args=(host, fps, ports, stop_event))
+        process.start()
+        while len(ports) < len(SENSOR_TYPES):
+            time.sleep(0.05)
+        devices.append(FleetDevice(host, f"hololens2_{i}", dict(ports)))
+        processes.append(process)
+    return devices, processes, stop_event, manager
+
+
+class Counter:
+    def __init__(self, seconds) -> None:
+        self.frames = 0
+        self.bytes = 0
+        self.seconds = seconds
+        self.start = None
+
+    def __call__(self, frame):
+        if self.start is None:
+            self.start = time.perf_counter()
+        self.frames += 1
+        self.bytes += len(frame.payload)
+        frame.image.sum()  # touch every pixel, like a real consumer
+        if time.perf_counter() - self.start >= self.seconds:
+            raise StopStreaming()
+
+
+def run_asyncio(devices, seconds):
+    counter = Counter(seconds)
+    client = AsyncStreamingClient(consumers=[counter], stats_interval=0)
+    for device in devices:
+        for sensor_type in SENSOR_TYPES:
+            client.add_stream(
+                device.host,
+                sensor_type,
+                device=device.serial,
+                port=device.ports[sensor_type],
+            )
+    asyncio.run(client.run())
+    return counter
+
+
+def run_fleet(devices, seconds):
+    counter = Counter(seconds)
+    FleetIngest(devices, SENSOR_TYPES, stats_interval=0, log=None).start().run(
+        [counter]
+    )
+    return counter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", help="Emulated devices", default=8, type=int)
+    parser.add_argument("--seconds", help="Duration of each run", default=10.0, type=float)
+    parser.add_argument(
+        "--max_rate", help="Send frames back to back", action="store_true"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    devices, processes, stop_event, manager = start_devices(
+        args.devices, 0 if args.max_rate else None
+    )
+    if not args.max_rate:
+        print(f"==> [INFO] devices send {args.devices * 75} FPS in total")
+    try:
+        for name, run in [("asyncio", run_asyncio), ("fleet", run_fleet)]:
+            counter = run(devices, args.seconds)
+            elapsed = time.perf_counter() - counter.start
+            print(
+                f"==> [INFO] {name:<8} {args.devices} devices: "
+                f"{counter.frames / elapsed:8.1f} FPS "
+                f"{counter.bytes / elapsed / 1e6:8.1f} MB/s"
+            )
+    finally:
+        stop_event.set()
+        for process in processes:
+            process.join()
+        manager.shutdown()
@@ -0,0 +1,180 @@
+"""
+Timestamp gate of the clients: cost per frame, detection of duplicate,
+stale and missing frames served by a local ReplayServer, and the CPU saved
+by saving depth frames below the stream rate (`--save_rate`).
+
+The detection run serves 45 Hz depth frames whose Timestamps repeat, step
+back or skip ahead at scripted frames and compares the counts of the stream
+stats with the injected faults; a second stream drops from 30 to 15 Hz, so
+the lost frames should stay those injected after the drop. The CPU run
+saves colorized depth PNGs of a paced 45 Hz stream at full rate and at the
+given rates, and reports the process CPU time (receive loop and writer
+threads) per received frame.
+
+    python3 benchmarks/bench_frame_gate.py --frames 270 --rates 15 5
+"""
+import os, sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from async_client import AsyncStreamingClient, RateLimitedConsumer, SaveImageConsumer
+from frame_gate import FrameGate
+from pipeline import StopStreaming
+from replay_server import ReplayServer, SyntheticFrameSource
+from sensor_protocol import HEADER_PREFIX_STRUCT
+
+PERIOD = round(1e7 / 45.0)
+START = 133_000_000_000_000_000
+
+
+class FaultySource:
+    """
+    Synthetic depth frames at 45 Hz device time with scripted Timestamp
+    faults: every 50th frame repeats the previous Timestamp, every 70th
+    steps back one period and every 90th comes after 2 lost frames.
+    """
+
+    def __init__(self, frames) -> None:
+        self.source = SyntheticFrameSource("depth")
+        self.sensor_type = "depth"
+        self.timestamps = []
+        self.duplicates = self.stale = self.lost = 0
+        timestamp = START
+        for i in range(frames):
+            if i and i % 50 == 0:
+                self.duplicates += 1
+                self.timestamps.append(timestamp)
+                continue
+            if i and i % 70 == 0:
+                self.stale += 1
+                self.timestamps.append(timestamp - PERIOD)
+                continue
+            if i and i % 90 == 0:
+                self.lost += 2
+                timestamp += 2 * PERIOD
+            timestamp += PERIOD
+            self.timestamps.append(timestamp)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame(self, i, timestamp):
+        header, payload = self.source.frame(i, self.timestamps[i])
+        header = bytearray(header)
+        HEADER_PREFIX_STRUCT.pack_into(
+            header, 0, self.timestamps[i], *HEADER_PREFIX_STRUCT.unpack_from(header)[1:]
+        )
+        return header, payload
+
+
+class RateDropSource(FaultySource):
+    """
+    Synthetic depth frames at 30 Hz device time for `frames_before` frames,
+    then at 15 Hz, with 2 lost frames before every 90th frame.
+    """
+
+    def __init__(self, frames_before, frames_after) -> None:
+        super().__init__(0)
+        timestamp = START
+        for i in range(frames_before + frames_after):
+            period = round(1e7 / (30.0 if i < frames_before else 15.0))
+            if i % 90 == 89:
+                self.lost += 2
+                timestamp += 2 * period
+            timestamp += period
+            self.timestamps.append(timestamp)
+
+
+class StopAfter:
+    def __init__(self, frames=None, timestamp=None) -> None:
+        self.frames = frames
+        self.timestamp = timestamp
+        self.count = 0
+
+    def __call__(self, frame):
+        self.count += 1
+        if self.count == self.frames or frame.header.Timestamp == self.timestamp:
+            raise StopStreaming()
+
+
+def run_client(port, consumers):
+    client = AsyncStreamingClient(consumers=consumers, stats_interval=0)
+    stream = client.add_stream("127.0.0.1", "depth", port=port)
+    asyncio.run(client.run())
+    return stream.stats
+
+
+def served_gate_stats(source):
+    server = ReplayServer(source, host="127.0.0.1", port=0, fps=0, loop=False).start()
+    stats = run_client(server.port, [StopAfter(timestamp=source.timestamps[-1])])
+    server.stop()
+    return stats.gate
+
+
+def gate_cost(frames):
+    gate = FrameGate(rates={"save": 15.0, "record": None})
+    timestamps = [START + i * PERIOD for i in range(frames)]
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        if gate.admit(timestamp):
+            gate.due("save", timestamp)
+            gate.due("record", timestamp)
+    return (time.perf_counter() - start) / frames
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--frames", help="Frames per CPU measurement", default=270, type=int
+    )
+    parser.add_argument(
+        "--rates",
+        help="Save rates to compare with the full rate",
+        nargs="*",
+        default=[15.0, 5.0],
+        type=float,
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"==> [INFO] admit + 2 outputs: {gate_cost(100000) * 1e6:.2f} us/frame")
+
+    source = FaultySource(1000)
+    gate = served_gate_stats(source)
+    print("==> [INFO] Injected vs counted Timestamp faults")
+    print(f"  duplicates {source.duplicates:>4} {gate.duplicates:>6}")
+    print(f"  stale      {source.stale:>4} {gate.stale:>6}")
+    print(f"  lost       {source.lost:>4} {gate.lost:>6} (in {gate.gaps} gaps)")
+    source = RateDropSource(30, 300)
+    gate = served_gate_stats(source)
+    print("==> [INFO] Injected vs counted lost frames, 30 then 15 FPS")
+    print(f"  lost       {source.lost:>4} {gate.lost:>6} (in {gate.gaps} gaps)")
+
+    server = ReplayServer(SyntheticFrameSource("depth"), host="127.0.0.1", port=0)
+    server.start()
+    print(
+        f"==> [INFO] CPU per received frame saving colorized depth PNGs, "
+        f"{args.frames} frames at 45 FPS"
+    )
+    for rate in [None] + args.rates:
+        with tempfile.TemporaryDirectory() as folder:
+            consumer = SaveImageConsumer(folder, 2, 32, "block")
+            if rate:
+                consumer = RateLimitedConsumer(consumer, rate)
+            saved_before = time.process_time()
+            stats = run_client(server.port, [consumer, StopAfter(frames=args.frames)])
+            cpu = (time.process_time() - saved_before) / stats.frames
+            saved = sum(
+                name.endswith(".png") for _, _, names in os.walk(folder) for name in names
+            )
+        print(
+            f"  save rate {rate or 45.0:>5.1f} Hz: {cpu * 1e3:6.2f} ms CPU/frame, "
+            f"{saved} images"
+        )
+    server.stop()
@@ -0,0 +1,165 @@
+"""
+Loopback microbenchmark of the frame receive path.
+
+Compares the previous `data += data_chunk` receive loop against FrameReader
+on synthetic AHaT depth (512x512 uint16) or PV color (640x360 bgr8) frames
+served from a local thread.
+
+    python3 benchmarks/bench_frame_reader.py --sensor_type depth --frames 2000
+"""
+import os, sys
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_reader import FrameReader
+
+SYNTHETIC_FRAMES = {
+    "color": {
+        "header_format": "@qIIII20f",
+        "num_floats": 20,
+        "shape": (360, 640),
+        "pixel_stride": 3,
+    },
+    "depth": {
+        "header_format": "@qIIII16f",
+        "num_floats": 16,
+        "shape": (512, 512),
+        "pixel_stride": 2,
+    },
+}
+
+
+def build_frame(sensor_type):
+    frame = SYNTHETIC_FRAMES[sensor_type]
+    height, width = frame["shape"]
+    row_stride = width * frame["pixel_stride"]
+    header = struct.pack(
+        frame["header_format"],
+        0,
+        width,
+        height,
+        frame["pixel_stride"],
+        row_stride,
+        *([0.0] * frame["num_floats"]),
+    )
+    payload = os.urandom(height * row_stride)
+    return header, payload
+
+
+def serve_frames(server, frame_bytes, num_frames):
+    conn, _ = server.accept()
+    with conn:
+        for _ in range(num_frames):
+            conn.sendall(frame_bytes)
+
+
+def open_stream(frame_bytes, num_frames):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    thread = threading.Thread(
+        target=serve_frames, args=(server, frame_bytes, num_frames), daemon=True
+    )
+    thread.start()
+    client = socket.create_connection(server.getsockname())
+    return server, client, thread
+
+
+def legacy_receive(sock, data_size, counter):
+    # Receive loop used before FrameReader, kept here as the baseline
+    data = bytes()
+    while len(data) < data_size:
+        remaining_bytes = data_size - len(data)
+        data_chunk = sock.recv(remaining_bytes)
+        counter[0] += 1
+        if not data_chunk:
+            break
+        data += data_chunk
+    return data
+
+
+def run_legacy(client, header_size, payload_size, num_frames, trace):
+    peaks = []
+    recv_calls = [0]
+    for _ in range(num_frames):
+        if trace:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        header = legacy_receive(client, header_size, recv_calls)
+        payload = legacy_receive(client, payload_size, recv_calls)
+        if trace:
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        assert len(header) == header_size and len(payload) == payload_size
+        del header, payload
+    return peaks, recv_calls[0]
+
+
+def run_reader(client, header_size, payload_size, num_frames, trace):
+    reader = FrameReader(client, header_size, payload_size)
+    peaks = []
+    for _ in range(num_frames):
+        if trace:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        header = reader.read_header()
+        payload = reader.read_payload(payload_size)
+        if trace:
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        assert header is not None and payload is not None, reader.describe_status()
+    return peaks, reader.recv_calls
+
+
+def measure(name, runner, header, payload, num_frames, trace_frames):
+    frame_bytes = header + payload
+    server, client, thread = open_stream(frame_bytes, num_frames + trace_frames)
+    try:
+        start = time.perf_counter()
+        _, recv_calls = runner(client, len(header), len(payload), num_frames, False)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        peaks, _ = runner(client, len(header), len(payload), trace_frames, True)
+        tracemalloc.stop()
+    finally:
+        client.close()
+        server.close()
+        thread.join()
+
+    mb_per_sec = num_frames * len(frame_bytes) / elapsed / 1e6
+    print(
+        f"{name:<12} {mb_per_sec:>10.1f} MB/s {num_frames / elapsed:>10.1f} FPS "
+        f"{sum(peaks) / len(peaks) / 1024:>10.1f} KiB allocated/frame "
+        f"{recv_calls / num_frames:>6.1f} recv/frame"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sensor_type", choices=["color", "depth"], default="depth", type=str
+    )
+    parser.add_argument("--frames", help="Frames per timed run", default=2000, type=int)
+    parser.add_argument(
+        "--trace_frames",
+        help="Frames per allocation-traced run",
+        default=200,
+        type=int,
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    header, payload = build_frame(args.sensor_type)
+    print(
+        f"==> [INFO] {args.sensor_type} frames: {len(header)} B header + "
+        f"{len(payload)} B payload"
+    )
+    measure("legacy", run_legacy, header, payload, args.frames, args.trace_frames)
+    measure("FrameReader", run_reader, header, payload, args.frames, args.trace_frames)
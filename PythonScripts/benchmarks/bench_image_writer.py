@@ -0,0 +1,125 @@
+"""
+Achieved FPS of the depth receive loop with --save_image off, inline
+`cv2.imwrite` and AsyncImageWriter, against a synthetic 45 FPS AHaT source.
+
+The source behaves like the HoloLens streamer: a frame that cannot be sent on
+time because the client is not draining the socket is skipped.
+
+    python3 benchmarks/bench_image_writer.py --seconds 10 --save_policy drop_oldest
+"""
+import os, sys
+import socket
+import threading
+import time
+import tempfile
+import argparse
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_reader import FrameReader
+from image_writer import AsyncImageWriter
+from sensor_protocol import SensorFrameHeader
+from worker_pool import BACKPRESSURE_POLICIES
+from bench_frame_reader import build_frame
+
+CV_ALPHA = 255 / 2000.0
+
+
+def serve_paced(server, frame_bytes, fps, seconds, result):
+    conn, _ = server.accept()
+    period = 1.0 / fps
+    sent = skipped = 0
+    with conn:
+        start = next_time = time.perf_counter()
+        while next_time - start < seconds:
+            now = time.perf_counter()
+            if now < next_time:
+                time.sleep(next_time - now)
+            elif now - next_time > period:
+                # the camera does not wait for a slow client
+                skipped += 1
+                next_time += period
+                continue
+            conn.sendall(frame_bytes)
+            sent += 1
+            next_time += period
+    result["sent"] = sent
+    result["skipped"] = skipped
+
+
+def run(mode, frame_bytes, header_size, args):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    source = {}
+    thread = threading.Thread(
+        target=serve_paced,
+        args=(server, frame_bytes, args.fps, args.seconds, source),
+        daemon=True,
+    )
+    thread.start()
+    client = socket.create_connection(server.getsockname())
+    # keep the kernel buffer small so a slow consumer stalls the source
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, len(frame_bytes))
+
+    output_folder = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    writer = None
+    if mode == "async":
+        writer = AsyncImageWriter(args.save_workers, args.save_queue_size, args.save_policy)
+
+    header = SensorFrameHeader("depth")
+    reader = FrameReader(client, header_size)
+    received = 0
+    start = time.perf_counter()
+    while True:
+        header_data = reader.read_header()
+        if header_data is None:
+            break
+        header.decode(header_data)
+        image_data = reader.read_payload(header.image_size)
+        if image_data is None:
+            break
+        image = cv2.applyColorMap(
+            cv2.convertScaleAbs(header.image_view(image_data), alpha=CV_ALPHA),
+            cv2.COLORMAP_JET,
+        )
+        file_path = os.path.join(output_folder, f"depth_{received}.png")
+        if mode == "inline":
+            cv2.imwrite(file_path, image)
+        elif mode == "async":
+            writer.submit(file_path, image, copy=False)
+        received += 1
+    elapsed = time.perf_counter() - start
+    client.close()
+    server.close()
+    thread.join()
+
+    line = (
+        f"{mode:<8} {received / elapsed:>7.1f} FPS received "
+        f"{source['skipped']:>5d} frames skipped at source"
+    )
+    if writer is not None:
+        writer.close()
+        line += f"\n         writer {writer.stats()}"
+    print(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fps", help="Source frame rate", default=45.0, type=float)
+    parser.add_argument("--seconds", help="Duration of each run", default=10.0, type=float)
+    parser.add_argument("--save_workers", default=2, type=int)
+    parser.add_argument("--save_queue_size", default=32, type=int)
+    parser.add_argument(
+        "--save_policy", choices=BACKPRESSURE_POLICIES, default="block", type=str
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    header, payload = build_frame("depth")
+    print(f"==> [INFO] Synthetic depth source at {args.fps} FPS for {args.seconds}s")
+    for mode in ["off", "inline", "async"]:
+        run(mode, header + payload, len(header), args)
@@ -0,0 +1,101 @@
+"""
+Offline export of synthetic color (30 FPS) and depth (45 FPS) recordings to
+the TUM RGB-D layout, in this process and on worker pools, reported as
+milliseconds per frame and as a multiple of the recorded duration. Also
+checks the depth recovered from colorized `--save_image` PNGs and, when the
+ROS Python packages are installed, times the rosbag export.
+
+    python3 benchmarks/bench_offline_export.py --seconds 10 --workers 0 1 4
+"""
+import os, sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_recorder import FrameRecorder
+from frame_viewer import colorize_depth, decolorize_depth, depth_colormap_lut
+from offline_export import OfflineExporter, open_recording
+from point_cloud import pinhole_lut
+from replay_server import SyntheticFrameSource
+
+START = 133_000_000_000_000_000
+FPS = {"color": 30.0, "depth": 45.0}
+
+
+def record(folder, seconds):
+    paths = []
+    for sensor_type, fps in FPS.items():
+        source = SyntheticFrameSource(sensor_type)
+        path = os.path.join(folder, f"{sensor_type}.hl2rec")
+        with FrameRecorder(path, sensor_type) as recorder:
+            for i in range(int(seconds * fps)):
+                timestamp = START + round(i * 1e7 / fps)
+                recorder.write(*source.frame(i % len(source), timestamp))
+        paths.append(path)
+    return paths
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--seconds", help="Duration of the recordings", default=10.0, type=float
+    )
+    parser.add_argument(
+        "--workers",
+        help="Worker processes to compare, 0 converts in this process",
+        nargs="*",
+        default=[0, 1, os.cpu_count()],
+        type=int,
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    depth = np.random.default_rng(0).integers(0, 1990, (512, 512)).astype(np.uint16)
+    colorized = colorize_depth(depth, depth_colormap_lut())[:, :, :3]
+    error = np.abs(decolorize_depth(colorized).astype(int) - depth).max()
+    print(f"==> [INFO] Depth recovered from colorized PNGs: {error} mm max error")
+
+    with tempfile.TemporaryDirectory() as folder:
+        streams = [open_recording(path) for path in record(folder, args.seconds)]
+        print(
+            f"==> [INFO] {args.seconds:.0f} s of color and depth, "
+            f"{sum(len(stream) for stream in streams)} frames, TUM RGB-D layout "
+            f"({os.cpu_count()} CPUs)"
+        )
+        for layout, options in (("PNG", {}), ("JPEG rgb", {"rgb_format": "jpg"})):
+            for workers in sorted(set(args.workers)):
+                exporter = OfflineExporter(
+                    streams, depth_lut=pinhole_lut(), workers=workers
+                )
+                output = os.path.join(folder, f"tum_{layout}_{workers}")
+                start = time.perf_counter()
+                exporter.write_tum(output, **options)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"  {layout:<8} {workers:>2} workers: "
+                    f"{elapsed / exporter.frames * 1e3:6.2f} ms/frame, "
+                    f"{exporter.duration / elapsed:5.1f}x real time"
+                )
+
+        exporter = OfflineExporter(
+            streams,
+            depth_lut=pinhole_lut(),
+            point_clouds=True,
+            workers=max(args.workers),
+        )
+        start = time.perf_counter()
+        try:
+            counts = exporter.write_bag(os.path.join(folder, "export.bag"))
+        except ImportError as error:
+            print(f"==> [INFO] rosbag export skipped: {error}")
+        else:
+            elapsed = time.perf_counter() - start
+            print(
+                f"==> [INFO] rosbag with point clouds: {sum(counts.values())} "
+                f"messages, {exporter.duration / elapsed:.1f}x real time"
+            )
@@ -0,0 +1,107 @@
+"""
+Throughput and latency of a pipeline saving colorized depth PNGs on the
+inline, thread and process executors, fed as fast as it takes frames from a
+synthetic AHaT depth recording.
+
+`push` is the time the source spends handing over one frame, the budget a
+receive loop loses per frame; `service` the time spent in the stage and
+`latency` the time from entering the pipeline to the end of the stage. The
+process executor only scales with free cores: on a single core it shows the
+cost of the shared memory hand-off, not a speedup.
+
+    python3 benchmarks/bench_pipeline.py --frames 300
+"""
+import os, sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from frame_recorder import FrameRecorder
+from pipeline import Pipeline, RecordingSource, SaveImageStage, Stage
+from replay_server import SyntheticFrameSource
+
+CONFIGURATIONS = [
+    ("inline", "inline", 1),
+    ("thread x1", "thread", 1),
+    ("thread x2", "thread", 2),
+    ("process x1", "process", 1),
+    ("process x2", "process", 2),
+]
+
+
+def write_recording(file_path, frames):
+    source = SyntheticFrameSource("depth")
+    with FrameRecorder(file_path, "depth") as recorder:
+        for i in range(frames):
+            header, payload = source.frame(i, 133_000_000_000_000_000 + i * 222_222)
+            recorder.write(header, payload)
+
+
+class TimedSource:
+    """
+    RecordingSource timing how long every frame takes to be handed over.
+    """
+
+    def __init__(self, file_path) -> None:
+        self.source = RecordingSource(file_path)
+        self.push = 0.0
+
+    def __iter__(self):
+        for frame in self.source:
+            start = time.perf_counter()
+            yield frame
+            self.push += time.perf_counter() - start
+
+
+def measure(file_path, output_folder, executor, workers, queue_size):
+    stage = Stage(
+        SaveImageStage(output_folder),
+        name="save_image",
+        executor=executor,
+        workers=workers,
+        queue_size=queue_size,
+    )
+    pipeline = Pipeline([stage], report_interval=0)
+    source = TimedSource(file_path)
+    start = time.perf_counter()
+    pipeline.run(source)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(output_folder)
+    return pipeline.frames / elapsed, source.push / pipeline.frames, stage.stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Frames per configuration", default=300, type=int)
+    parser.add_argument(
+        "--queue_size", help="Frames queued in front of the stage", default=8, type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = os.path.join(folder, "depth.hl2rec")
+        write_recording(file_path, args.frames)
+        print(
+            f"==> [INFO] {args.frames} depth frames saved as colorized PNG, "
+            f"{os.cpu_count()} CPUs"
+        )
+        print(
+            f"  {'executor':<12} {'FPS':>7} {'push':>9} {'service':>9} "
+            f"{'p50':>9} {'p99':>9}"
+        )
+        for name, executor, workers in CONFIGURATIONS:
+            fps, push, stats = measure(
+                file_path, os.path.join(folder, "out"), executor, workers, args.queue_size
+            )
+            print(
+                f"  {name:<12} {fps:>7.1f} {push * 1e3:>7.2f}ms "
+                f"{stats.service.mean * 1e3:>7.2f}ms "
+                f"{stats.latency.percentile(0.5) * 1e3:>7.1f}ms "
+                f"{stats.latency.percentile(0.99) * 1e3:>7.1f}ms"
+            )
@@ -0,0 +1,92 @@
+"""
+Point cloud throughput on synthetic 512x512 AHaT depth frames.
+
+Compares a per-pixel Python loop (timed on one frame) and a straightforward
+NumPy version gathering (N,3) rays against DepthUnprojector, with the
+rig2world @ depth2rig transform applied, at several strides.
+
+    python3 benchmarks/bench_point_cloud.py --frames 200
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from point_cloud import AHAT_INVALID_DEPTH, DepthUnprojector, pinhole_lut
+from replay_server import SyntheticFrameSource
+from sensor_protocol import SensorFrameHeader, unix_to_filetime
+
+TARGET_FPS = 45.0
+
+
+def depth_frames():
+    source = SyntheticFrameSource("depth")
+    frames = []
+    for i in range(len(source)):
+        header_data, payload = source.frame(i, unix_to_filetime(time.time()))
+        header = SensorFrameHeader("depth")
+        header.decode(header_data)
+        frames.append((header.image_view(payload), header.pose.copy()))
+    return frames
+
+
+def python_loop(lut, depth, transform):
+    points = []
+    for v in range(depth.shape[0]):
+        for u in range(depth.shape[1]):
+            d = int(depth[v, u, 0])
+            if 0 < d < AHAT_INVALID_DEPTH:
+                x, y, z = lut[v, u] * (d / 1000.0)
+                points.append(
+                    [
+                        transform[r, 0] * x
+                        + transform[r, 1] * y
+                        + transform[r, 2] * z
+                        + transform[r, 3]
+                        for r in range(3)
+                    ]
+                )
+    return np.array(points, dtype=np.float32)
+
+
+def numpy_rows(lut, depth, transform):
+    rays = lut.reshape(-1, 3)
+    raw = depth.ravel()
+    valid = (raw > 0) & (raw < AHAT_INVALID_DEPTH)
+    points = rays[valid] * (raw[valid] / 1000.0)[:, None]
+    return (points @ transform[:3, :3].T + transform[:3, 3]).astype(np.float32)
+
+
+def measure(name, function, frames, count):
+    start = time.perf_counter()
+    for i in range(count):
+        depth, transform = frames[i % len(frames)]
+        points = function(depth, transform)
+    elapsed = (time.perf_counter() - start) / count
+    print(
+        f"==> [INFO] {name:<24} {elapsed * 1e3:8.2f} ms/frame {1 / elapsed:8.1f} FPS "
+        f"{len(points):>7} points {'ok' if 1 / elapsed >= TARGET_FPS else 'SLOW'}"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Frames per measurement", default=200, type=int)
+    parser.add_argument(
+        "--skip_loop", help="Skip the per-pixel Python loop", action="store_true"
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    lut = pinhole_lut()
+    frames = depth_frames()
+    if not args.skip_loop:
+        measure("python loop", lambda d, t: python_loop(lut, d, t), frames, 1)
+    measure("numpy (N,3) gather", lambda d, t: numpy_rows(lut, d, t), frames, args.frames)
+    for stride in (1, 2, 4):
+        unprojector = DepthUnprojector(lut, stride=stride)
+        measure(f"DepthUnprojector stride={stride}", unprojector.unproject, frames, args.frames)
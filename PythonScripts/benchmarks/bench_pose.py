@@ -0,0 +1,83 @@
+"""
+Per-frame cost of the publisher pose pipeline (header pose to ROS TF
+translation and quaternion), before and after folding the constant factors
+and dropping the per-frame scipy Rotation, plus the batch trajectory path.
+
+    python3 benchmarks/bench_pose.py --frames 20000
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pose_utils import (
+    HOLO_PV_TO_ROS_CAM,
+    HOLO_WORLD_TO_ROS_WORLD,
+    matrix_to_quaternion,
+    ros_camera_chain,
+    trajectory_to_tf,
+    transform_to_tf,
+)
+from replay_server import SyntheticFrameSource
+
+try:
+    from scipy.spatial.transform import Rotation as Rot
+except ImportError:
+    Rot = None
+
+
+def legacy_pose(pose):
+    cam2world = np.matmul(
+        HOLO_WORLD_TO_ROS_WORLD, np.matmul(pose, HOLO_PV_TO_ROS_CAM)
+    )
+    trans = cam2world[:3, 3]
+    quat = Rot.from_matrix(cam2world[:3, :3]).as_quat()
+    return trans, quat
+
+
+def measure(name, function, poses):
+    start = time.perf_counter()
+    for pose in poses:
+        function(pose)
+    elapsed = (time.perf_counter() - start) / len(poses)
+    print(f"==> [INFO] {name:<28} {elapsed * 1e6:8.2f} us/frame")
+    return elapsed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Poses per measurement", default=20000, type=int)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    source = SyntheticFrameSource("color", num_frames=1)
+    poses = np.stack([source.pose(i / 30.0) for i in range(args.frames)])
+    chain = ros_camera_chain("color")
+
+    if Rot is not None:
+        before = measure("matmul x2 + scipy Rotation", legacy_pose, poses)
+    else:
+        before = None
+        print("==> [INFO] scipy is not installed, skipping the previous pipeline")
+    after = measure(
+        "PoseChain + transform_to_tf",
+        lambda pose: transform_to_tf(chain.apply(pose)),
+        poses,
+    )
+    measure(
+        "  matrix_to_quaternion only", lambda pose: matrix_to_quaternion(pose), poses
+    )
+    if before is not None:
+        print(f"==> [INFO] per-frame speedup {before / after:.1f}x")
+
+    start = time.perf_counter()
+    translations, quaternions = trajectory_to_tf(poses, chain)
+    elapsed = time.perf_counter() - start
+    print(
+        f"==> [INFO] {'trajectory_to_tf (batch)':<28} {elapsed / len(poses) * 1e6:8.2f} "
+        f"us/frame ({len(poses)} poses in {elapsed * 1e3:.1f} ms)"
+    )
@@ -0,0 +1,108 @@
+"""
+Accuracy and cost of the publisher TF pose filter on a noisy synthetic
+trajectory: the orbiting pose of the replay server sampled at the 45 Hz
+depth rate with jittered frame times, 2 mm translation noise and 0.3 degree
+rotation noise.
+
+Errors are measured against the true pose at the stamp each configuration
+publishes, so a predicted pose is compared with where the device is
+`prediction` seconds after the frame. The offline `filter_trajectory` is
+checked against the per-frame PoseFilter.
+
+    python3 benchmarks/bench_pose_filter.py --frames 4500
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pose_filter import PoseFilter, filter_trajectory
+from pose_utils import quaternion_to_matrix, ros_camera_chain, trajectory_to_tf
+from replay_server import SyntheticFrameSource
+
+CONFIGURATIONS = [
+    ("raw", 0.0, None),
+    ("smoothing 30ms", 0.03, None),
+    ("smoothing 30ms, lag 0", 0.03, 0.0),
+    ("prediction 20ms", 0.0, 0.02),
+    ("smoothing 30ms + 20ms", 0.03, 0.02),
+    ("smoothing 60ms + 20ms", 0.06, 0.02),
+]
+FPS = 45.0
+
+
+def true_trajectory(source, chain, timestamps):
+    poses = np.stack([source.pose(timestamp * 1e-7) for timestamp in timestamps])
+    return trajectory_to_tf(poses, chain)
+
+
+def noisy_trajectory(source, chain, timestamps, rng):
+    poses = np.stack([source.pose(timestamp * 1e-7) for timestamp in timestamps])
+    poses[:, :3, 3] += rng.normal(0, 0.002, (len(poses), 3))
+    for pose in poses:
+        axis = rng.normal(0, np.radians(0.3) / 2, 3)
+        noise = np.append(axis, 1.0)
+        pose[:3, :3] = pose[:3, :3] @ quaternion_to_matrix(noise / np.linalg.norm(noise))
+    return trajectory_to_tf(poses, chain)
+
+
+def errors(translations, quaternions, truth):
+    """
+    :returns: (RMS translation error in mm, RMS rotation error in degrees)
+    """
+    true_translations, true_quaternions = truth
+    distance = np.linalg.norm(translations - true_translations, axis=-1)
+    dot = np.abs(np.einsum("ij,ij->i", quaternions, true_quaternions))
+    angle = 2 * np.degrees(np.arccos(np.minimum(dot, 1.0)))
+    return np.sqrt(np.mean(distance**2)) * 1e3, np.sqrt(np.mean(angle**2))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Poses of the trajectory", default=4500, type=int)
+    parser.add_argument("--window", help="Ring size of the filter", default=8, type=int)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    source = SyntheticFrameSource("depth", num_frames=1)
+    chain = ros_camera_chain("color")
+    steps = rng.normal(1e7 / FPS, 1e7 / FPS * 0.1, args.frames).astype(np.int64)
+    timestamps = 133_000_000_000_000_000 + np.cumsum(steps)
+    translations, quaternions = noisy_trajectory(source, chain, timestamps, rng)
+    samples = list(zip(timestamps.tolist(), translations.tolist(), quaternions.tolist()))
+
+    print(
+        f"==> [INFO] {args.frames} poses at {FPS:.0f} Hz, window {args.window}, "
+        "errors against the true pose at the published stamp"
+    )
+    print(
+        f"  {'configuration':<24} {'trans RMS':>10} {'rot RMS':>9} "
+        f"{'update':>9} {'offline':>9} {'offline diff':>12}"
+    )
+    for name, smoothing, prediction in CONFIGURATIONS:
+        pose_filter = PoseFilter(smoothing, prediction, window=args.window)
+        start = time.perf_counter()
+        online = [pose_filter.update(*sample) for sample in samples]
+        update = (time.perf_counter() - start) / len(samples)
+
+        start = time.perf_counter()
+        stamps, filtered_translations, filtered_quaternions = filter_trajectory(
+            timestamps, translations, quaternions, smoothing, prediction, args.window
+        )
+        offline = (time.perf_counter() - start) / len(samples)
+        diff = max(
+            np.abs(np.array([pose[1] for pose in online]) - filtered_translations).max(),
+            np.abs(np.array([pose[2] for pose in online]) - filtered_quaternions).max(),
+        )
+
+        truth = true_trajectory(source, chain, stamps)
+        trans_error, rot_error = errors(filtered_translations, filtered_quaternions, truth)
+        print(
+            f"  {name:<24} {trans_error:>8.2f}mm {rot_error:>7.3f}deg "
+            f"{update * 1e6:>7.1f}us {offline * 1e6:>7.2f}us {diff:>12.1e}"
+        )
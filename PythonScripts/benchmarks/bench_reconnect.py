@@ -0,0 +1,197 @@
+"""
+Recovery time of a depth stream after connection faults, injected by a TCP
+proxy between a replay server and the asyncio client:
+
+  * cut:    the proxy closes the connection
+  * drop:   the proxy swallows bytes in the middle of a frame, so the next
+            header is read at a wrong offset (stream out of sync)
+  * outage: the proxy stops listening for a while, as a rebooting device
+
+Compares the exponential backoff with a fixed 3 s retry delay (the previous
+behavior), and reports the gap until the next frame after each fault.
+
+    python3 benchmarks/bench_reconnect.py --rounds 3
+"""
+import os, sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from async_client import AsyncStreamingClient, StopStreaming
+from connection import Backoff
+from replay_server import ReplayServer, SyntheticFrameSource
+
+FPS = 45.0
+
+
+class FaultProxy:
+    """
+    Forward one port to the replay server, with injectable faults.
+    """
+
+    def __init__(self, upstream_port) -> None:
+        self.upstream_port = upstream_port
+        self.port = None
+        self.connections = []
+        self._drop = 0
+        self._lock = threading.Lock()
+        self._listen()
+
+    def _listen(self):
+        self.server = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", self.port or 0))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._accept, args=(self.server,), daemon=True).start()
+
+    def _accept(self, server):
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self.upstream_port))
+            with self._lock:
+                self.connections.append((client, upstream))
+            threading.Thread(
+                target=self._pump, args=(upstream, client), daemon=True
+            ).start()
+
+    def _pump(self, upstream, client):
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        try:
+            while True:
+                nbytes = upstream.recv_into(buffer)
+                if nbytes == 0:
+                    break
+                start = 0
+                with self._lock:
+                    if self._drop:
+                        start = min(self._drop, nbytes)
+                        self._drop -= start
+                client.sendall(view[start:nbytes])
+        except OSError:
+            pass
+        finally:
+            client.close()
+            upstream.close()
+
+    def cut(self):
+        with self._lock:
+            connections, self.connections = self.connections, []
+        for client, upstream in connections:
+            for sock in (client, upstream):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+
+    def drop(self, nbytes):
+        with self._lock:
+            self._drop = nbytes
+
+    def outage(self, seconds):
+        # shutdown wakes up the accept thread, close alone does not
+        self.server.shutdown(socket.SHUT_RDWR)
+        self.server.close()
+        self.cut()
+        time.sleep(seconds)
+        self._listen()
+
+
+class ArrivalLog:
+    def __init__(self) -> None:
+        self.times = []
+        self.stop = False
+
+    def __call__(self, frame):
+        self.times.append(time.perf_counter())
+        if self.stop:
+            raise StopStreaming()
+
+    def gap_after(self, moment):
+        """
+        :returns: seconds from `moment` to the first frame after it
+        """
+        for arrival in self.times:
+            if arrival > moment:
+                return arrival - moment
+        return float("nan")
+
+
+async def run_faults(client, proxy, log, rounds, outage):
+    await asyncio.sleep(1.0)
+    results = {"cut": [], "drop": [], "outage": []}
+    for _ in range(rounds):
+        moment = time.perf_counter()
+        proxy.cut()
+        await asyncio.sleep(1.0)
+        results["cut"].append(log.gap_after(moment))
+
+        moment = time.perf_counter()
+        proxy.drop(1000)
+        await asyncio.sleep(1.0)
+        results["drop"].append(log.gap_after(moment))
+
+        await asyncio.get_running_loop().run_in_executor(None, proxy.outage, outage)
+        moment = time.perf_counter()
+        await asyncio.sleep(4.0)
+        results["outage"].append(log.gap_after(moment))
+    log.stop = True
+    return results
+
+
+def measure(name, backoff, upstream_port, rounds, outage):
+    proxy = FaultProxy(upstream_port)
+    log = ArrivalLog()
+    client = AsyncStreamingClient(consumers=[log], stats_interval=0)
+    stream = client.add_stream("127.0.0.1", "depth", port=proxy.port)
+    stream.connection.backoff = backoff
+    stream.connection.log_info = stream.connection.log_error = lambda message: None
+
+    async def main():
+        _, results = await asyncio.gather(
+            client.run(), run_faults(client, proxy, log, rounds, outage)
+        )
+        return results
+
+    results = asyncio.run(main())
+    proxy.cut()
+    proxy.server.close()
+    return stream.stats.connection, results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", help="Faults of each kind", default=3, type=int)
+    parser.add_argument(
+        "--outage", help="Seconds the proxy stops listening", default=1.5, type=float
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = ReplayServer(
+        SyntheticFrameSource("depth"), host="127.0.0.1", port=0, fps=FPS
+    ).start()
+    for name, backoff in (
+        ("fixed 3 s delay", Backoff(initial=3.0, maximum=3.0, jitter=0.0)),
+        ("exponential backoff", Backoff()),
+    ):
+        stats, results = measure(name, backoff, server.port, args.rounds, args.outage)
+        print(f"==> [INFO] {name}")
+        for fault, gaps in results.items():
+            print(
+                f"  * {fault:<6} gap to next frame "
+                + " / ".join(f"{gap * 1e3:7.1f}ms" for gap in gaps)
+            )
+        print(f"  * connection {stats.to_dict()}")
+    server.stop()
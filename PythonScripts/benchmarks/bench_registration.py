@@ -0,0 +1,119 @@
+"""
+Depth-to-color registration throughput on synthetic 512x512 AHaT frames
+projected into a 640x360 PV image.
+
+Compares a straightforward NumPy version (per-frame ray normalization,
+(N,3) transform, z-buffer by sorting) against DepthRegistration, and checks
+that both produce the same registered depth.
+
+    python3 benchmarks/bench_registration.py --frames 200
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from point_cloud import AHAT_INVALID_DEPTH, pinhole_lut
+from pose_utils import HOLO_PV_TO_ROS_CAM
+from registration import PV_HEIGHT, PV_WIDTH, DepthRegistration
+from replay_server import SyntheticFrameSource
+from sensor_protocol import SensorFrameHeader, unix_to_filetime
+
+TARGET_FPS = 30.0
+# the synthetic streams share one pose, flip the depth camera to look along
+# the PV viewing direction so the points land in the PV image
+SYNTHETIC_RIG2DEPTH = HOLO_PV_TO_ROS_CAM
+
+
+def synthetic_frames():
+    depth_source = SyntheticFrameSource("depth")
+    color_source = SyntheticFrameSource("color", num_frames=1)
+    color = SensorFrameHeader("color")
+    frames = []
+    for i in range(len(depth_source)):
+        timestamp = unix_to_filetime(time.time()) + i * 222222
+        header = SensorFrameHeader("depth")
+        header_data, payload = depth_source.frame(i, timestamp)
+        header.decode(header_data)
+        color.decode(color_source.frame(0, timestamp)[0])
+        frames.append(
+            (
+                header.image_view(payload),
+                header.pose.copy(),
+                header.pose.copy(),
+                color.intrinsics.copy(),
+            )
+        )
+    return frames
+
+
+def numpy_sorted(raw_lut, rig2depth, depth, rig2world, pv2world, intrinsics):
+    fx, fy, cx, cy = intrinsics
+    rays = raw_lut.reshape(-1, 3) / np.linalg.norm(raw_lut.reshape(-1, 3), axis=1)[:, None]
+    raw = depth.ravel()
+    valid = (raw > 0) & (raw < AHAT_INVALID_DEPTH)
+    points = rays[valid] * (raw[valid] / 1000.0)[:, None]
+    transform = (
+        HOLO_PV_TO_ROS_CAM @ np.linalg.inv(pv2world) @ rig2world @ np.linalg.inv(rig2depth)
+    )
+    points = points @ transform[:3, :3].T + transform[:3, 3]
+    points = points[points[:, 2] > 0]
+    u = np.floor(points[:, 0] / points[:, 2] * fx + cx + 0.5).astype(np.int64)
+    v = np.floor(points[:, 1] / points[:, 2] * fy + cy + 0.5).astype(np.int64)
+    inside = (u >= 0) & (u < PV_WIDTH) & (v >= 0) & (v < PV_HEIGHT)
+    z = np.minimum(points[inside, 2] * 1000, 65534).astype(np.uint16)
+    index = v[inside] * PV_WIDTH + u[inside]
+    # farthest first, so the nearest point is written last
+    order = np.argsort(z)[::-1]
+    registered = np.zeros(PV_HEIGHT * PV_WIDTH, dtype=np.uint16)
+    registered[index[order]] = z[order]
+    return registered.reshape(PV_HEIGHT, PV_WIDTH)
+
+
+def measure(name, function, frames, count):
+    start = time.perf_counter()
+    for i in range(count):
+        registered = function(*frames[i % len(frames)])
+    elapsed = (time.perf_counter() - start) / count
+    coverage = np.count_nonzero(registered) / registered.size
+    print(
+        f"==> [INFO] {name:<30} {elapsed * 1e3:7.2f} ms/frame {1 / elapsed:7.1f} FPS "
+        f"{coverage * 100:5.1f}% PV pixels {'ok' if 1 / elapsed >= TARGET_FPS else 'SLOW'}"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Frames per measurement", default=200, type=int)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    lut = pinhole_lut()
+    frames = synthetic_frames()
+
+    registration = DepthRegistration(lut, SYNTHETIC_RIG2DEPTH)
+    reference = numpy_sorted(lut, SYNTHETIC_RIG2DEPTH, *frames[0])
+    registered = registration.register(*frames[0])
+    mismatched = np.count_nonzero(reference != registered)
+    print(f"==> [INFO] {mismatched} pixels differ from the sorted z-buffer")
+
+    measure(
+        "numpy sorted z-buffer",
+        lambda *frame: numpy_sorted(lut, SYNTHETIC_RIG2DEPTH, *frame),
+        frames,
+        max(args.frames // 10, 1),
+    )
+    for stride, splat in ((1, 1), (1, 2), (1, 3), (2, 3)):
+        registration = DepthRegistration(
+            lut, SYNTHETIC_RIG2DEPTH, stride=stride, splat=splat
+        )
+        measure(
+            f"DepthRegistration stride={stride} splat={splat}",
+            registration.register,
+            frames,
+            args.frames,
+        )
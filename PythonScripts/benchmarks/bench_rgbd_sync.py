@@ -0,0 +1,101 @@
+"""
+Cost per frame, match rate and pose interpolation error of RGBDSynchronizer
+on synthetic 30 FPS color and 45 FPS depth streams with timestamp jitter
+and a depth arrival delay, plus a depth stall to show the queues stay
+bounded.
+
+    python3 benchmarks/bench_rgbd_sync.py --seconds 60
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from replay_server import SyntheticFrameSource
+from rgbd_sync import TICKS_PER_MS, RGBDSynchronizer
+from sensor_protocol import unix_to_filetime
+
+
+def stream_events(seconds, jitter_ms, depth_delay_ms, stall=None):
+    """
+    :returns: (arrival order sorted) list of (timestamp, sensor_type, index)
+    """
+    rng = np.random.default_rng(0)
+    start = unix_to_filetime(time.time())
+    jitter = int(jitter_ms * TICKS_PER_MS)
+    events = []
+    for sensor_type, fps in (("color", 30), ("depth", 45)):
+        for i in range(int(seconds * fps)):
+            timestamp = start + int(i / fps * 1e7)
+            timestamp += int(rng.integers(-jitter, jitter + 1))
+            if stall and sensor_type == "depth" and stall[0] <= i / fps < stall[1]:
+                continue
+            events.append((timestamp, sensor_type, i))
+    delay = int(depth_delay_ms * TICKS_PER_MS)
+    events.sort(key=lambda event: event[0] + (delay if event[1] == "depth" else 0))
+    return events
+
+
+def run(name, events, sources, args):
+    # headers carry the pose at their timestamp, packed before timing
+    frames = [
+        (sensor_type, *sources[sensor_type].frame(i, timestamp))
+        for timestamp, sensor_type, i in events
+    ]
+    synchronizer = RGBDSynchronizer(args.tolerance_ms, args.queue_size)
+    pose = sources["depth"].pose
+    errors = []
+    max_queued = 0
+    start = time.perf_counter()
+    for sensor_type, header, payload in frames:
+        for pair in synchronizer.push(sensor_type, header, payload):
+            expected = pose(pair.timestamp * 1e-7)
+            errors.append(np.abs(pair.rig2world[:3, 3] - expected[:3, 3]).max())
+        max_queued = max(
+            max_queued, len(synchronizer.color_queue), len(synchronizer.depth_queue)
+        )
+    elapsed = time.perf_counter() - start
+    stats = synchronizer.stats()
+    num_colors = sum(1 for event in events if event[1] == "color")
+    print(
+        f"==> [INFO] {name:<8} {elapsed / len(events) * 1e6:7.1f} us/frame, "
+        f"{stats['pairs']}/{num_colors} color frames paired, offset "
+        f"{stats['offset_ms_avg']:.2f} ms avg, max queued {max_queued}, "
+        f"interpolated rig2world error {max(errors, default=0) * 1e3:.2f} mm"
+    )
+    print(f"  * {stats}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", help="Stream duration", default=60, type=float)
+    parser.add_argument("--jitter_ms", help="Timestamp jitter", default=0.5, type=float)
+    parser.add_argument(
+        "--depth_delay_ms", help="Depth arrival delay", default=30.0, type=float
+    )
+    parser.add_argument("--tolerance_ms", default=15.0, type=float)
+    parser.add_argument("--queue_size", default=16, type=int)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sources = {
+        "color": SyntheticFrameSource("color", num_frames=4),
+        "depth": SyntheticFrameSource("depth", num_frames=4),
+    }
+    run(
+        "steady",
+        stream_events(args.seconds, args.jitter_ms, args.depth_delay_ms),
+        sources,
+        args,
+    )
+    stall = (args.seconds / 3, 2 * args.seconds / 3)
+    run(
+        "stall",
+        stream_events(args.seconds, args.jitter_ms, args.depth_delay_ms, stall),
+        sources,
+        args,
+    )
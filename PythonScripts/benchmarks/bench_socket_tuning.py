@@ -0,0 +1,160 @@
+"""
+Receive syscalls and frame latency of the socket tuning options: a local
+sender streams AHaT depth frames at 45 FPS to a FrameReader, once per
+configuration. Frames are sent in `--chunk` byte pieces paced at
+`--link_mbps`, like a WiFi link delivers them; loopback would otherwise
+hand over a whole frame in a few large segments.
+
+Latency is measured from the header Timestamp (stamped when the frame
+starts being sent) to the last payload byte received, so it includes the
+transmission time at the link rate. `--load` adds busy processes competing
+for the CPU, where receive jitter shows up.
+
+SO_BUSY_POLL only acts on NIC queues, so on loopback it is expected to
+change nothing; it is listed to show its cost is zero when unused.
+
+    python3 benchmarks/bench_socket_tuning.py --frames 450 --link_mbps 300
+"""
+import os, sys
+import time
+import socket
+import argparse
+import threading
+import multiprocessing as mp
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from connection import StreamConnection
+from replay_server import SyntheticFrameSource
+from sensor_protocol import SensorFrameHeader, filetime_to_unix, unix_to_filetime
+
+CONFIGURATIONS = [
+    ("default", {}),
+    ("rcvbuf 4MB", {"rcvbuf": 4 * 2**20}),
+    ("waitall", {"waitall": True}),
+    ("waitall + rcvbuf 4MB", {"waitall": True, "rcvbuf": 4 * 2**20}),
+    ("waitall + busy_poll 50us", {"waitall": True, "busy_poll": 50}),
+]
+FPS = 45.0
+
+
+def busy_loop(stop_event):
+    while not stop_event.is_set():
+        pass
+
+
+def send_frames(conn, frames, link_rate, chunk_size):
+    """
+    Send `frames` depth frames at 45 FPS, each one paced at `link_rate`
+    bytes per second in `chunk_size` pieces.
+    """
+    source = SyntheticFrameSource("depth")
+    next_frame = time.perf_counter()
+    with conn:
+        for i in range(frames):
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame += 1 / FPS
+            header, payload = source.frame(i, unix_to_filetime(time.time()))
+            data = memoryview(bytes(header) + bytes(payload))
+            start = time.perf_counter()
+            for offset in range(0, len(data), chunk_size):
+                chunk = data[offset : offset + chunk_size]
+                conn.sendall(chunk)
+                delay = start + (offset + len(chunk)) / link_rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def serve(server, frames, link_rate, chunk_size):
+    while True:
+        try:
+            conn, _ = server.accept()
+        except OSError:
+            return
+        threading.Thread(
+            target=send_frames,
+            args=(conn, frames, link_rate, chunk_size),
+            daemon=True,
+        ).start()
+
+
+def measure(port, frames, options):
+    connection = StreamConnection(
+        "127.0.0.1", port, log_info=lambda message: None, **options
+    )
+    sock = connection.connect()
+    header = SensorFrameHeader("depth")
+    reader = connection.create_reader(sock, header.size)
+    latencies = np.empty(frames)
+    cpu_start = time.thread_time()
+    syscalls = reader.syscalls
+    for i in range(frames):
+        if reader.read_header() is None:
+            raise RuntimeError(f"header read failed ({reader.describe_status()})")
+        header.decode(reader._header_view)
+        if reader.read_payload(header.image_size) is None:
+            raise RuntimeError(f"payload read failed ({reader.describe_status()})")
+        latencies[i] = time.time() - filetime_to_unix(header.Timestamp)
+    cpu = time.thread_time() - cpu_start
+    syscalls = reader.syscalls - syscalls
+    connection.disconnect("stop")
+    return syscalls / frames, cpu / frames, latencies
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", help="Frames per configuration", default=450, type=int)
+    parser.add_argument(
+        "--link_mbps", help="Link rate in Mbit/s", default=300.0, type=float
+    )
+    parser.add_argument(
+        "--chunk", help="Bytes per send on the link", default=16384, type=int
+    )
+    parser.add_argument(
+        "--load", help="Busy processes competing for the CPU", default=0, type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    threading.Thread(
+        target=serve,
+        args=(server, args.frames, args.link_mbps * 1e6 / 8, args.chunk),
+        daemon=True,
+    ).start()
+    stop_event = mp.Event()
+    load = [mp.Process(target=busy_loop, args=(stop_event,)) for _ in range(args.load)]
+    for process in load:
+        process.start()
+
+    print(
+        f"==> [INFO] {args.frames} depth frames per configuration at {FPS:.0f} FPS, "
+        f"{args.link_mbps:.0f} Mbit/s link in {args.chunk} B sends, "
+        f"{args.load} busy processes"
+    )
+    print(
+        f"  {'configuration':<26} {'syscalls/frame':>14} {'cpu/frame':>10} "
+        f"{'p50':>8} {'p99':>8} {'max':>8}"
+    )
+    try:
+        for name, options in CONFIGURATIONS:
+            per_frame, cpu, latencies = measure(
+                server.getsockname()[1], args.frames, options
+            )
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+            print(
+                f"  {name:<26} {per_frame:>14.1f} {cpu * 1e3:>8.2f}ms "
+                f"{p50:>6.2f}ms {p99:>6.2f}ms {latencies.max() * 1e3:>6.2f}ms"
+            )
+    finally:
+        stop_event.set()
+        for process in load:
+            process.join()
+        server.close()
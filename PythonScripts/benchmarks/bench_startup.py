@@ -0,0 +1,162 @@
+"""
+Startup cost of the clients: import time of the entry modules and the time
+from launching a fresh interpreter to the first received depth frame, served
+by a local ReplayServer.
+
+Every measurement runs in a new `python3` process (median of `--runs`), so
+nothing is cached in `sys.modules`. The import table also lists which heavy
+optional modules an import pulls in; the publisher is skipped when rospy is
+not installed.
+
+    python3 benchmarks/bench_startup.py --runs 5
+"""
+import os, sys
+import time
+import argparse
+import subprocess
+import importlib.util
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+from replay_server import ReplayServer, SyntheticFrameSource
+
+HEAVY_MODULES = ["asyncio", "cv2", "yaml", "rospy", "cv_bridge", "tf2_ros"]
+
+IMPORT_DRIVER = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+exec(sys.argv[2])
+elapsed = time.perf_counter() - start
+print(elapsed, *(name for name in sys.argv[3:] if name in sys.modules))
+"""
+
+BLOCKING_DRIVER = """
+import os, sys, time
+sys.path.insert(0, sys.argv[1])
+from HL2StreamingCient import SensorStreamingClient
+imported = time.time()
+
+class FirstFrameClient(SensorStreamingClient):
+    SENSOR_FRAME_STRUCTURE = {
+        "depth": {**SensorStreamingClient.SENSOR_FRAME_STRUCTURE["depth"],
+                  "port": int(sys.argv[2])},
+    }
+
+    def parse_image(self, image_data):
+        print(imported, time.time(), flush=True)
+        os._exit(0)
+
+FirstFrameClient("127.0.0.1", "depth", sys.argv[3], headless=True, stats_interval=0)
+"""
+
+ASYNC_DRIVER = """
+import os, sys, time
+sys.path.insert(0, sys.argv[1])
+import asyncio
+from async_client import AsyncStreamingClient
+imported = time.time()
+
+def first_frame(frame):
+    print(imported, time.time(), flush=True)
+    os._exit(0)
+
+client = AsyncStreamingClient(consumers=[first_frame], stats_interval=0)
+client.add_stream("127.0.0.1", "depth", port=int(sys.argv[2]))
+asyncio.run(client.run())
+"""
+
+IMPORTS = [
+    ("numpy", "import numpy"),
+    ("core", "import sensor_protocol, frame_reader, connection, stream_stats"),
+    ("HL2StreamingCient", "import HL2StreamingCient"),
+    ("async_client", "import async_client"),
+    ("image_codecs", "import image_codecs"),
+    ("pose_utils", "import pose_utils"),
+    ("HoloLens2_ROS_Publisher", "import HoloLens2_ROS_Publisher"),
+]
+
+
+def import_time(statement, runs):
+    times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_DRIVER, SCRIPTS_DIR, statement]
+            + HEAVY_MODULES,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        times.append(float(output[0]))
+    return np.median(times), output[1:]
+
+
+def first_frame_time(driver, port, runs):
+    """
+    :returns: median seconds from launch to the end of the imports, and to
+        the first frame
+    """
+    imported, first_frame = [], []
+    for _ in range(runs):
+        start = time.time()
+        output = subprocess.run(
+            [sys.executable, "-c", driver, SCRIPTS_DIR, str(port), os.devnull],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        ).stdout.split()
+        if len(output) < 2:
+            raise RuntimeError("client exited before the first frame")
+        imported.append(float(output[-2]) - start)
+        first_frame.append(float(output[-1]) - start)
+    return np.median(imported), np.median(first_frame)
+
+
+def launch_time(runs):
+    """
+    :returns: median seconds to start and exit an empty interpreter
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", help="Processes per measurement", default=5, type=int)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"==> [INFO] Import time, median of {args.runs} fresh interpreters")
+    for name, statement in IMPORTS:
+        if name == "HoloLens2_ROS_Publisher" and importlib.util.find_spec("rospy") is None:
+            print(f"  {name:<26} skipped, rospy is not installed")
+            continue
+        elapsed, loaded = import_time(statement, args.runs)
+        print(
+            f"  {name:<26} {elapsed * 1e3:7.1f} ms  "
+            f"loads: {', '.join(loaded) if loaded else '-'}"
+        )
+
+    server = ReplayServer(
+        SyntheticFrameSource("depth"), host="127.0.0.1", port=0
+    ).start()
+    print(f"==> [INFO] Time to first depth frame, median of {args.runs} launches")
+    print(f"  {'python3 -c pass':<26} exits after {launch_time(args.runs) * 1e3:7.1f} ms")
+    for name, driver in (
+        ("SensorStreamingClient", BLOCKING_DRIVER),
+        ("AsyncStreamingClient", ASYNC_DRIVER),
+    ):
+        imported, first_frame = first_frame_time(driver, server.port, args.runs)
+        print(
+            f"  {name:<26} imports done {imported * 1e3:7.1f} ms, "
+            f"first frame {first_frame * 1e3:7.1f} ms"
+        )
+    server.stop()
@@ -0,0 +1,87 @@
+"""
+TSDF integration cost and memory growth on a synthetic replay: AHaT depth
+frames rendered from the replay server orbit inside a 4x3x4 m box room,
+fused at several pixel strides.
+
+    python3 benchmarks/bench_tsdf.py --frames 450
+"""
+import os, sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from point_cloud import AHAT_INVALID_DEPTH, DepthUnprojector, pinhole_lut
+from pose_utils import HOLO_PV_TO_ROS_CAM
+from replay_server import SyntheticFrameSource
+from tsdf_fusion import TSDFIntegrator, IntegrationPolicy, VoxelBlockGrid, export_map
+
+# the depth camera looks along the HoloLens forward axis (-z)
+SYNTHETIC_RIG2DEPTH = HOLO_PV_TO_ROS_CAM
+ROOM_MIN = np.array([-2.0, 0.0, -2.0], dtype=np.float32)
+ROOM_MAX = np.array([2.0, 3.0, 2.0], dtype=np.float32)
+FPS = 45.0
+
+
+def render_room(lut, rig2world):
+    """
+    :returns: (512, 512, 1) uint16 ray distances in millimeters to the walls
+    """
+    cam2world = rig2world @ np.linalg.inv(SYNTHETIC_RIG2DEPTH)
+    rays = lut.reshape(-1, 3) @ cam2world[:3, :3].T
+    origin = cam2world[:3, 3]
+    with np.errstate(divide="ignore"):
+        bounds = np.where(rays > 0, ROOM_MAX, ROOM_MIN)
+        distances = np.nanmin(np.abs((bounds - origin) / rays), axis=1)
+    depth = np.minimum(distances * 1000, AHAT_INVALID_DEPTH)
+    return depth.astype(np.uint16).reshape(lut.shape[0], lut.shape[1], 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--frames", help="Depth frames (45 FPS) to fuse", default=450, type=int
+    )
+    parser.add_argument("--voxel_size", default=0.02, type=float)
+    parser.add_argument("--output", help="Write the map of the last run", default=None)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    lut = pinhole_lut()
+    source = SyntheticFrameSource("depth", num_frames=1)
+    poses = [source.pose(i / FPS) for i in range(args.frames)]
+    frames = [render_room(lut, pose) for pose in poses]
+    print(
+        f"==> [INFO] {args.frames} frames ({args.frames / FPS:.0f} s), "
+        f"voxel {args.voxel_size * 100:.0f} cm"
+    )
+
+    for stride in (4, 2):
+        grid = VoxelBlockGrid(args.voxel_size)
+        integrator = TSDFIntegrator(
+            grid,
+            DepthUnprojector(lut, stride=stride),
+            SYNTHETIC_RIG2DEPTH,
+            IntegrationPolicy(max_fps=0),
+            background=False,
+        )
+        growth = []
+        start = time.perf_counter()
+        for i, (depth, pose) in enumerate(zip(frames, poses)):
+            integrator.submit(int(i * 1e7 / FPS), depth, pose)
+            if (i + 1) % max(args.frames // 4, 1) == 0:
+                growth.append(f"{grid.num_blocks} ({grid.memory_bytes / 1e6:.0f} MB)")
+        elapsed = (time.perf_counter() - start) / args.frames
+        print(
+            f"==> [INFO] stride={stride} {elapsed * 1e3:6.2f} ms/frame "
+            f"{1 / elapsed:6.1f} FPS, blocks (pool memory) after each quarter "
+            f"{' / '.join(growth)}"
+        )
+    # a 4x3x4 m dense volume for comparison
+    dense = np.prod((ROOM_MAX - ROOM_MIN) / args.voxel_size) * 8
+    print(f"==> [INFO] dense volume of the room: {dense / 1e6:.0f} MB")
+    if args.output:
+        export_map(grid, args.output, mesh=args.output.endswith("_mesh.ply"))
@@ -0,0 +1,365 @@
+import sys
+import time
+import random
+import struct
+import socket
+from frame_reader import FrameReader, ReadStatus
+from sensor_protocol import HEADER_PREFIX_STRUCT
+from stream_stats import ConnectionStats
+
+# Largest Timestamp step (hundreds of ns) from the last good header to a
+# resynchronization candidate
+RESYNC_MAX_GAP = 10 * 10**7
+# Bytes skipped while looking for the next header before reconnecting instead
+RESYNC_MAX_BYTES = 16 * 2**20
+# The high 32 bits of consecutive Timestamps only change every ~7 minutes
+_ANCHOR_SLICE = slice(4, 8) if sys.byteorder == "little" else slice(0, 4)
+# Not exported by the socket module, value from <asm-generic/socket.h>
+SO_BUSY_POLL = getattr(socket, "SO_BUSY_POLL", 46)
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter between connection attempts.
+
+    The n-th consecutive failure waits `initial * multiplier ** n` seconds,
+    capped at `maximum`, and shortened by a random fraction (up to `jitter`)
+    so that clients of a restarted device do not retry in lockstep.
+    """
+
+    def __init__(self, initial=0.1, maximum=2.0, multiplier=2.0, jitter=0.5) -> None:
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.initial * self.multiplier**self.attempts, self.maximum)
+        self.attempts += 1
+        return delay * (1.0 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
+
+
+def configure_socket(
+    sock,
+    nodelay=True,
+    keepalive=True,
+    keepalive_idle=2,
+    keepalive_interval=1,
+    keepalive_count=3,
+    rcvbuf=None,
+    busy_poll=None,
+):
+    """
+    Set the TCP options of a sensor stream socket.
+
+    Keepalive probes make a silently dropped connection (device asleep, WiFi
+    lost) fail within about `keepalive_idle + keepalive_interval *
+    keepalive_count` seconds. The probe timing options are platform specific
+    and skipped where missing.
+
+    :param rcvbuf: SO_RCVBUF size in bytes, the OS default if not set. On
+        Linux an explicit size turns off receive buffer autotuning and is
+        capped by net.core.rmem_max
+    :param busy_poll: SO_BUSY_POLL in microseconds (Linux): spin on the
+        device queue instead of sleeping when a read finds no data. Values
+        above net.core.busy_poll need CAP_NET_ADMIN
+    :returns: effective SO_RCVBUF size in bytes
+    """
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if keepalive:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in (
+            ("TCP_KEEPIDLE", keepalive_idle),
+            ("TCP_KEEPINTVL", keepalive_interval),
+            ("TCP_KEEPCNT", keepalive_count),
+        ):
+            if hasattr(socket, name):
+                try:
+                    sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+                except OSError:
+                    pass
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if busy_poll and sys.platform.startswith("linux"):
+        sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, busy_poll)
+    effective = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    # Linux reports twice the requested size, the other half is bookkeeping
+    return effective // 2 if sys.platform.startswith("linux") else effective
+
+
+def set_receive_timeout(sock, seconds):
+    """
+    Kernel receive timeout (SO_RCVTIMEO) of a blocking socket.
+
+    Unlike `settimeout`, it keeps the socket in blocking mode, so a recv is
+    a single syscall and MSG_WAITALL is honored; an expired read raises
+    BlockingIOError.
+    """
+    if sys.platform == "win32":
+        value = struct.pack("@I", int(seconds * 1000))
+    else:
+        value = struct.pack("@ll", int(seconds), int(seconds % 1 * 1e6))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, value)
+
+
+def _log_info(message):
+    print(f"==> [INFO] {message}")
+
+
+def _log_error(message):
+    print(f"==> [ERROR] {message}")
+
+
+class StreamConnection:
+    """
+    Connection manager of one sensor stream.
+
+    `connect` / `connect_async` retry with exponential backoff until the
+    device accepts, `disconnect` closes the socket after a failed read, and
+    `resync` / `resync_async` skip to the next valid header when a header
+    fails its sanity check. Connects, failures, disconnect causes, resyncs
+    and downtime are counted in `stats` (a ConnectionStats).
+
+    A connection dropped before its first frame also delays the next
+    connect by the backoff, so a device accepting and closing right away is
+    not retried in a tight loop.
+
+    Call `frame_received(header)` after every complete frame: it resets the
+    backoff and remembers the Timestamp that anchors a resynchronization.
+
+    With `waitall`, connected sockets are left in blocking mode with a
+    kernel receive timeout, for FrameReaders reading with MSG_WAITALL (see
+    `create_reader`). The asyncio client needs non-blocking sockets and
+    ignores it.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        timeout=3.0,
+        backoff=None,
+        stats=None,
+        rcvbuf=None,
+        busy_poll=None,
+        waitall=False,
+        keepalive=True,
+        nodelay=True,
+        max_resync_bytes=RESYNC_MAX_BYTES,
+        log_info=_log_info,
+        log_error=_log_error,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.backoff = backoff or Backoff()
+        self.stats = stats if stats is not None else ConnectionStats()
+        self.rcvbuf = rcvbuf
+        self.busy_poll = busy_poll
+        self.waitall = waitall
+        self.keepalive = keepalive
+        self.nodelay = nodelay
+        self.max_resync_bytes = max_resync_bytes
+        self.log_info = log_info
+        self.log_error = log_error
+        self.socket = None
+        self.last_timestamp = None
+        # whether the current connection delivered a frame
+        self.frame_seen = False
+        # backoff before the next connect, after a connection without frames
+        self.retry_delay = 0.0
+
+    def _create_socket(self):
+        sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        try:
+            rcvbuf = configure_socket(
+                sock,
+                nodelay=self.nodelay,
+                keepalive=self.keepalive,
+                rcvbuf=self.rcvbuf,
+                busy_poll=self.busy_poll,
+            )
+        except OSError as err:
+            if not self.busy_poll:
+                raise
+            self.log_error(f"SO_BUSY_POLL not allowed, disabled!!! ({err})")
+            sock.close()
+            self.busy_poll = None
+            return self._create_socket()
+        if self.rcvbuf and rcvbuf < self.rcvbuf:
+            self.log_error(
+                f"SO_RCVBUF capped to {rcvbuf} bytes!!! "
+                "(raise net.core.rmem_max for more)"
+            )
+            # warn once
+            self.rcvbuf = rcvbuf
+        return sock
+
+    def create_reader(self, sock, header_size, **kwargs):
+        """
+        FrameReader for a socket returned by `connect`.
+        """
+        return FrameReader(sock, header_size, waitall=self.waitall, **kwargs)
+
+    def _connected(self, sock):
+        self.socket = sock
+        self.last_timestamp = None
+        self.frame_seen = False
+        self.stats.on_connect()
+        message = f"Connection create succeed... ({self.host}:{self.port})"
+        if self.stats.reconnects:
+            message += (
+                f" reconnect {self.stats.reconnects}, "
+                f"down {self.stats.last_downtime:.2f} s"
+            )
+        self.log_info(message)
+        return sock
+
+    def _connect_failed(self, err):
+        self.stats.connect_failures += 1
+        delay = self.backoff.next_delay()
+        self.log_error(
+            f"Connection create failed!!! ({self.host}:{self.port}) {err or 'timeout'}"
+        )
+        self.log_info(f"  * Try to reconnect {delay:.2f} seconds later...")
+        return delay
+
+    def connect(self, should_stop=None):
+        """
+        Connect, retrying until the device accepts.
+
+        :param should_stop: callable checked before every attempt
+        :returns: the connected socket (with `timeout` set, or a kernel
+            receive timeout with `waitall`), or None if `should_stop()`
+            returned True
+        """
+        if self.retry_delay:
+            time.sleep(self.retry_delay)
+            self.retry_delay = 0.0
+        while should_stop is None or not should_stop():
+            sock = self._create_socket()
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect((self.host, self.port))
+            except OSError as err:
+                sock.close()
+                time.sleep(self._connect_failed(err))
+                continue
+            if self.waitall:
+                sock.settimeout(None)
+                set_receive_timeout(sock, self.timeout)
+            return self._connected(sock)
+        return None
+
+    async def connect_async(self):
+        """
+        Non-blocking `connect` for the asyncio clients.
+        """
+        # asyncio is only loaded by the asyncio clients
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self.retry_delay:
+            await asyncio.sleep(self.retry_delay)
+            self.retry_delay = 0.0
+        while True:
+            sock = self._create_socket()
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(
+                    loop.sock_connect(sock, (self.host, self.port)), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError) as err:
+                sock.close()
+                await asyncio.sleep(self._connect_failed(err))
+                continue
+            return self._connected(sock)
+
+    def disconnect(self, reason):
+        """
+        Close the socket, the downtime counts from now. If the connection
+        ended before its first frame, the next connect waits for the backoff.
+
+        :param reason: cause of the disconnect, e.g. a ReadStatus value
+        """
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+            if not self.frame_seen and reason != "stop":
+                self.retry_delay = self.backoff.next_delay()
+                self.log_error(
+                    f"Connection lost before the first frame!!! "
+                    f"({self.host}:{self.port}) {reason}"
+                )
+                self.log_info(
+                    f"  * Try to reconnect {self.retry_delay:.2f} seconds later..."
+                )
+        self.stats.on_disconnect(reason)
+
+    def frame_received(self, header):
+        self.last_timestamp = header.Timestamp
+        self.frame_seen = True
+        self.backoff.reset()
+
+    def _resync_args(self, header):
+        last_timestamp = self.last_timestamp
+
+        def is_header(data):
+            header.decode(data)
+            return (
+                header.check() is None
+                and 0 <= header.Timestamp - last_timestamp <= RESYNC_MAX_GAP
+            )
+
+        anchor = HEADER_PREFIX_STRUCT.pack(last_timestamp, 0, 0, 0, 0)[_ANCHOR_SLICE]
+        return anchor, _ANCHOR_SLICE.start, is_header, self.max_resync_bytes
+
+    def _resync_done(self, reader, data, skipped):
+        self.stats.bytes_skipped += reader.bytes_skipped - skipped
+        if data is None:
+            self.log_error(
+                f"Stream resynchronization failed!!! ({reader.describe_status()})"
+            )
+            return None
+        self.stats.resyncs += 1
+        self.log_info(
+            f"Stream resynchronized, skipped {reader.bytes_skipped - skipped} bytes"
+        )
+        return data
+
+    def resync(self, reader, header):
+        """
+        Skip to the next header after `header` failed its sanity check.
+
+        Needs a previous frame of this connection for its Timestamp,
+        otherwise the stream has to be reconnected (reader status DESYNC).
+
+        :param reader: FrameReader of the connection
+        :param header: SensorFrameHeader, holds the found header on success
+        :returns: the raw header, or None when the stream should be
+            reconnected
+        """
+        self.stats.desyncs += 1
+        if self.last_timestamp is None:
+            reader.status = ReadStatus.DESYNC
+            return None
+        skipped = reader.bytes_skipped
+        data = reader.resync(*self._resync_args(header))
+        return self._resync_done(reader, data, skipped)
+
+    async def resync_async(self, reader, header):
+        """
+        `resync` for an AsyncFrameReader.
+        """
+        self.stats.desyncs += 1
+        if self.last_timestamp is None:
+            reader.status = ReadStatus.DESYNC
+            return None
+        skipped = reader.bytes_skipped
+        data = await reader.resync(*self._resync_args(header))
+        return self._resync_done(reader, data, skipped)
@@ -0,0 +1,554 @@
+import os
+import time
+import queue
+import asyncio
+import argparse
+import multiprocessing as mp
+from datetime import datetime
+from multiprocessing import shared_memory
+from async_client import (
+    AsyncStreamingClient,
+    DisplayConsumer,
+    RecordConsumer,
+    SaveImageConsumer,
+    StopStreaming,
+    StreamFrame,
+)
+
+
+# Room reserved in front of every payload for the raw frame header, larger
+# than the biggest header (104 bytes) and keeps payloads 64-byte aligned
+SLOT_HEADER_SIZE = 128
+# Default payload capacity of a ring slot, fits 640x360 Bgra8 and 512x512 Gray16
+SLOT_PAYLOAD_SIZE = 1 << 20
+
+SLOT_FREE = 0
+SLOT_READY = 1
+
+
+class FleetDevice:
+    """
+    One HoloLens of the fleet.
+
+    :param serial: device name used in frames, logs and output file names,
+        like `holo_serial` of HoloLensMessagePublisher
+    :param ports: optional {sensor_type: port} overriding the default ports
+    """
+
+    def __init__(self, host, serial, ports=None) -> None:
+        self.host = host
+        self.serial = serial
+        self.ports = dict(ports or {})
+
+    @classmethod
+    def parse(cls, spec, index=0):
+        """
+        Parse "<host>[=<serial>]", the serial defaults to "hololens2_<index>".
+        """
+        host, _, serial = spec.partition("=")
+        return cls(host, serial or f"hololens2_{index}")
+
+    def __repr__(self):
+        return f"FleetDevice({self.host!r}, {self.serial!r})"
+
+
+class SharedFrameRing:
+    """
+    Fixed ring of frame slots in one `multiprocessing.shared_memory` block,
+    filled by a device worker and read in place by the consumer process.
+
+    The block starts with one state byte per slot, followed by the slots,
+    each holding a SLOT_HEADER_SIZE header area and a `payload_size` payload
+    area. Only the producer moves a slot from SLOT_FREE to SLOT_READY and only
+    the consumer moves it back, so the state bytes need no lock; the slot
+    index itself travels through a multiprocessing queue.
+    """
+
+    def __init__(self, num_slots, payload_size=SLOT_PAYLOAD_SIZE, name=None) -> None:
+        """
+        :param name: attach to the existing block `name` instead of creating one
+        """
+        self.num_slots = num_slots
+        self.payload_size = payload_size
+        self.slot_size = SLOT_HEADER_SIZE + payload_size
+        self._states_size = (num_slots + 63) // 64 * 64
+        size = self._states_size + num_slots * self.slot_size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:num_slots] = bytes(num_slots)
+        else:
+            # workers share the resource tracker of the process that created
+            # the block, so attaching does not make them unlink it on exit
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buffer = self.shm.buf
+        self.states = self.buffer[:num_slots]
+        self._next_slot = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def acquire(self):
+        """
+        Producer side: find a free slot, starting after the last one used.
+
+        :returns: slot index, or None if the consumer holds every slot
+        """
+        states = self.states
+        for i in range(self.num_slots):
+            slot = (self._next_slot + i) % self.num_slots
+            if states[slot] == SLOT_FREE:
+                self._next_slot = slot + 1
+                return slot
+        return None
+
+    def publish(self, slot):
+        self.states[slot] = SLOT_READY
+
+    def release(self, slot):
+        """
+        Consumer side: hand `slot` back to the producer.
+        """
+        self.states[slot] = SLOT_FREE
+
+    def header_view(self, slot, size=SLOT_HEADER_SIZE):
+        start = self._states_size + slot * self.slot_size
+        return self.buffer[start : start + size]
+
+    def payload_view(self, slot, size):
+        start = self._states_size + slot * self.slot_size + SLOT_HEADER_SIZE
+        return self.buffer[start : start + size]
+
+    def close(self):
+        if self.buffer is None:
+            return
+        self.states.release()
+        self.states = self.buffer = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a consumer still holds a view, the mapping goes away with the process
+            print(f"==> [ERROR] Shared frame ring {self.name} still in use!!!")
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class _RingProducer:
+    """
+    AsyncStreamingClient consumer running in a device worker: copy each
+    frame into a free ring slot and announce it on the ready queue.
+
+    When the consumer process holds every slot the new frame is dropped, so
+    a slow consumer never stalls the device socket.
+    """
+
+    def __init__(self, ring, device_index, ready_queue, sensor_types) -> None:
+        self.ring = ring
+        self.device_index = device_index
+        self.ready_queue = ready_queue
+        self.dropped = dict.fromkeys(sensor_types, 0)
+        self.oversized = dict.fromkeys(sensor_types, 0)
+        self.last_frame_time = dict.fromkeys(sensor_types, None)
+
+    def __call__(self, frame):
+        sensor_type = frame.sensor_type
+        self.last_frame_time[sensor_type] = time.time()
+        header_size = len(frame.raw_header)
+        payload_size = len(frame.payload)
+        if payload_size > self.ring.payload_size:
+            if not self.oversized[sensor_type]:
+                print(
+                    f"==> [ERROR] {frame.device} {sensor_type} frame of {payload_size} "
+                    f"bytes does not fit the {self.ring.payload_size} bytes slots!!!"
+                )
+            self.oversized[sensor_type] += 1
+            return
+        slot = self.ring.acquire()
+        if slot is None:
+            self.dropped[sensor_type] += 1
+            return
+        self.ring.header_view(slot, header_size)[:] = frame.raw_header
+        self.ring.payload_view(slot, payload_size)[:] = frame.payload
+        self.ring.publish(slot)
+        self.ready_queue.put(
+            ("frame", self.device_index, sensor_type, slot, header_size, payload_size)
+        )
+
+    def health(self, client):
+        streams = {}
+        for stream in client.streams:
+            sensor_type = stream.sensor_type
+            stats = stream.stats
+            streams[sensor_type] = {
+                "connected": stream.connected,
+                "reconnects": stats.connection.reconnects,
+                "downtime": stats.connection.current_downtime(),
+                "frames": stats.frames,
+                "bytes": stats.bytes,
+                "fps": stats.fps,
+                "bandwidth": stats.bandwidth,
+                "latency_p50": stats.latency.percentile(0.5),
+                "dropped": self.dropped[sensor_type],
+                "oversized": self.oversized[sensor_type],
+                "last_frame_time": self.last_frame_time[sensor_type],
+            }
+        return streams
+
+
+def _device_worker(
+    device_index,
+    device,
+    sensor_types,
+    ring_name,
+    num_slots,
+    payload_size,
+    ready_queue,
+    stop_event,
+    stats_interval,
+    cpu,
+    rcvbuf=None,
+):
+    """
+    Worker process entry: receive every stream of one device with the
+    asyncio client and feed the shared frame ring.
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    # frames still queued when the fleet stops are dropped, the worker must
+    # not wait for the consumer to read them before exiting
+    ready_queue.cancel_join_thread()
+    ring = SharedFrameRing(num_slots, payload_size, name=ring_name)
+    client = AsyncStreamingClient(stats_interval=stats_interval or 1.0, rcvbuf=rcvbuf)
+    for sensor_type in sensor_types:
+        stream = client.add_stream(
+            device.host,
+            sensor_type,
+            device=device.serial,
+            port=device.ports.get(sensor_type),
+        )
+        # the fleet prints one health table instead of per-stream lines
+        stream.stats.log = None
+    producer = client.add_consumer(
+        _RingProducer(ring, device_index, ready_queue, sensor_types)
+    )
+
+    async def supervise():
+        next_report = time.monotonic()
+        while not stop_event.is_set():
+            if time.monotonic() >= next_report:
+                ready_queue.put(("health", device_index, producer.health(client)))
+                next_report += stats_interval or 1.0
+            await asyncio.sleep(0.1)
+        client.stop()
+
+    async def main():
+        supervisor = asyncio.ensure_future(supervise())
+        try:
+            await client.run()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            supervisor.cancel()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+class FleetIngest:
+    """
+    Receive the sensor streams of several HoloLens devices with one worker
+    process per device, so decoding and socket work of the devices run on
+    separate cores instead of sharing one GIL.
+
+    Workers copy every frame into a per-device SharedFrameRing; `frames()`
+    yields them in the calling process as StreamFrame objects whose
+    `raw_header` and `payload` are views into shared memory (no pickling).
+    A frame is valid until the next iteration, when its slot goes back to
+    the worker: consumers that keep data must copy it.
+
+        with FleetIngest([FleetDevice("192.168.50.210", "hololens2_a"), ...]) as fleet:
+            for frame in fleet.frames():
+                ...
+    """
+
+    def __init__(
+        self,
+        devices,
+        sensor_types=("color", "depth"),
+        num_slots=8,
+        slot_size=SLOT_PAYLOAD_SIZE,
+        stats_interval=5.0,
+        pin_cpus=False,
+        rcvbuf=None,
+        log=print,
+    ) -> None:
+        """
+        :param devices: FleetDevice list
+        :param num_slots: ring slots per device, frames are dropped when the
+            consumer holds all of them
+        :param slot_size: payload capacity of each slot in bytes
+        :param stats_interval: seconds between health reports, 0 to disable
+        :param pin_cpus: pin worker i to CPU (i + 1) % cpu_count
+        :param rcvbuf: SO_RCVBUF of the stream sockets in bytes
+        :param log: callable receiving the health report, None to stay silent
+        """
+        self.devices = list(devices)
+        self.sensor_types = list(sensor_types)
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.stats_interval = stats_interval
+        self.pin_cpus = pin_cpus
+        self.rcvbuf = rcvbuf
+        self.log = log
+        self.rings = []
+        self.workers = []
+        self.health = [{} for _ in self.devices]
+        self.delivered = [dict.fromkeys(self.sensor_types, 0) for _ in self.devices]
+        self._ready_queue = None
+        self._stop_event = None
+        self._running = False
+        self._next_report = 0.0
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._ready_queue = mp.Queue()
+        self._stop_event = mp.Event()
+        cpu_count = os.cpu_count() or 1
+        for i, device in enumerate(self.devices):
+            ring = SharedFrameRing(self.num_slots, self.slot_size)
+            self.rings.append(ring)
+            worker = mp.Process(
+                target=_device_worker,
+                name=f"fleet-{device.serial}",
+                args=(
+                    i,
+                    device,
+                    self.sensor_types,
+                    ring.name,
+                    self.num_slots,
+                    self.slot_size,
+                    self._ready_queue,
+                    self._stop_event,
+                    self.stats_interval,
+                    (i + 1) % cpu_count if self.pin_cpus else None,
+                    self.rcvbuf,
+                ),
+                daemon=True,
+            )
+            worker.start()
+            self.workers.append(worker)
+        self._running = True
+        self._next_report = time.monotonic() + (self.stats_interval or 0)
+        print(
+            f"==> [INFO] Fleet started: {len(self.devices)} devices, "
+            f"{', '.join(self.sensor_types)} streams"
+        )
+        return self
+
+    def frames(self):
+        """
+        Yield the frames of every device as they arrive, until `stop()`.
+        """
+        frames = {}
+        while self._running:
+            try:
+                message = self._ready_queue.get(timeout=0.5)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self.workers):
+                    print("==> [ERROR] All fleet workers exited!!!")
+                    break
+                self._maybe_report()
+                continue
+
+            if message[0] == "health":
+                self.health[message[1]] = message[2]
+                self._maybe_report()
+                continue
+
+            _, device_index, sensor_type, slot, header_size, payload_size = message
+            ring = self.rings[device_index]
+            frame = frames.get((device_index, sensor_type))
+            if frame is None:
+                frame = frames[(device_index, sensor_type)] = StreamFrame(
+                    self.devices[device_index].serial, sensor_type
+                )
+            frame.raw_header = ring.header_view(slot, header_size)
+            frame.header.decode(frame.raw_header)
+            frame.payload = ring.payload_view(slot, payload_size)
+            self.delivered[device_index][sensor_type] += 1
+            try:
+                yield frame
+            finally:
+                frame.raw_header = frame.payload = None
+                ring.release(slot)
+
+    def run(self, consumers):
+        """
+        Pass every frame to `consumers` (see AsyncStreamingClient) until one
+        raises StopStreaming, then close them and stop the fleet.
+        """
+        frames = self.frames()
+        try:
+            for frame in frames:
+                for consumer in consumers:
+                    consumer(frame)
+        except StopStreaming:
+            pass
+        finally:
+            # hand the current slot back before the rings are closed
+            frames.close()
+            for consumer in consumers:
+                close = getattr(consumer, "close", None)
+                if close is not None:
+                    close()
+            self.stop()
+
+    def stop(self):
+        if not self.workers:
+            return
+        self._running = False
+        self._stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        for ring in self.rings:
+            ring.close()
+            ring.unlink()
+        self._ready_queue.close()
+        self.workers = []
+        self.rings = []
+        if self.log is not None:
+            self.log(self.health_report())
+
+    def _maybe_report(self):
+        if not self.stats_interval or self.log is None:
+            return
+        now = time.monotonic()
+        if now >= self._next_report:
+            self._next_report = now + self.stats_interval
+            self.log(self.health_report())
+
+    def health_report(self):
+        now = time.time()
+        lines = [
+            f"==> [INFO] Fleet health ({len(self.devices)} devices)",
+            f"  {'device':<20} {'stream':<6} {'state':<12} {'FPS':>7} {'MB/s':>7} "
+            f"{'frames':>9} {'delivered':>9} {'dropped':>8} {'reconn':>6} {'down':>7} {'age':>7}",
+        ]
+        for i, device in enumerate(self.devices):
+            for sensor_type in self.sensor_types:
+                health = self.health[i].get(sensor_type)
+                if health is None:
+                    lines.append(f"  {device.serial:<20} {sensor_type:<6} starting")
+                    continue
+                last = health["last_frame_time"]
+                age = f"{now - last:.1f}s" if last is not None else "-"
+                lines.append(
+                    f"  {device.serial:<20} {sensor_type:<6} "
+                    f"{'connected' if health['connected'] else 'DISCONNECTED':<12} "
+                    f"{health['fps']:>7.1f} {health['bandwidth'] / 1e6:>7.1f} "
+                    f"{health['frames']:>9} {self.delivered[i][sensor_type]:>9} "
+                    f"{health['dropped'] + health['oversized']:>8} "
+                    f"{health['reconnects']:>6} {health['downtime']:>6.1f}s {age:>7}"
+                )
+        return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--devices",
+        help="HoloLens devices as <host>[=<serial>], the serial defaults to "
+        "hololens2_<index>",
+        nargs="+",
+        required=True,
+    )
+    parser.add_argument(
+        "--sensor_type",
+        help="Sensor type to subscribe, all/depth/color",
+        choices=["color", "depth", "all"],
+        default="all",
+    )
+    parser.add_argument(
+        "--headless", help="Do not open viewer windows", action="store_true"
+    )
+    parser.add_argument(
+        "--record",
+        help="Record raw frames to <output_folder>/<serial>_<sensor_type>.hl2rec",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--save_image", help="Save image to local", action="store_true", default=False
+    )
+    parser.add_argument(
+        "--num_slots", help="Shared memory frame slots per device", default=8, type=int
+    )
+    parser.add_argument(
+        "--slot_size",
+        help="Payload capacity of each slot in MB",
+        default=SLOT_PAYLOAD_SIZE / 1e6,
+        type=float,
+    )
+    parser.add_argument(
+        "--pin_cpus", help="Pin each device worker to its own CPU", action="store_true"
+    )
+    parser.add_argument(
+        "--rcvbuf",
+        help="Socket receive buffer (SO_RCVBUF) in MB, OS autotuning if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--stats_interval",
+        help="Seconds between health reports, 0 to disable",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--output_folder",
+        help="Output folder for recordings and saved images",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "output",
+            datetime.now().strftime("%Y%m%d_%H%M%S"),
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    consumers = []
+    if args.record:
+        consumers.append(RecordConsumer(args.output_folder))
+    if args.save_image:
+        consumers.append(SaveImageConsumer(args.output_folder))
+    if not args.headless:
+        consumers.append(DisplayConsumer())
+
+    fleet = FleetIngest(
+        [FleetDevice.parse(spec, i) for i, spec in enumerate(args.devices)],
+        sensor_types=["color", "depth"] if args.sensor_type == "all" else [args.sensor_type],
+        num_slots=args.num_slots,
+        slot_size=int(args.slot_size * 1e6),
+        stats_interval=args.stats_interval,
+        pin_cpus=args.pin_cpus,
+        rcvbuf=int(args.rcvbuf * 2**20) if args.rcvbuf else None,
+    ).start()
+    try:
+        fleet.run(consumers)
+    except KeyboardInterrupt:
+        fleet.stop()
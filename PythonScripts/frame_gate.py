@@ -0,0 +1,163 @@
+from stream_stats import GateStats
+
+
+# Intervals longer than this many frame periods count as gaps
+GAP_FACTOR = 1.5
+# Timestamps further back (hundreds of ns) are taken as a device clock change
+# rather than stale frames
+MAX_REWIND = 10**7
+# This many gaps in a row with the same interval are taken as a frame rate
+# drop rather than lost frames, and re-anchor the frame period
+REANCHOR_GAPS = 3
+
+
+class RateLimiter:
+    """
+    Let frames through at most `rate` times per second of device time.
+
+    Decisions only look at the header Timestamp. Due times follow a fixed
+    grid of `1 / rate` periods, with a tolerance of an eighth of a period
+    for the frame time jitter, so 45 Hz depth limited to 15 Hz keeps every
+    third frame. After a longer pause the grid restarts at the next frame.
+    """
+
+    def __init__(self, rate) -> None:
+        """
+        :param rate: frames per second, 0 or None to let every frame through
+        """
+        self.period = round(1e7 / rate) if rate else 0
+        self.tolerance = self.period // 8
+        self._due = None
+
+    def due(self, timestamp):
+        if not self.period:
+            return True
+        if self._due is None or not -self.period < timestamp - self._due < self.period:
+            self._due = timestamp
+        elif timestamp < self._due - self.tolerance:
+            return False
+        self._due += self.period
+        return True
+
+
+class FrameGate:
+    """
+    Timestamp checks of one sensor stream, run on the decoded header so that
+    rejected frames are never decoded nor copied.
+
+    `admit` rejects duplicates (same Timestamp as the last admitted frame)
+    and stale frames (older), and counts the gaps where frames went missing:
+    intervals longer than GAP_FACTOR times the frame period, estimated from
+    the stream. It is called once the payload has arrived, so a frame cut by
+    a failed read is not taken as received; `accepts` tells ahead of the
+    payload whether the frame will be admitted.
+
+    Gaps are counted one frame late. `reanchor_gaps` gaps in a row whose
+    intervals agree within an eighth are a frame rate drop rather than lost
+    frames: the shortest interval becomes the period. Bursts of gaps of
+    different lengths are counted as lost frames. The first interval only
+    seeds the period if the next one is not much shorter.
+
+    `due(output, timestamp)` applies the rate limit of one output of an
+    admitted frame. Both count into `stats` (a GateStats).
+
+    :param rates: {output name: frames per second}, outputs without a rate
+        get every frame
+    """
+
+    def __init__(
+        self,
+        stats=None,
+        rates=None,
+        gap_factor=GAP_FACTOR,
+        max_rewind=MAX_REWIND,
+        reanchor_gaps=REANCHOR_GAPS,
+    ) -> None:
+        self.stats = stats if stats is not None else GateStats()
+        self.limiters = {
+            output: RateLimiter(rate) for output, rate in (rates or {}).items() if rate
+        }
+        self.gap_factor = gap_factor
+        self.max_rewind = max_rewind
+        self.reanchor_gaps = reanchor_gaps
+        self.last_timestamp = None
+        # estimated frame period in hundreds of ns
+        self.period = None
+        # intervals of the gaps in a row not counted yet
+        self._gap_steps = []
+        # first interval of the stream, until the next one confirms it
+        self._first_step = None
+
+    def accepts(self, timestamp):
+        """
+        Whether `admit` would let the frame through, without counting it,
+        e.g. to act on a header before its payload has arrived.
+        """
+        last = self.last_timestamp
+        return last is None or not -self.max_rewind <= timestamp - last <= 0
+
+    def admit(self, timestamp):
+        """
+        :returns: False for a duplicate or stale frame
+        """
+        last = self.last_timestamp
+        if last is not None:
+            step = timestamp - last
+            if step == 0:
+                self.stats.duplicates += 1
+                return False
+            if -self.max_rewind <= step < 0:
+                self.stats.stale += 1
+                return False
+            if step > 0:
+                self._count_gap(step)
+        self.last_timestamp = timestamp
+        return True
+
+    def _count_gap(self, step):
+        period = self.period
+        if period is None:
+            # checked against the next interval, it may already span lost
+            # frames
+            self.period = self._first_step = step
+            return
+        if self._first_step is not None:
+            if step * self.gap_factor < period:
+                self._gap_steps.append(period)
+                self.period = period = step
+            self._first_step = None
+        if step > self.gap_factor * period:
+            self._gap_steps.append(step)
+            if len(self._gap_steps) < self.reanchor_gaps:
+                return
+            shortest = min(self._gap_steps)
+            if max(self._gap_steps) - shortest > shortest / 8:
+                # intervals of different lengths, a burst of lost frames
+                self._count_gaps(self._gap_steps[:1], period)
+                del self._gap_steps[0]
+                return
+            # the same longer interval again, the frame rate dropped, e.g. 30
+            # to 15 FPS
+            self.period = period = shortest
+        else:
+            # slow average, follows frame rate increases but not jitter
+            self.period = period + (step - period) / 8
+        self._count_gaps(self._gap_steps, period)
+        self._gap_steps.clear()
+
+    def _count_gaps(self, steps, period):
+        for step in steps:
+            if step > self.gap_factor * period:
+                self.stats.gaps += 1
+                self.stats.lost += round(step / period) - 1
+
+    def due(self, output, timestamp):
+        """
+        :returns: True if `output` should handle the frame
+        """
+        limiter = self.limiters.get(output)
+        if limiter is None or limiter.due(timestamp):
+            return True
+        skipped = self.stats.skipped
+        skipped[output] = skipped.get(output, 0) + 1
+        return False
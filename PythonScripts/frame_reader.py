@@ -0,0 +1,253 @@
+import socket
+from enum import Enum
+
+
+class ReadStatus(Enum):
+    OK = "ok"
+    # Peer closed the connection cleanly on a frame boundary
+    EOF = "eof"
+    # Peer closed the connection in the middle of a frame: within a header,
+    # or after a header and before or within its payload
+    SHORT_READ = "short_read"
+    TIMEOUT = "timeout"
+    ERROR = "error"
+    # No valid header found while resynchronizing
+    DESYNC = "desync"
+
+
+class FrameReader:
+    """
+    Receive fixed-size headers and variable-size payloads from a TCP stream
+    socket without building intermediate bytes objects.
+
+    The reader owns one preallocated header buffer and a small ring of payload
+    buffers. Every read is filled in place with `socket.recv_into`, and the
+    returned memoryview stays valid until the same ring slot is reused, i.e.
+    for the next `num_slots - 1` frames.
+
+    `resync` scans the stream for the next valid header after a corrupt one;
+    the bytes it read past that header are consumed by the next reads.
+    """
+
+    def __init__(
+        self,
+        sock,
+        header_size,
+        payload_size=0,
+        num_slots=2,
+        waitall=False,
+        exact_payload=False,
+    ) -> None:
+        """
+        :param sock: connected TCP stream socket
+        :param header_size: size of the frame header in bytes
+        :param payload_size: initial payload capacity of each ring slot,
+            slots grow on demand if a frame is larger
+        :param num_slots: number of payload buffers in the ring
+        :param waitall: receive with MSG_WAITALL, so the kernel fills a whole
+            header or payload in one call. Only effective on blocking sockets
+            (see `connection.set_receive_timeout`), sockets with a Python
+            timeout are non-blocking underneath
+        :param exact_payload: size every slot to the payload it receives, so
+            the bytearray of a returned view (`view.obj`) holds exactly the
+            payload and can be passed on without copying
+        """
+        assert num_slots > 0, "FrameReader needs at least one payload slot"
+        self.socket = sock
+        self.header_size = header_size
+        self.status = ReadStatus.OK
+        self.last_error = None
+        self.bytes_received = 0
+        self.bytes_skipped = 0
+        self.recv_calls = 0
+        self._recv_flags = socket.MSG_WAITALL if waitall else 0
+        self.exact_payload = exact_payload
+        # bytes read ahead by `resync`, served before the socket
+        self._pending = memoryview(b"")
+
+        self._header_buffer = bytearray(header_size)
+        self._header_view = memoryview(self._header_buffer)
+        self._slots = [bytearray(payload_size) for _ in range(num_slots)]
+        self._slot_views = [memoryview(slot) for slot in self._slots]
+        self._slot_index = 0
+
+    @property
+    def ok(self):
+        return self.status is ReadStatus.OK
+
+    @property
+    def syscalls(self):
+        """
+        Receive syscalls so far: recv calls, plus the poll CPython runs
+        before each of them on sockets with a timeout.
+        """
+        return self.recv_calls * (2 if self.socket.gettimeout() else 1)
+
+    def read_header(self):
+        """
+        Receive one frame header.
+
+        :returns: memoryview over the header buffer, or None if the read
+            failed (see `status` and `last_error`)
+        """
+        if self.recv_exact(self._header_view) is not ReadStatus.OK:
+            return None
+        return self._header_view
+
+    def read_payload(self, data_size):
+        """
+        Receive one frame payload into the next ring slot.
+
+        :param data_size: payload size in bytes
+        :returns: memoryview of exactly `data_size` bytes, or None if the
+            read failed (see `status` and `last_error`)
+        """
+        view = self._next_payload_view(data_size)
+        if self.recv_exact(view, frame_start=False) is not ReadStatus.OK:
+            return None
+        return view
+
+    def _next_payload_view(self, data_size):
+        self._slot_index = (self._slot_index + 1) % len(self._slots)
+        slot_size = len(self._slots[self._slot_index])
+        if slot_size < data_size or (self.exact_payload and slot_size != data_size):
+            self._slot_views[self._slot_index].release()
+            self._slots[self._slot_index] = bytearray(data_size)
+            self._slot_views[self._slot_index] = memoryview(
+                self._slots[self._slot_index]
+            )
+        return self._slot_views[self._slot_index][:data_size]
+
+    def recv_exact(self, view, frame_start=True):
+        """
+        Fill `view` completely from the socket.
+
+        :param frame_start: `view` starts a frame, so a close before its first
+            byte is EOF rather than SHORT_READ
+        :returns: ReadStatus of the read, also stored in `status`
+        """
+        data_size = len(view)
+        received = pending = self._take_pending(view)
+        self.last_error = None
+        try:
+            while received < data_size:
+                nbytes = self.socket.recv_into(
+                    view[received:], data_size - received, self._recv_flags
+                )
+                self.recv_calls += 1
+                if nbytes == 0:
+                    self.status = (
+                        ReadStatus.EOF
+                        if received == 0 and frame_start
+                        else ReadStatus.SHORT_READ
+                    )
+                    return self.status
+                received += nbytes
+        except (socket.timeout, BlockingIOError) as err:
+            # BlockingIOError: SO_RCVTIMEO expired on a blocking socket
+            self.last_error = err
+            self.status = ReadStatus.TIMEOUT
+            return self.status
+        except OSError as err:
+            self.last_error = err
+            self.status = ReadStatus.ERROR
+            return self.status
+        finally:
+            self.bytes_received += received - pending
+        self.status = ReadStatus.OK
+        return self.status
+
+    def _take_pending(self, view):
+        if not self._pending:
+            return 0
+        nbytes = min(len(self._pending), len(view))
+        view[:nbytes] = self._pending[:nbytes]
+        self._pending = self._pending[nbytes:]
+        return nbytes
+
+    def _find_header(self, window, anchor, anchor_offset, is_header):
+        """
+        Look for a header in `window` whose bytes at `anchor_offset` are
+        `anchor` and that `is_header` accepts.
+
+        :returns: (offset of the header or None, number of leading bytes of
+            `window` that cannot start a header)
+        """
+        header_size = self.header_size
+        start = 0
+        while True:
+            position = window.find(anchor, start)
+            if position == -1:
+                return None, max(len(window) - header_size + 1, 0)
+            offset = position - anchor_offset
+            if offset >= 0:
+                if offset + header_size > len(window):
+                    return None, offset
+                if is_header(bytes(window[offset : offset + header_size])):
+                    return offset, offset
+            start = position + 1
+
+    def _start_resync(self):
+        # the rejected header may overlap the real one, so it is scanned too
+        window = bytearray(self._header_view)
+        window += self._pending
+        self._pending = memoryview(b"")
+        self.last_error = None
+        return window
+
+    def _end_resync(self, window, offset):
+        header_size = self.header_size
+        self._header_view[:] = window[offset : offset + header_size]
+        self._pending = memoryview(bytes(window[offset + header_size :]))
+        self.status = ReadStatus.OK
+        return self._header_view
+
+    def resync(self, anchor, anchor_offset, is_header, max_bytes, chunk_size=65536):
+        """
+        Skip stream bytes up to the next header.
+
+        The protocol has no sync marker, so candidates are found by searching
+        for `anchor`, bytes every header has at `anchor_offset` (e.g. the high
+        bytes of the Timestamp), and confirmed by `is_header(raw_header)`.
+
+        :param max_bytes: give up after skipping this many bytes
+        :returns: memoryview over the header buffer holding the found header,
+            or None (see `status`, DESYNC when `max_bytes` was exceeded)
+        """
+        window = self._start_resync()
+        chunk = bytearray(chunk_size)
+        skipped = 0
+        while True:
+            offset, dropped = self._find_header(window, anchor, anchor_offset, is_header)
+            skipped += dropped
+            if offset is not None:
+                self.bytes_skipped += skipped
+                return self._end_resync(window, offset)
+            del window[:dropped]
+            if skipped > max_bytes:
+                self.bytes_skipped += skipped
+                self.status = ReadStatus.DESYNC
+                return None
+            try:
+                nbytes = self.socket.recv_into(chunk)
+            except (socket.timeout, BlockingIOError) as err:
+                self.last_error = err
+                self.status = ReadStatus.TIMEOUT
+                nbytes = None
+            except OSError as err:
+                self.last_error = err
+                self.status = ReadStatus.ERROR
+                nbytes = None
+            if not nbytes:
+                if nbytes == 0:
+                    self.status = ReadStatus.SHORT_READ
+                self.bytes_skipped += skipped
+                return None
+            self.recv_calls += 1
+            self.bytes_received += nbytes
+            window += memoryview(chunk)[:nbytes]
+
+    def describe_status(self):
+        if self.last_error is not None:
+            return f"{self.status.value} ({self.last_error})"
+        return self.status.value
@@ -0,0 +1,280 @@
+import os
+import mmap
+import struct
+import argparse
+import numpy as np
+from sensor_protocol import (
+    HEADER_DTYPES,
+    HEADER_PREFIX_STRUCT,
+    HEADER_STRUCTS,
+    image_view,
+)
+
+# Recording container layout (little endian, every record padded to 8 bytes)
+#
+#   file header   magic, version, frame header size, sensor type
+#   "FRAM" record raw frame header + payload, exactly as streamed
+#   ...
+#   "FIDX" record footer index, one INDEX_DTYPE entry per frame
+#   trailer       magic, offset of the "FIDX" record, number of frames
+#
+# Frames are flushed to disk once per chunk. A file without a valid trailer
+# (e.g. the recorder crashed) is recovered by walking the "FRAM" records.
+FILE_MAGIC = b"HL2REC\x00\x00"
+FILE_VERSION = 1
+FILE_HEADER_STRUCT = struct.Struct("<8sII16s")
+RECORD_HEADER_STRUCT = struct.Struct("<4sIQ")
+TRAILER_MAGIC = b"HL2RIDX\x00"
+TRAILER_STRUCT = struct.Struct("<8sQQ")
+FRAME_TAG = b"FRAM"
+INDEX_TAG = b"FIDX"
+RECORD_ALIGNMENT = 8
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("timestamp", "<i8"),
+        # offset of the raw frame header in the file
+        ("offset", "<u8"),
+        ("payload_size", "<u8"),
+    ]
+)
+
+
+def _padding(size):
+    return -size % RECORD_ALIGNMENT
+
+
+class FrameRecorder:
+    """
+    Append raw frames to an indexed recording container.
+    """
+
+    def __init__(self, file_path, sensor_type, chunk_frames=64) -> None:
+        self.file_path = file_path
+        self.sensor_type = sensor_type
+        self.header_size = HEADER_STRUCTS[sensor_type].size
+        self.chunk_frames = chunk_frames
+        self.num_frames = 0
+        self._index = []
+        self._file = open(file_path, "wb")
+        self._file.write(
+            FILE_HEADER_STRUCT.pack(
+                FILE_MAGIC, FILE_VERSION, self.header_size, sensor_type.encode()
+            )
+        )
+        self._offset = FILE_HEADER_STRUCT.size
+
+    def write(self, header_data, payload):
+        """
+        Append one frame.
+
+        :param header_data: raw frame header, as received
+        :param payload: raw frame payload, as received
+        """
+        body_size = self.header_size + len(payload)
+        padding = _padding(body_size)
+        timestamp = HEADER_PREFIX_STRUCT.unpack_from(header_data)[0]
+
+        self._file.write(RECORD_HEADER_STRUCT.pack(FRAME_TAG, 0, body_size))
+        self._file.write(header_data)
+        self._file.write(payload)
+        if padding:
+            self._file.write(bytes(padding))
+
+        self._index.append(
+            (timestamp, self._offset + RECORD_HEADER_STRUCT.size, len(payload))
+        )
+        self._offset += RECORD_HEADER_STRUCT.size + body_size + padding
+        self.num_frames += 1
+        if self.num_frames % self.chunk_frames == 0:
+            self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        index_size = index.nbytes
+        self._file.write(RECORD_HEADER_STRUCT.pack(INDEX_TAG, 0, index_size))
+        self._file.write(index.tobytes())
+        self._file.write(bytes(_padding(index_size)))
+        self._file.write(TRAILER_STRUCT.pack(TRAILER_MAGIC, self._offset, len(index)))
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RecordingReader:
+    """
+    Memory-mapped random access to a recording container.
+
+    Frames are returned as zero-copy, read-only NumPy views of the mapped file.
+    Views must be dropped before `close`.
+    """
+
+    def __init__(self, file_path) -> None:
+        self.file_path = file_path
+        self._file = open(file_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, version, self.header_size, sensor_type = FILE_HEADER_STRUCT.unpack_from(
+            self._mmap
+        )
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError(f"{file_path} is not a HoloLens 2 recording")
+        self.sensor_type = sensor_type.rstrip(b"\x00").decode()
+        self.header_dtype = HEADER_DTYPES[self.sensor_type]
+
+        self.recovered = False
+        self.index = self._read_footer_index()
+        if self.index is None:
+            self.index = self._scan_index()
+            self.recovered = True
+        self.timestamps = self.index["timestamp"]
+        self._sorted = bool(np.all(self.timestamps[1:] >= self.timestamps[:-1]))
+
+    def _read_footer_index(self):
+        if len(self._mmap) < FILE_HEADER_STRUCT.size + TRAILER_STRUCT.size:
+            return None
+        magic, index_offset, num_frames = TRAILER_STRUCT.unpack_from(
+            self._mmap, len(self._mmap) - TRAILER_STRUCT.size
+        )
+        if magic != TRAILER_MAGIC:
+            return None
+        tag, _, index_size = RECORD_HEADER_STRUCT.unpack_from(self._mmap, index_offset)
+        if tag != INDEX_TAG or index_size != num_frames * INDEX_DTYPE.itemsize:
+            return None
+        return np.frombuffer(
+            self._mmap,
+            dtype=INDEX_DTYPE,
+            count=num_frames,
+            offset=index_offset + RECORD_HEADER_STRUCT.size,
+        )
+
+    def _scan_index(self):
+        entries = []
+        offset = FILE_HEADER_STRUCT.size
+        file_size = len(self._mmap)
+        while offset + RECORD_HEADER_STRUCT.size <= file_size:
+            tag, _, body_size = RECORD_HEADER_STRUCT.unpack_from(self._mmap, offset)
+            body_offset = offset + RECORD_HEADER_STRUCT.size
+            if tag != FRAME_TAG or body_offset + body_size > file_size:
+                break
+            timestamp = HEADER_PREFIX_STRUCT.unpack_from(self._mmap, body_offset)[0]
+            entries.append((timestamp, body_offset, body_size - self.header_size))
+            offset = body_offset + body_size + _padding(body_size)
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        return self.frame(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def raw_frame(self, i):
+        """
+        :returns: (raw header, raw payload) memoryviews of frame `i`
+        """
+        offset = int(self.index["offset"][i])
+        payload_offset = offset + self.header_size
+        payload_end = payload_offset + int(self.index["payload_size"][i])
+        return (
+            self._view[offset:payload_offset],
+            self._view[payload_offset:payload_end],
+        )
+
+    def header(self, i):
+        """
+        :returns: structured header record of frame `i`, a view of the file
+        """
+        offset = int(self.index["offset"][i])
+        return np.frombuffer(
+            self._mmap, dtype=self.header_dtype, count=1, offset=offset
+        )[0]
+
+    def frame(self, i):
+        """
+        :returns: (header record, image view) of frame `i`
+        """
+        header = self.header(i)
+        _, payload = self.raw_frame(i)
+        image = image_view(
+            payload,
+            int(header["ImageWidth"]),
+            int(header["ImageHeight"]),
+            int(header["PixelStride"]),
+            int(header["RowStride"]),
+        )
+        return header, image
+
+    def find(self, timestamp):
+        """
+        :returns: index of the frame closest to `timestamp`
+        """
+        if not len(self):
+            raise IndexError("Recording is empty")
+        if not self._sorted:
+            return int(np.argmin(np.abs(self.timestamps - timestamp)))
+        i = int(np.searchsorted(self.timestamps, timestamp))
+        if i == len(self):
+            return i - 1
+        if i > 0 and timestamp - self.timestamps[i - 1] <= self.timestamps[i] - timestamp:
+            return i - 1
+        return i
+
+    def frame_at(self, timestamp):
+        return self.frame(self.find(timestamp))
+
+    def headers(self):
+        """
+        Gather every frame header into one structured array (a single copy).
+        """
+        raw = np.frombuffer(self._mmap, dtype=np.uint8)
+        offsets = self.index["offset"].astype(np.int64)
+        gathered = raw[offsets[:, None] + np.arange(self.header_size)]
+        return gathered.view(self.header_dtype).reshape(-1)
+
+    def close(self):
+        self.timestamps = None
+        self.index = None
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording", help="Recording file to summarize", type=str)
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    reader = RecordingReader(args.recording)
+    num_frames = len(reader)
+    print(f"==> [INFO] {args.recording}")
+    print(f"  * sensor type: {reader.sensor_type}")
+    print(f"  * frames: {num_frames}")
+    print(f"  * size: {os.path.getsize(args.recording) / 1e6:.1f} MB")
+    if reader.recovered:
+        print("  * index: recovered by scanning (file was not closed properly)")
+    if num_frames > 1:
+        # Timestamp is in hundreds of nanoseconds
+        duration = (reader.timestamps[-1] - reader.timestamps[0]) * 1e-7
+        print(f"  * duration: {duration:.1f} s ({(num_frames - 1) / duration:.1f} FPS)")
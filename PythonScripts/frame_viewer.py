@@ -0,0 +1,213 @@
+import sys
+import time
+import threading
+from functools import lru_cache
+import cv2
+import numpy as np
+
+# Define the viewer distance in meter for Depth image
+VIEW_DEPTH_DISTANCE = 2.0
+
+
+@lru_cache(maxsize=None)
+def depth_colormap_lut(
+    view_depth_distance=VIEW_DEPTH_DISTANCE, colormap=cv2.COLORMAP_JET
+):
+    """
+    Color of every uint16 depth value, the same as
+    `applyColorMap(convertScaleAbs(depth, alpha=255 / (distance * 1000)))`.
+
+    Entries are packed BGRA pixels (alpha 255) in a uint32, so colorizing a
+    frame is a single 4-byte gather.
+
+    :returns: (65536,) uint32 array
+    """
+    values = np.arange(65536, dtype=np.uint16).reshape(-1, 1)
+    bgr = cv2.applyColorMap(
+        cv2.convertScaleAbs(values, alpha=255 / (view_depth_distance * 1000)), colormap
+    ).reshape(-1, 3)
+    bgra = np.full((65536, 4), 255, dtype=np.uint8)
+    bgra[:, :3] = bgr
+    return bgra.view(np.uint32).reshape(-1)
+
+
+def depth_colormap_inverse(
+    view_depth_distance=VIEW_DEPTH_DISTANCE, colormap=cv2.COLORMAP_JET
+):
+    """
+    Inverse of `depth_colormap_lut` for `decolorize_depth`: the packed BGR
+    color of each of the 256 colormap levels, sorted, and the depth in
+    millimeters at the center of the level. The last level also holds
+    everything farther than `view_depth_distance` and maps to 0.
+
+    :returns: ((256,) uint32 sorted colors, (256,) uint16 depths)
+    """
+    levels = np.arange(256, dtype=np.uint8).reshape(-1, 1)
+    bgr = cv2.applyColorMap(levels, colormap).reshape(-1, 3).astype(np.uint32)
+    colors = bgr[:, 0] | bgr[:, 1] << 8 | bgr[:, 2] << 16
+    depths = np.round(np.arange(256) * view_depth_distance * 1000 / 255)
+    depths[-1] = 0
+    order = np.argsort(colors)
+    return colors[order], depths[order].astype(np.uint16)
+
+
+def decolorize_depth(image, inverse=None):
+    """
+    Approximate depth of an image colorized with `depth_colormap_lut`, e.g.
+    a depth PNG saved by `--save_image`. The depth is quantized to the 256
+    colormap levels (about 8 mm for 2 m), pixels of any other color get 0.
+
+    :param image: (height, width, 3) uint8 BGR image
+    :param inverse: see `depth_colormap_inverse`, the default one if not set
+    :returns: (height, width) uint16 depth in millimeters
+    """
+    if inverse is None:
+        inverse = depth_colormap_inverse()
+    colors, depths = inverse
+    bgr = image.astype(np.uint32)
+    packed = bgr[:, :, 0] | bgr[:, :, 1] << 8 | bgr[:, :, 2] << 16
+    index = np.searchsorted(colors, packed).clip(max=len(colors) - 1)
+    return np.where(colors[index] == packed, depths[index], 0).astype(np.uint16)
+
+
+def colorize_depth(depth, lut=None, out=None):
+    """
+    :param depth: (height, width[, 1]) uint16 depth image, may be a strided view
+    :param lut: see `depth_colormap_lut`, the default one if not set
+    :param out: optional (height, width) uint32 buffer to reuse
+    :returns: (height, width, 4) uint8 BGRA view of `out`
+    """
+    if lut is None:
+        lut = depth_colormap_lut()
+    if depth.ndim == 3:
+        depth = depth[:, :, 0]
+    if out is None:
+        out = np.empty(depth.shape, dtype=np.uint32)
+    np.take(lut, depth, out=out)
+    return out.view(np.uint8).reshape(depth.shape + (4,))
+
+
+class _Window:
+    __slots__ = ("image", "depth", "pending", "display", "colorized")
+
+    def __init__(self, image, depth) -> None:
+        self.image = np.empty_like(image)
+        self.depth = depth
+        self.pending = False
+        # owned by the display thread, swapped with `image` when drawn
+        self.display = np.empty_like(image)
+        self.colorized = np.empty(image.shape[:2], dtype=np.uint32)
+
+
+class FrameViewer:
+    """
+    Show frames decoupled from the receive loops, at a capped refresh rate.
+
+    `show` only copies the (downsampled) image into the window's buffer;
+    windows are drawn at most `max_fps` times per second with the latest
+    image of every window, so frames arriving in between are skipped (latest
+    frame wins). Depth images are colorized with the lookup table, and only
+    when they are drawn. Pressing "q" in a window sets `stop_requested`.
+
+    On Linux a display thread draws the windows. HighGUI windows have to be
+    driven from the main thread on macOS, and from the thread that created
+    them on Windows, so there `show` draws itself when a refresh is due and
+    has to be called from the main thread.
+    """
+
+    def __init__(
+        self,
+        max_fps=30.0,
+        downsample=1,
+        view_depth_distance=VIEW_DEPTH_DISTANCE,
+        threaded=None,
+    ) -> None:
+        """
+        :param max_fps: refresh rate cap of all windows
+        :param downsample: show every n-th row and column
+        :param threaded: draw from a display thread, by default on Linux only
+        """
+        self.period = 1.0 / max_fps if max_fps else 0.0
+        self.downsample = downsample
+        self.lut = depth_colormap_lut(view_depth_distance)
+        self.stop_requested = False
+        self.shown = 0
+        self.skipped = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._next_draw = 0.0
+        if threaded is None:
+            threaded = sys.platform.startswith("linux")
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(
+                target=self._display_loop, name="FrameViewer", daemon=True
+            )
+            self._thread.start()
+
+    def show(self, name, image, depth=False):
+        """
+        Queue `image` for window `name`, replacing any image not drawn yet.
+
+        :param depth: colorize `image` as a uint16 depth image
+        """
+        step = self.downsample
+        if step > 1:
+            image = image[::step, ::step]
+        with self._lock:
+            window = self._windows.get(name)
+            if window is None or window.image.shape != image.shape:
+                window = self._windows[name] = _Window(image, depth)
+            elif window.pending:
+                self.skipped += 1
+            np.copyto(window.image, image)
+            window.pending = True
+        if self._thread is not None:
+            self._wakeup.set()
+        elif time.perf_counter() >= self._next_draw:
+            self._next_draw = time.perf_counter() + self.period
+            self._draw()
+
+    def _display_loop(self):
+        while not self._closed:
+            self._wakeup.wait(0.1)
+            delay = self._next_draw - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._wakeup.clear()
+            self._next_draw = time.perf_counter() + self.period
+            self._draw()
+        if self.shown:
+            cv2.destroyAllWindows()
+
+    def _draw(self):
+        drawn = []
+        with self._lock:
+            for name, window in self._windows.items():
+                if window.pending:
+                    window.image, window.display = window.display, window.image
+                    window.pending = False
+                    drawn.append((name, window))
+        for name, window in drawn:
+            if window.depth:
+                image = colorize_depth(window.display, self.lut, window.colorized)
+            else:
+                image = window.display
+            cv2.imshow(name, image)
+            self.shown += 1
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            self.stop_requested = True
+
+    def close(self):
+        self._closed = True
+        if self._thread is None:
+            if self.shown:
+                cv2.destroyAllWindows()
+            return
+        self._wakeup.set()
+        self._thread.join()
+
+    def stats(self):
+        return {"shown": self.shown, "skipped": self.skipped}
@@ -0,0 +1,242 @@
+import struct
+import time
+import numpy as np
+from worker_pool import BoundedWorkerPool
+
+
+COLOR_CODECS = ["jpeg", "webp"]
+DEPTH_CODECS = ["png", "rvl"]
+# Default quality: JPEG/WebP quality (0-100) or PNG compression level (0-9)
+DEFAULT_QUALITY = {"jpeg": 90, "webp": 90, "png": 1, "rvl": None}
+
+# compressed_depth_image_transport prefixes the data with its ConfigHeader
+# (format, depthQuantA, depthQuantB); the quantization is unused for 16UC1
+DEPTH_CONFIG_HEADER = struct.pack("<iff", 0, 0.0, 0.0)
+RVL_SIZE_STRUCT = struct.Struct("<II")
+
+
+def compressed_format(codec, encoding):
+    """
+    `format` field of the sensor_msgs/CompressedImage, following the
+    compressed and compressedDepth image_transport plugins.
+    """
+    if codec in DEPTH_CODECS:
+        return f"{encoding}; compressedDepth {codec}"
+    return f"{encoding}; {codec} compressed {encoding}"
+
+
+def encode_image(codec, image, quality=None):
+    """
+    :param image: bgr8/bgra8 image for JPEG/WebP, 16-bit depth image for
+        PNG/RVL
+    :param quality: see DEFAULT_QUALITY, None for the default
+    :returns: encoded bytes, with the compressedDepth header for depth codecs
+    """
+    quality = DEFAULT_QUALITY[codec] if quality is None else quality
+    if codec == "rvl":
+        height, width = image.shape[:2]
+        return (
+            DEPTH_CONFIG_HEADER
+            + RVL_SIZE_STRUCT.pack(width, height)
+            + encode_rvl(image)
+        )
+    # OpenCV is only loaded by the codecs that need it
+    import cv2
+
+    if codec == "jpeg":
+        ext, params = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif codec == "webp":
+        ext, params = ".webp", [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    elif codec == "png":
+        ext, params = ".png", [cv2.IMWRITE_PNG_COMPRESSION, int(quality)]
+    else:
+        raise ValueError(f"Unknown codec '{codec}'")
+    ok, encoded = cv2.imencode(ext, image, params)
+    if not ok:
+        raise RuntimeError(f"Failed to encode {codec} image")
+    if codec == "png":
+        return DEPTH_CONFIG_HEADER + encoded.tobytes()
+    return encoded.tobytes()
+
+
+def decode_image(codec, data):
+    """
+    Inverse of `encode_image`.
+    """
+    if codec in DEPTH_CODECS:
+        data = memoryview(data)[len(DEPTH_CONFIG_HEADER) :]
+    if codec == "rvl":
+        width, height = RVL_SIZE_STRUCT.unpack_from(data)
+        return decode_rvl(data[RVL_SIZE_STRUCT.size :], width, height)
+    import cv2
+
+    flags = cv2.IMREAD_UNCHANGED
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def encode_rvl(depth):
+    """
+    RVL lossless depth compression (A. D. Wilson, "Fast Lossless Depth Image
+    Compression", 2017), bit-compatible with compressed_depth_image_transport.
+
+    The image is coded as alternating runs of zero and non-zero pixels;
+    non-zero pixels are zigzag-coded deltas to the previous non-zero pixel,
+    and every number is a variable-length sequence of 4-bit nibbles packed
+    into little-endian 32-bit words. The whole stream is built with NumPy
+    array operations instead of a per-pixel loop.
+    """
+    pixels = np.ascontiguousarray(depth).reshape(-1)
+    nonzero = pixels != 0
+
+    # runs: (zeros, nonzeros) pairs covering the whole image
+    edges = np.flatnonzero(nonzero[1:] != nonzero[:-1]) + 1
+    lengths = np.diff(edges, prepend=0, append=len(pixels))
+    if len(pixels) and nonzero[0]:
+        lengths = np.concatenate(([0], lengths))
+    if len(lengths) % 2:
+        lengths = np.concatenate((lengths, [0]))
+    zeros, nonzeros = lengths[0::2], lengths[1::2]
+
+    values = pixels[nonzero].astype(np.int32)
+    deltas = np.diff(values, prepend=np.zeros(1, dtype=np.int32))
+    deltas = ((deltas << 1) ^ (deltas >> 31)).view(np.uint32)
+
+    # token stream: zeros, nonzeros, then the deltas of the non-zero run
+    num_pairs = len(zeros)
+    tokens = np.empty(2 * num_pairs + len(deltas), dtype=np.uint32)
+    pair_starts = 2 * np.arange(num_pairs) + np.cumsum(nonzeros) - nonzeros
+    is_delta = np.ones(len(tokens), dtype=bool)
+    is_delta[pair_starts] = False
+    is_delta[pair_starts + 1] = False
+    tokens[pair_starts] = zeros
+    tokens[pair_starts + 1] = nonzeros
+    tokens[is_delta] = deltas
+
+    # variable-length nibbles, 3 bits each, low bits first, high bit set if
+    # more follow; most tokens fit in one nibble
+    counts = np.ones(len(tokens), dtype=np.int32)
+    limit, max_token = 8, int(tokens.max()) if len(tokens) else 0
+    while limit <= max_token:
+        counts += tokens >= limit
+        limit <<= 3
+    offsets = np.cumsum(counts) - counts
+    num_nibbles = int(offsets[-1] + counts[-1]) if len(counts) else 0
+    nibbles = np.zeros((num_nibbles + 7) // 8 * 8, dtype=np.uint8)
+    nibbles[offsets] = (tokens & 0x7) | ((counts > 1) << 3)
+    for i in range(1, int(counts.max()) if len(counts) else 0):
+        longer = np.flatnonzero(counts > i)
+        nibbles[offsets[longer] + i] = ((tokens[longer] >> (3 * i)) & 0x7) | (
+            (counts[longer] > i + 1) << 3
+        )
+
+    # first nibble in the most significant bits of each little-endian word
+    packed = (nibbles[0::2] << 4) | nibbles[1::2]
+    return packed.reshape(-1, 4)[:, ::-1].tobytes()
+
+
+def decode_rvl(data, width, height):
+    """
+    Inverse of `encode_rvl`.
+
+    :returns: (height, width) uint16 array
+    """
+    num_pixels = width * height
+    words = np.frombuffer(data, dtype="<u4")
+    shifts = np.arange(28, -1, -4, dtype=np.uint32)
+    nibbles = ((words[:, None] >> shifts) & 0xF).reshape(-1).astype(np.int64)
+
+    # split the nibble stream into numbers at nibbles without the high bit,
+    # the zero nibbles padding the last word decode as unused zeros
+    ends = np.flatnonzero(nibbles < 8)
+    nibbles = nibbles[: ends[-1] + 1] if len(ends) else nibbles[:0]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    number = np.zeros(len(nibbles), dtype=np.int64)
+    number[starts[1:]] = 1
+    position = np.arange(len(nibbles)) - starts[np.cumsum(number)]
+    bits = (nibbles & 0x7) << (3 * position)
+    tokens = np.add.reduceat(bits, starts) if len(ends) else bits
+
+    # walk the (zeros, nonzeros) pairs, one step per run
+    output = np.zeros(num_pixels, dtype=np.uint16)
+    tokens_list = tokens.tolist()
+    pixel_starts, token_starts, run_lengths = [], [], []
+    pixel = token = 0
+    while pixel < num_pixels:
+        zeros, nonzeros = tokens_list[token], tokens_list[token + 1]
+        token += 2
+        pixel += zeros
+        if nonzeros:
+            pixel_starts.append(pixel)
+            token_starts.append(token)
+            run_lengths.append(nonzeros)
+            pixel += nonzeros
+            token += nonzeros
+    if run_lengths:
+        run_lengths = np.array(run_lengths)
+        within_run = np.arange(run_lengths.sum()) - np.repeat(
+            np.cumsum(run_lengths) - run_lengths, run_lengths
+        )
+        deltas = tokens[np.repeat(token_starts, run_lengths) + within_run]
+        deltas = (deltas >> 1) ^ -(deltas & 1)
+        output[np.repeat(pixel_starts, run_lengths) + within_run] = np.cumsum(deltas)
+    return output.reshape(height, width)
+
+
+class CompressedImagePool(BoundedWorkerPool):
+    """
+    Encode images on worker threads and hand the results to a callback.
+
+    `cv2.imencode` and most of the RVL array work release the GIL. The
+    default policy drops the oldest queued frame, so a slow encoder costs
+    compressed frames rather than receive loop time.
+    """
+
+    def __init__(
+        self, callback, num_workers=2, queue_size=4, policy="drop_oldest"
+    ) -> None:
+        """
+        :param callback: called on a worker thread as
+            `callback(context, codec, data)` with the encoded bytes
+        """
+        self.callback = callback
+        self.encoded = 0
+        self.encode_time = 0.0
+        self.encoded_bytes = 0
+        super().__init__(num_workers, queue_size, policy, name="ImageEncoder")
+
+    def submit(self, codec, image, context=None, quality=None, copy=True):
+        """
+        :param copy: copy the image first, required when it is a view of a
+            receive buffer that will be reused
+        :returns: True if queued, False if dropped
+        """
+        if copy:
+            image = image.copy()
+        return self._submit((codec, image, context, quality))
+
+    def _process(self, job):
+        codec, image, context, quality = job
+        start = time.perf_counter()
+        data = encode_image(codec, image, quality)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.encoded += 1
+            self.encode_time += elapsed
+            self.encoded_bytes += len(data)
+        self.callback(context, codec, data)
+
+    def _report_failure(self, job, err):
+        print(f"==> [ERROR] Failed to encode {job[0]} image!!! ({err})")
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            encoded = max(self.encoded, 1)
+            stats.update(
+                {
+                    "encoded": self.encoded,
+                    "encode_ms_avg": round(self.encode_time / encoded * 1e3, 3),
+                    "bytes_avg": self.encoded_bytes // encoded,
+                }
+            )
+        return stats
@@ -0,0 +1,74 @@
+import os
+import time
+import cv2
+from frame_viewer import colorize_depth
+from worker_pool import BoundedWorkerPool
+
+
+class AsyncImageWriter(BoundedWorkerPool):
+    """
+    Encode and write images on a pool of worker threads.
+
+    `cv2.imencode` releases the GIL, so a few threads are enough to keep
+    JPEG/PNG encoding and disk writes out of the receive loop. Jobs go through
+    a bounded queue; when it is full the backpressure policy decides whether
+    `submit` blocks, evicts the oldest queued image or drops the new one.
+    """
+
+    def __init__(self, num_workers=2, queue_size=32, policy="block") -> None:
+        # Per-stage counters, guarded by _lock
+        self.written = 0
+        self.encode_time = 0.0
+        self.max_encode_time = 0.0
+        self.write_time = 0.0
+        super().__init__(num_workers, queue_size, policy, name="ImageWriter")
+
+    def submit(self, file_path, image, copy=True, colormap=None):
+        """
+        Queue `image` to be written to `file_path`.
+
+        :param copy: copy the image first, required when it is a view of a
+            receive buffer that will be reused
+        :param colormap: depth colormap LUT (see
+            `frame_viewer.depth_colormap_lut`), colorizes the uint16 image on
+            the worker before encoding
+        :returns: True if queued, False if dropped
+        """
+        if copy:
+            image = image.copy()
+        return self._submit((file_path, image, colormap))
+
+    def _process(self, job):
+        file_path, image, colormap = job
+        start = time.perf_counter()
+        if colormap is not None:
+            image = cv2.cvtColor(colorize_depth(image, colormap), cv2.COLOR_BGRA2BGR)
+        ok, encoded = cv2.imencode(os.path.splitext(file_path)[1], image)
+        encoded_at = time.perf_counter()
+        if not ok:
+            raise RuntimeError(f"Failed to encode {file_path}")
+        with open(file_path, "wb") as f:
+            f.write(encoded)
+        written_at = time.perf_counter()
+        with self._lock:
+            self.written += 1
+            self.encode_time += encoded_at - start
+            self.max_encode_time = max(self.max_encode_time, encoded_at - start)
+            self.write_time += written_at - encoded_at
+
+    def _report_failure(self, job, err):
+        print(f"==> [ERROR] Failed to save image!!! ({err})")
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            written = max(self.written, 1)
+            stats.update(
+                {
+                    "written": self.written,
+                    "encode_ms_avg": round(self.encode_time / written * 1e3, 3),
+                    "encode_ms_max": round(self.max_encode_time * 1e3, 3),
+                    "write_ms_avg": round(self.write_time / written * 1e3, 3),
+                }
+            )
+        return stats
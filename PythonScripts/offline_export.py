@@ -0,0 +1,1044 @@
+import io
+import os
+import mmap
+import time
+import shutil
+import argparse
+import multiprocessing as mp
+import numpy as np
+from point_cloud import AHAT_INVALID_DEPTH
+from image_codecs import DEFAULT_QUALITY
+from pose_utils import (
+    DEFAULT_RIG2DEPTH,
+    filetime_stamps,
+    interpolate_pose,
+    load_depth_extrinsics_from_yaml,
+    ros_camera_chain,
+    trajectory_to_tf,
+)
+from sensor_protocol import PIXEL_FORMATS, UNIX_EPOCH, header_poses, image_view
+
+
+BAG_COMPRESSIONS = ["none", "bz2", "lz4"]
+# TUM RGB-D depth PNGs hold 5000 units per meter, the frames millimeters
+TUM_DEPTH_FACTOR = 5
+# Color and depth frames further apart (seconds) are not associated, the
+# default of the TUM associate.py tool
+MAX_DIFFERENCE = 0.02
+# Image files and pose logs of a `--save_image` session, by sensor type
+SESSION_IMAGES = {"color": ("color_", ".jpg"), "depth": ("depth_", ".png")}
+SESSION_POSE_LOGS = {
+    "color": "pv2WorldTransform.csv",
+    "depth": "rig2worldTransform.csv",
+}
+
+
+def ros_stamp(timestamp):
+    """
+    :returns: exact (secs, nsecs) UNIX time of a FILETIME Timestamp
+    """
+    secs, ticks = divmod(int(timestamp) - UNIX_EPOCH * 10**7, 10**7)
+    return secs, ticks * 100
+
+
+class ExportStream:
+    """
+    One sensor stream of a recording, a raw stream capture or a saved session.
+
+    Frames are read by index in the export workers: recordings and captures
+    are memory-mapped and viewed in place (`payload_offsets`, and the width,
+    height, PixelStride and RowStride of every frame in `frame_shapes`),
+    saved sessions are decoded from their `image_files`. `poses` are the
+    header poses (pv2world or rig2world), None if the session has no pose
+    log, and `intrinsics` the fx, fy, cx, cy of color frames.
+    """
+
+    def __init__(
+        self,
+        sensor_type,
+        timestamps,
+        poses=None,
+        intrinsics=None,
+        file_path=None,
+        payload_offsets=None,
+        frame_shapes=None,
+        image_files=None,
+        image_size=None,
+    ) -> None:
+        self.sensor_type = sensor_type
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.poses = poses
+        self.intrinsics = intrinsics
+        self.file_path = file_path
+        self.payload_offsets = payload_offsets
+        self.frame_shapes = frame_shapes
+        self.image_files = image_files
+        self.image_size = image_size
+        # set by the exporter: ROS camera-to-world transforms and the TF
+        # (stamps, translations, quaternions)
+        self.cam2world = None
+        self.tf = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def size(self, i):
+        """
+        :returns: (width, height) of frame `i`
+        """
+        if self.frame_shapes is not None:
+            return tuple(self.frame_shapes[i, :2].tolist())
+        return self.image_size
+
+    @property
+    def duration(self):
+        return (self.timestamps[-1] - self.timestamps[0]) * 1e-7 if len(self) else 0.0
+
+    @property
+    def source(self):
+        return self.file_path or os.path.dirname(self.image_files[0])
+
+
+def _frame_shapes(headers):
+    fields = ("ImageWidth", "ImageHeight", "PixelStride", "RowStride")
+    return np.stack([headers[field] for field in fields], axis=1).astype(np.int64)
+
+
+def open_recording(file_path):
+    """
+    ExportStream of a `--record` recording (.hl2rec).
+    """
+    from frame_recorder import RecordingReader
+
+    reader = RecordingReader(file_path)
+    try:
+        headers = reader.headers()
+        payload_offsets = reader.index["offset"].astype(np.int64) + reader.header_size
+        return ExportStream(
+            reader.sensor_type,
+            reader.timestamps.copy(),
+            poses=header_poses(headers).copy(),
+            intrinsics=(
+                headers["Intrinsics"].copy() if reader.sensor_type == "color" else None
+            ),
+            file_path=file_path,
+            payload_offsets=payload_offsets,
+            frame_shapes=_frame_shapes(headers),
+        )
+    finally:
+        reader.close()
+
+
+def open_capture(file_path, sensor_type):
+    """
+    ExportStream of a raw stream capture, the frames exactly as streamed
+    (header + payload, repeated).
+    """
+    from sensor_protocol import decode_stream_headers
+
+    with open(file_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        headers, payload_offsets = decode_stream_headers(data, sensor_type)
+    finally:
+        data.close()
+    return ExportStream(
+        sensor_type,
+        headers["Timestamp"].copy(),
+        poses=header_poses(headers).copy(),
+        intrinsics=headers["Intrinsics"].copy() if sensor_type == "color" else None,
+        file_path=file_path,
+        payload_offsets=payload_offsets,
+        frame_shapes=_frame_shapes(headers),
+    )
+
+
+def open_session(folder):
+    """
+    ExportStreams of a `--save_image` output folder: one image folder per
+    stream (`<sensor_type>/` of SensorStreamingClient, `<device>_<sensor_type>/`
+    of the async client and the pipeline) and its pose log next to it. Frames
+    without a pose log row are skipped; without a pose log (pipeline
+    `--save_image`) every image is exported, without poses.
+    """
+    import cv2
+    from pose_log import load_pose_log
+
+    streams = []
+    for name in sorted(os.listdir(folder)):
+        image_folder = os.path.join(folder, name)
+        if not os.path.isdir(image_folder):
+            continue
+        files = {}
+        for file_name in os.listdir(image_folder):
+            for sensor_type, (prefix, extension) in SESSION_IMAGES.items():
+                stamp = file_name[len(prefix) : -len(extension)]
+                if file_name.startswith(prefix) and file_name.endswith(extension):
+                    if stamp.isdigit():
+                        files.setdefault(sensor_type, {})[int(stamp)] = os.path.join(
+                            image_folder, file_name
+                        )
+        for sensor_type, images in files.items():
+            log_name = SESSION_POSE_LOGS[sensor_type]
+            log_path = os.path.join(
+                folder, log_name if name == sensor_type else f"{name}_{log_name}"
+            )
+            poses = intrinsics = None
+            if os.path.exists(log_path):
+                log = load_pose_log(log_path)
+                keep = np.array(
+                    [stamp in images for stamp in log["timestamps"].tolist()],
+                    dtype=bool,
+                )
+                timestamps = log["timestamps"][keep]
+                poses = log["poses"][keep]
+                if "intrinsics" in log:
+                    # fx, fy, cx, cy back from the camera matrices
+                    matrices = log["intrinsics"][keep]
+                    intrinsics = matrices[:, [0, 1, 0, 1], [0, 1, 2, 2]]
+            else:
+                timestamps = np.array(sorted(images), dtype=np.int64)
+            if not len(timestamps):
+                continue
+            image_files = [images[stamp] for stamp in timestamps.tolist()]
+            height, width = cv2.imread(image_files[0], cv2.IMREAD_UNCHANGED).shape[:2]
+            streams.append(
+                ExportStream(
+                    sensor_type,
+                    timestamps,
+                    poses=poses,
+                    intrinsics=intrinsics,
+                    image_files=image_files,
+                    image_size=(width, height),
+                )
+            )
+    return streams
+
+
+def open_inputs(paths, sensor_type=None):
+    """
+    ExportStreams of session folders, recordings (.hl2rec) and raw captures.
+    The sensor type of a capture is `sensor_type`, or guessed from its name.
+    """
+    streams = []
+    for path in paths:
+        if os.path.isdir(path):
+            streams += open_session(path)
+        elif path.endswith(".hl2rec"):
+            streams.append(open_recording(path))
+        else:
+            capture_type = sensor_type
+            if capture_type is None:
+                file_name = os.path.basename(path)
+                named = [name for name in SESSION_IMAGES if name in file_name]
+                if len(named) != 1:
+                    raise ValueError(f"Sensor type of the capture {path} is unknown")
+                capture_type = named[0]
+            streams.append(open_capture(path, capture_type))
+    return streams
+
+
+class _RosMessages:
+    """
+    rospy and the message classes written to bags. Only the ROS Python
+    packages are needed, no master is contacted.
+    """
+
+    def __init__(self) -> None:
+        try:
+            import rospy
+            from geometry_msgs.msg import TransformStamped
+            from sensor_msgs.msg import CameraInfo, Image, PointCloud2, PointField
+            from tf2_msgs.msg import TFMessage
+        except ImportError as error:
+            raise ImportError(
+                f"Writing bags needs the ROS Python packages ({error.name} is "
+                "missing), source the ROS setup.bash first"
+            ) from error
+        self.Time = rospy.Time
+        self.TransformStamped = TransformStamped
+        self.TFMessage = TFMessage
+        self.Image = Image
+        self.CameraInfo = CameraInfo
+        self.PointCloud2 = PointCloud2
+        self.PointField = PointField
+
+    @property
+    def types(self):
+        return {
+            cls._type: cls
+            for cls in (self.TFMessage, self.Image, self.CameraInfo, self.PointCloud2)
+        }
+
+
+class _ExportWorker:
+    """
+    Per-process state of the export workers: the mapped input files, the
+    colormap inverse of saved depth, the point cloud unprojector and the
+    depth registrations, all created on first use.
+    """
+
+    def __init__(
+        self,
+        streams,
+        serial,
+        rig2depth,
+        depth_lut,
+        point_clouds,
+        cloud_stride,
+        view_depth_distance,
+    ) -> None:
+        self.streams = streams
+        self.serial = serial
+        self.rig2depth = rig2depth
+        self.depth_lut = depth_lut
+        self.point_clouds = point_clouds
+        self.cloud_stride = cloud_stride
+        self.view_depth_distance = view_depth_distance
+        self._maps = {}
+        self._inverse = None
+        self._unprojector = None
+        self._registrations = {}
+        self._ros = None
+
+    def run(self, task, *args):
+        return getattr(self, task)(*args)
+
+    def payload(self, stream, i):
+        view = self._maps.get(stream.file_path)
+        if view is None:
+            with open(stream.file_path, "rb") as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._maps[stream.file_path] = view
+        height, row_stride = stream.frame_shapes[i, [1, 3]].tolist()
+        offset = int(stream.payload_offsets[i])
+        return view[offset : offset + height * row_stride]
+
+    def image(self, stream, i):
+        """
+        :returns: (height, width, channels) uint8 color image or (height,
+            width) uint16 depth image of frame `i`, a view of the mapped
+            file for recordings and captures
+        """
+        if stream.image_files is None:
+            shape = stream.frame_shapes[i].tolist()
+            image = image_view(self.payload(stream, i), *shape)
+            return image[:, :, 0] if stream.sensor_type == "depth" else image
+
+        import cv2
+
+        image = cv2.imread(stream.image_files[i], cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise RuntimeError(f"Failed to read {stream.image_files[i]}")
+        if stream.sensor_type == "depth" and image.dtype != np.uint16:
+            from frame_viewer import decolorize_depth, depth_colormap_inverse
+
+            if self._inverse is None:
+                self._inverse = depth_colormap_inverse(self.view_depth_distance)
+            image = decolorize_depth(image, self._inverse)
+        return image
+
+    def registration(self, width, height):
+        registration = self._registrations.get((width, height))
+        if registration is None:
+            from registration import DepthRegistration
+
+            registration = self._registrations[(width, height)] = DepthRegistration(
+                self.depth_lut, self.rig2depth, width=width, height=height
+            )
+        return registration
+
+    # Dataset layouts
+
+    def write_color(self, s, i, file_path):
+        stream = self.streams[s]
+        if stream.image_files is not None and (
+            os.path.splitext(stream.image_files[i])[1] == os.path.splitext(file_path)[1]
+        ):
+            # saved images are copied without decoding
+            shutil.copyfile(stream.image_files[i], file_path)
+            return
+
+        import cv2
+
+        image = self.image(stream, i)
+        if image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        self._imwrite(file_path, image)
+
+    def write_depth(self, s, i, file_path, factor):
+        self._write_depth(self.image(self.streams[s], i), file_path, factor)
+
+    def write_registered(self, c, ci, d, di, rig2world, file_path, factor):
+        color, depth = self.streams[c], self.streams[d]
+        registered = self.registration(*color.size(ci)).register(
+            self.image(depth, di), rig2world, color.poses[ci], color.intrinsics[ci]
+        )
+        self._write_depth(registered, file_path, factor)
+
+    def _write_depth(self, depth, file_path, factor):
+        depth = np.where(depth < AHAT_INVALID_DEPTH, depth, 0).astype(np.uint16)
+        depth *= factor
+        self._imwrite(file_path, depth)
+
+    @staticmethod
+    def _imwrite(file_path, image):
+        import cv2
+
+        # the fast PNG level and JPEG quality of the compressed topics
+        if file_path.endswith(".png"):
+            params = [cv2.IMWRITE_PNG_COMPRESSION, DEFAULT_QUALITY["png"]]
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, DEFAULT_QUALITY["jpeg"]]
+        if not cv2.imwrite(file_path, image, params):
+            raise RuntimeError(f"Failed to write {file_path}")
+
+    # Bags
+
+    def bag_frame(self, s, i):
+        """
+        Messages of frame `i` of stream `s`, as the publisher would send them.
+
+        :returns: list of (topic, (secs, nsecs), type, serialized message,
+            md5sum) for `rosbag.Bag.write(raw=True)`
+        """
+        ros = self._ros
+        if ros is None:
+            ros = self._ros = _RosMessages()
+        stream = self.streams[s]
+        sensor_type = stream.sensor_type
+        timestamp = int(stream.timestamps[i])
+        stamp = ros.Time(*ros_stamp(timestamp))
+        world_frame_id = f"{self.serial}_world"
+        frame_id = f"{self.serial}_{sensor_type}_optical_frame"
+        topic = f"/{self.serial}/sensor_{sensor_type}"
+        messages = []
+
+        if stream.tf is not None:
+            stamps, translations, quaternions = stream.tf
+            transform = ros.TransformStamped()
+            transform.header.stamp = ros.Time(*ros_stamp(stamps[i]))
+            transform.header.frame_id = world_frame_id
+            transform.child_frame_id = frame_id
+            (
+                transform.transform.translation.x,
+                transform.transform.translation.y,
+                transform.transform.translation.z,
+            ) = translations[i].tolist()
+            (
+                transform.transform.rotation.x,
+                transform.transform.rotation.y,
+                transform.transform.rotation.z,
+                transform.transform.rotation.w,
+            ) = quaternions[i].tolist()
+            messages.append(("/tf", ros.TFMessage(transforms=[transform])))
+
+        msg = ros.Image()
+        msg.header.stamp = stamp
+        msg.header.frame_id = frame_id
+        msg.is_bigendian = 0
+        if stream.image_files is None:
+            # straight from the payload, padded rows included
+            width, height, pixel_stride, row_stride = stream.frame_shapes[i].tolist()
+            msg.data = bytes(self.payload(stream, i))
+            image = None
+        else:
+            image = np.ascontiguousarray(self.image(stream, i))
+            height, width = image.shape[:2]
+            row_stride = image.strides[0]
+            pixel_stride = row_stride // width
+            msg.data = image.tobytes()
+        msg.height = height
+        msg.width = width
+        msg.encoding = PIXEL_FORMATS[pixel_stride][2]
+        msg.step = row_stride
+        messages.append((f"{topic}/image_raw", msg))
+
+        if stream.intrinsics is not None:
+            fx, fy, cx, cy = stream.intrinsics[i].tolist()
+            msg = ros.CameraInfo()
+            msg.header.stamp = stamp
+            msg.header.frame_id = frame_id
+            msg.width = width
+            msg.height = height
+            msg.distortion_model = "plumb_bob"
+            msg.D = [0.0, 0.0, 0.0, 0.0, 0.0]
+            msg.K = [fx, 0, cx, 0, fy, cy, 0, 0, 1]
+            msg.R = [1, 0, 0, 0, 1, 0, 0, 0, 1]
+            msg.P = [fx, 0, cx, 0, 0, fy, cy, 0, 0, 0, 1, 0]
+            messages.append((f"{topic}/camera_info", msg))
+
+        if (
+            sensor_type == "depth"
+            and self.point_clouds
+            and stream.cam2world is not None
+        ):
+            if self._unprojector is None:
+                from point_cloud import DepthUnprojector
+
+                self._unprojector = DepthUnprojector(
+                    self.depth_lut, stride=self.cloud_stride
+                )
+            if image is None:
+                image = self.image(stream, i)
+            points = self._unprojector.unproject(image, stream.cam2world[i])
+            msg = ros.PointCloud2()
+            msg.header.stamp = stamp
+            msg.header.frame_id = world_frame_id
+            msg.height = 1
+            msg.width = len(points)
+            msg.fields = [
+                ros.PointField(
+                    name=name, offset=4 * k, datatype=ros.PointField.FLOAT32, count=1
+                )
+                for k, name in enumerate("xyz")
+            ]
+            msg.is_bigendian = False
+            msg.point_step = 12
+            msg.row_step = msg.point_step * len(points)
+            msg.is_dense = True
+            msg.data = points.tobytes()
+            messages.append((f"/{self.serial}/sensor_depth/points", msg))
+
+        serialized = []
+        for topic, msg in messages:
+            buffer = io.BytesIO()
+            msg.serialize(buffer)
+            serialized.append(
+                (topic, ros_stamp(timestamp), msg._type, buffer.getvalue(), msg._md5sum)
+            )
+        return serialized
+
+
+# Export state of a worker process, set by _init_worker
+_worker = None
+
+
+def _init_worker(config):
+    global _worker
+    _worker = _ExportWorker(**config)
+
+
+def _run_chunk(tasks):
+    return [_worker.run(*task) for task in tasks]
+
+
+class OfflineExporter:
+    """
+    Convert the streams of one device (see `open_inputs`) to a rosbag or an
+    RGB-D dataset layout, without a ROS master.
+
+    Poses go through the same chains as `HoloLensMessagePublisher`
+    (HoloWorld2RosWorld, then HoloPV2RosCam for color or depth2rig for
+    depth), so bags carry the topics, frame ids and TF the live publisher
+    sends. Frames are read, converted and encoded in chunks of
+    `chunk_frames` on `workers` processes (0 to run in this process); only
+    writing the bag and the index files stays in the main process.
+
+    :param depth_lut: AHaT unit rays (see `point_cloud.load_depth_lut`),
+        needed for point clouds and to register depth
+    :param point_clouds: add the depth point clouds to bags
+    :param tf_smoothing: see `pose_filter.filter_trajectory`, like the
+        publisher --tf_smoothing/--tf_prediction/--tf_window
+    """
+
+    def __init__(
+        self,
+        streams,
+        serial="hololens2",
+        rig2depth=DEFAULT_RIG2DEPTH,
+        depth_lut=None,
+        point_clouds=False,
+        cloud_stride=1,
+        max_difference=MAX_DIFFERENCE,
+        view_depth_distance=2.0,
+        tf_smoothing=0.0,
+        tf_prediction=None,
+        tf_window=8,
+        workers=None,
+        chunk_frames=8,
+    ) -> None:
+        self.streams = [stream for stream in streams if len(stream)]
+        self.by_type = {}
+        for stream in self.streams:
+            if stream.sensor_type in self.by_type:
+                raise ValueError(
+                    f"Several {stream.sensor_type} streams, export one device at a time"
+                )
+            self.by_type[stream.sensor_type] = stream
+        self.serial = serial
+        self.rig2depth = rig2depth
+        self.depth_lut = depth_lut
+        self.point_clouds = point_clouds and depth_lut is not None
+        self.cloud_stride = cloud_stride
+        self.max_difference = max_difference
+        self.view_depth_distance = view_depth_distance
+        self.workers = os.cpu_count() if workers is None else workers
+        self.chunk_frames = chunk_frames
+
+        for stream in self.streams:
+            if stream.poses is None:
+                continue
+            chain = ros_camera_chain(stream.sensor_type, rig2depth)
+            stream.cam2world = chain.apply_batch(stream.poses)
+            stamps = stream.timestamps
+            translations, quaternions = trajectory_to_tf(stream.cam2world)
+            if tf_smoothing or tf_prediction is not None:
+                from pose_filter import filter_trajectory
+
+                stamps, translations, quaternions = filter_trajectory(
+                    stamps,
+                    translations,
+                    quaternions,
+                    smoothing=tf_smoothing,
+                    prediction=tf_prediction,
+                    window=tf_window,
+                )
+            stream.tf = (stamps, translations, quaternions)
+
+    @property
+    def color(self):
+        return self.by_type.get("color")
+
+    @property
+    def depth(self):
+        return self.by_type.get("depth")
+
+    @property
+    def frames(self):
+        return sum(len(stream) for stream in self.streams)
+
+    @property
+    def duration(self):
+        """
+        Seconds of device time covered by the streams.
+        """
+        first = min(int(stream.timestamps[0]) for stream in self.streams)
+        last = max(int(stream.timestamps[-1]) for stream in self.streams)
+        return (last - first) * 1e-7
+
+    def _run(self, tasks):
+        """
+        Run (task, *args) tuples on the workers, yielding the results in order.
+        """
+        chunks = [
+            tasks[i : i + self.chunk_frames]
+            for i in range(0, len(tasks), self.chunk_frames)
+        ]
+        config = dict(
+            streams=self.streams,
+            serial=self.serial,
+            rig2depth=self.rig2depth,
+            depth_lut=self.depth_lut,
+            point_clouds=self.point_clouds,
+            cloud_stride=self.cloud_stride,
+            view_depth_distance=self.view_depth_distance,
+        )
+        if not self.workers:
+            _init_worker(config)
+            for chunk in chunks:
+                yield from _run_chunk(chunk)
+            return
+        pool = mp.Pool(self.workers, initializer=_init_worker, initargs=(config,))
+        with pool:
+            for results in pool.imap(_run_chunk, chunks):
+                yield from results
+
+    def associate(self):
+        """
+        Closest depth frame of every color frame, within `max_difference`.
+
+        :returns: (color indices, depth indices)
+        """
+        color_timestamps = self.color.timestamps
+        depth_timestamps = self.depth.timestamps
+        right = np.searchsorted(depth_timestamps, color_timestamps).clip(
+            0, len(depth_timestamps) - 1
+        )
+        left = (right - 1).clip(0)
+        closest = np.where(
+            np.abs(color_timestamps - depth_timestamps[left])
+            < np.abs(color_timestamps - depth_timestamps[right]),
+            left,
+            right,
+        )
+        offsets = np.abs(color_timestamps - depth_timestamps[closest])
+        keep = np.flatnonzero(offsets <= self.max_difference * 1e7)
+        return keep, closest[keep]
+
+    def _registration_tasks(self, file_path, factor):
+        """
+        Register the closest depth frame into every color frame, with the
+        depth pose interpolated to the color Timestamp like `rgbd_sync`.
+
+        :param file_path: (pair index, color index) -> depth file path
+        :returns: (color indices, tasks)
+        """
+        from rgbd_sync import MAX_INTERPOLATION_GAP_MS, TICKS_PER_MS
+
+        color, depth = self.color, self.depth
+        if self.depth_lut is None:
+            raise ValueError("Registering depth needs the AHaT depth LUT")
+        if color.intrinsics is None or color.poses is None or depth.poses is None:
+            raise ValueError("Registering depth needs the color and depth poses")
+        c, d = self.streams.index(color), self.streams.index(depth)
+        color_indices, depth_indices = self.associate()
+        tasks = []
+        pairs = zip(color_indices.tolist(), depth_indices.tolist())
+        for k, (ci, di) in enumerate(pairs):
+            timestamp = color.timestamps[ci]
+            d0 = di - 1 if depth.timestamps[di] > timestamp else di
+            d0, d1 = max(d0, 0), min(d0 + 1, len(depth) - 1)
+            span = depth.timestamps[d1] - depth.timestamps[d0]
+            if 0 < span <= MAX_INTERPOLATION_GAP_MS * TICKS_PER_MS:
+                t = np.clip((timestamp - depth.timestamps[d0]) / span, 0.0, 1.0)
+                rig2world = interpolate_pose(depth.poses[d0], depth.poses[d1], t)
+            else:
+                rig2world = depth.poses[di]
+            tasks.append(
+                ("write_registered", c, ci, d, di, rig2world, file_path(k, ci), factor)
+            )
+        return color_indices, tasks
+
+    def write_bag(self, file_path, compression="none"):
+        """
+        Write every frame, merged by Timestamp, with its TF, CameraInfo and
+        point cloud messages.
+
+        :returns: {topic: message count}
+        """
+        try:
+            import rosbag
+        except ImportError as error:
+            raise ImportError(
+                "Writing bags needs the ROS rosbag package, source the ROS "
+                "setup.bash first"
+            ) from error
+        ros = _RosMessages()
+        types = ros.types
+
+        order = sorted(
+            (int(timestamp), s, i)
+            for s, stream in enumerate(self.streams)
+            for i, timestamp in enumerate(stream.timestamps.tolist())
+        )
+        counts = {}
+        with rosbag.Bag(file_path, "w", compression=compression) as bag:
+            for messages in self._run([("bag_frame", s, i) for _, s, i in order]):
+                for topic, stamp, msg_type, data, md5sum in messages:
+                    bag.write(
+                        topic,
+                        (msg_type, data, md5sum, types[msg_type]),
+                        ros.Time(*stamp),
+                        raw=True,
+                    )
+                    counts[topic] = counts.get(topic, 0) + 1
+        return counts
+
+    def write_tum(self, folder, register=False, rgb_format="png"):
+        """
+        TUM RGB-D layout: rgb/ and depth/ images named by their UNIX time,
+        rgb.txt, depth.txt, associations.txt and groundtruth.txt with the
+        ROS optical frame poses of the color camera (of the depth camera
+        without color). Depth PNGs hold 5000 units per meter.
+
+        :param register: register the depth into every color frame, so both
+            share the color intrinsics and associations are exact
+        :param rgb_format: "png" or "jpg" for recorded color frames, saved
+            JPEGs are always copied as they are
+        :returns: {file list: entries}
+        """
+        color, depth = self.color, self.depth
+        lists = {}
+        tasks = []
+        if color is not None:
+            os.makedirs(os.path.join(folder, "rgb"), exist_ok=True)
+            extension = ".jpg" if color.image_files is not None else f".{rgb_format}"
+            stamps = filetime_stamps(color.timestamps)
+            rgb = [f"rgb/{stamp:.6f}{extension}" for stamp in stamps.tolist()]
+            lists["rgb.txt"] = list(zip(stamps.tolist(), rgb))
+            s = self.streams.index(color)
+            tasks += [
+                ("write_color", s, i, os.path.join(folder, name))
+                for i, name in enumerate(rgb)
+            ]
+        if depth is not None:
+            os.makedirs(os.path.join(folder, "depth"), exist_ok=True)
+            if register and color is not None:
+                color_indices, registered = self._registration_tasks(
+                    lambda k, ci: os.path.join(folder, f"depth/{stamps[ci]:.6f}.png"),
+                    TUM_DEPTH_FACTOR,
+                )
+                tasks += registered
+                lists["depth.txt"] = [
+                    (stamps[ci], f"depth/{stamps[ci]:.6f}.png")
+                    for ci in color_indices.tolist()
+                ]
+                lists["associations.txt"] = [
+                    (stamps[ci], rgb[ci], stamps[ci], f"depth/{stamps[ci]:.6f}.png")
+                    for ci in color_indices.tolist()
+                ]
+            else:
+                depth_stamps = filetime_stamps(depth.timestamps).tolist()
+                depth_names = [f"depth/{stamp:.6f}.png" for stamp in depth_stamps]
+                lists["depth.txt"] = list(zip(depth_stamps, depth_names))
+                s = self.streams.index(depth)
+                tasks += [
+                    ("write_depth", s, i, os.path.join(folder, name), TUM_DEPTH_FACTOR)
+                    for i, name in enumerate(depth_names)
+                ]
+                if color is not None:
+                    pairs = zip(*(indices.tolist() for indices in self.associate()))
+                    lists["associations.txt"] = [
+                        (stamps[ci], rgb[ci], depth_stamps[di], depth_names[di])
+                        for ci, di in pairs
+                    ]
+        for _ in self._run(tasks):
+            pass
+
+        reference = color if color is not None else depth
+        if reference is not None and reference.tf is not None:
+            tf_stamps, translations, quaternions = reference.tf
+            lists["groundtruth.txt"] = [
+                (stamp, *translation, *quaternion)
+                for stamp, translation, quaternion in zip(
+                    filetime_stamps(tf_stamps).tolist(),
+                    translations.tolist(),
+                    quaternions.tolist(),
+                )
+            ]
+        titles = {
+            "rgb.txt": "color images\n# timestamp filename",
+            "depth.txt": "depth maps\n# timestamp filename",
+            "groundtruth.txt": (
+                "ground truth trajectory\n# timestamp tx ty tz qx qy qz qw"
+            ),
+        }
+        for file_name, rows in lists.items():
+            with open(os.path.join(folder, file_name), "w") as f:
+                if file_name in titles:
+                    f.write(f"# {titles[file_name]}\n")
+                f.writelines(
+                    " ".join(
+                        f"{value:.6f}" if isinstance(value, float) else value
+                        for value in row
+                    )
+                    + "\n"
+                    for row in rows
+                )
+        return {file_name: len(rows) for file_name, rows in lists.items()}
+
+    def write_scannet(self, folder):
+        """
+        ScanNet-like layout: color/<i>.jpg, depth/<i>.png (millimeters,
+        registered into the color frame), pose/<i>.txt (4x4 color camera to
+        world, ROS optical frame, -inf without a pose) and the intrinsic/
+        matrices of the first color frame.
+
+        :returns: number of frames
+        """
+        color, depth = self.color, self.depth
+        if color is None:
+            raise ValueError("The ScanNet layout needs a color stream")
+        for name in ("color", "depth", "pose", "intrinsic"):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+        if depth is not None:
+            color_indices, tasks = self._registration_tasks(
+                lambda k, ci: os.path.join(folder, "depth", f"{k}.png"), 1
+            )
+        else:
+            color_indices, tasks = np.arange(len(color)), []
+        frame_of = {ci: k for k, ci in enumerate(color_indices.tolist())}
+        s = self.streams.index(color)
+        tasks += [
+            ("write_color", s, ci, os.path.join(folder, "color", f"{k}.jpg"))
+            for ci, k in frame_of.items()
+        ]
+        for _ in self._run(tasks):
+            pass
+
+        for ci, k in frame_of.items():
+            pose = (
+                color.cam2world[ci]
+                if color.cam2world is not None
+                else np.full((4, 4), -np.inf)
+            )
+            np.savetxt(os.path.join(folder, "pose", f"{k}.txt"), pose, fmt="%.9g")
+        if color.intrinsics is not None:
+            fx, fy, cx, cy = color.intrinsics[0].tolist()
+            intrinsic = np.array(
+                [[fx, 0, cx, 0], [0, fy, cy, 0], [0, 0, 1, 0], [0, 0, 0, 1]]
+            )
+            # the depth is registered, both cameras share the color matrices
+            for camera in ("color", "depth"):
+                prefix = os.path.join(folder, "intrinsic")
+                np.savetxt(f"{prefix}/intrinsic_{camera}.txt", intrinsic, fmt="%.9g")
+                np.savetxt(f"{prefix}/extrinsic_{camera}.txt", np.eye(4), fmt="%g")
+        return len(frame_of)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert recordings and saved sessions to rosbags and RGB-D "
+        "datasets"
+    )
+    parser.add_argument(
+        "inputs",
+        help="Recordings (.hl2rec), raw stream captures or --save_image output "
+        "folders of one device",
+        nargs="+",
+    )
+    parser.add_argument("--bag", help="Write a rosbag to this file", default=None)
+    parser.add_argument(
+        "--tum", help="Write the TUM RGB-D layout to this folder", default=None
+    )
+    parser.add_argument(
+        "--scannet", help="Write the ScanNet-like layout to this folder", default=None
+    )
+    parser.add_argument(
+        "--holo_serial",
+        help="Serial of the device in frame ids and topics",
+        default="hololens2",
+    )
+    parser.add_argument(
+        "--sensor_type",
+        help="Sensor type of raw captures, guessed from the file name if not set",
+        choices=["color", "depth"],
+        default=None,
+    )
+    parser.add_argument(
+        "--rig2depth",
+        help="YAML file with the depth extrinsics, the default ones if not set",
+        default=None,
+    )
+    parser.add_argument(
+        "--depth_lut",
+        help="Depth AHaT_lut.bin of the device, enables the bag point clouds; "
+        "registration uses an ideal pinhole if not set",
+        default=None,
+    )
+    parser.add_argument(
+        "--cloud_stride",
+        help="Keep every n-th depth row and column",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--register",
+        help="Register the TUM depth maps into the color frames",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--rgb_format",
+        help="Image format of recorded color frames in the TUM layout",
+        choices=["png", "jpg"],
+        default="png",
+    )
+    parser.add_argument(
+        "--max_difference",
+        help="Seconds between associated color and depth frames",
+        default=MAX_DIFFERENCE,
+        type=float,
+    )
+    parser.add_argument(
+        "--view_depth_distance",
+        help="Colormap range of saved depth PNGs in meters",
+        default=2.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--tf_smoothing",
+        help="Smooth TF poses like the publisher --tf_smoothing (seconds)",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--tf_prediction",
+        help="Predict TF poses like the publisher --tf_prediction (seconds)",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--tf_window", help="Recent poses kept for TF smoothing", default=8, type=int
+    )
+    parser.add_argument(
+        "--bag_compression",
+        help="Chunk compression of the bag",
+        choices=BAG_COMPRESSIONS,
+        default="none",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Worker processes, 0 to convert in this process",
+        default=os.cpu_count(),
+        type=int,
+    )
+    parser.add_argument(
+        "--chunk_frames", help="Frames sent to a worker at once", default=8, type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not (args.bag or args.tum or args.scannet):
+        raise SystemExit("==> [ERROR] Nothing to do, pass --bag, --tum or --scannet!!!")
+    from point_cloud import load_depth_lut, pinhole_lut
+
+    streams = open_inputs(args.inputs, args.sensor_type)
+    if not any(len(stream) for stream in streams):
+        raise SystemExit(f"==> [ERROR] No frames found in {' '.join(args.inputs)}!!!")
+    exporter = OfflineExporter(
+        streams,
+        serial=args.holo_serial,
+        rig2depth=(
+            load_depth_extrinsics_from_yaml(args.rig2depth)
+            if args.rig2depth
+            else DEFAULT_RIG2DEPTH
+        ),
+        # registration falls back to an ideal pinhole like registration.py,
+        # point clouds are only published with the device LUT
+        depth_lut=load_depth_lut(args.depth_lut) if args.depth_lut else pinhole_lut(),
+        point_clouds=args.depth_lut is not None,
+        cloud_stride=args.cloud_stride,
+        max_difference=args.max_difference,
+        view_depth_distance=args.view_depth_distance,
+        tf_smoothing=args.tf_smoothing,
+        tf_prediction=args.tf_prediction,
+        tf_window=args.tf_window,
+        workers=args.workers,
+        chunk_frames=args.chunk_frames,
+    )
+    for stream in exporter.streams:
+        print(
+            f"==> [INFO] {stream.source}: {len(stream)} {stream.sensor_type} frames, "
+            f"{stream.duration:.1f} s{'' if stream.poses is not None else ', no poses'}"
+        )
+
+    start = time.perf_counter()
+    try:
+        if args.bag:
+            counts = exporter.write_bag(args.bag, args.bag_compression)
+            for topic, count in sorted(counts.items()):
+                print(f"  * {topic}: {count}")
+            print(f"==> [INFO] Wrote {args.bag}")
+        if args.tum:
+            lists = exporter.write_tum(args.tum, args.register, args.rgb_format)
+            for file_name, count in lists.items():
+                print(f"  * {file_name}: {count}")
+            print(f"==> [INFO] Wrote the TUM RGB-D layout to {args.tum}")
+        if args.scannet:
+            frames = exporter.write_scannet(args.scannet)
+            print(
+                f"==> [INFO] Wrote {frames} frames of the ScanNet layout to "
+                f"{args.scannet}"
+            )
+    except (ImportError, ValueError) as error:
+        raise SystemExit(f"==> [ERROR] {error}!!!")
+    elapsed = time.perf_counter() - start
+    print(
+        f"==> [INFO] Converted {exporter.frames} frames in {elapsed:.1f} s, "
+        f"{exporter.duration / elapsed:.1f}x real time with {args.workers} workers"
+    )
@@ -0,0 +1,866 @@
+import os
+import time
+import argparse
+import threading
+import multiprocessing as mp
+from datetime import datetime
+from connection import StreamConnection
+from frame_gate import FrameGate, RateLimiter
+from sensor_protocol import SENSOR_FRAME_STRUCTURE, SensorFrameHeader
+from stream_stats import StageStats, StreamStats
+from worker_pool import BACKPRESSURE_POLICIES, BoundedWorkerPool
+
+
+EXECUTORS = ["inline", "thread", "process"]
+
+
+class StopStreaming(Exception):
+    """
+    Raised by a consumer or pipeline stage to stop streaming.
+    """
+
+
+class _DropFrame:
+    def __repr__(self):
+        return "DROP_FRAME"
+
+
+# Returned by a stage function to drop the frame, the later stages do not see it
+DROP_FRAME = _DropFrame()
+
+
+class StreamFrame:
+    """
+    One received frame, handed to every consumer or pipeline stage.
+
+    The object, its header and its payload are reused for the next frame of
+    the same stream: consumers that keep data past their call must copy it,
+    or keep a `copy()`. `results` holds the return values of the pipeline
+    stages the frame went through, by stage name.
+    """
+
+    __slots__ = (
+        "device",
+        "sensor_type",
+        "header",
+        "raw_header",
+        "payload",
+        "owned",
+        "entered_at",
+        "results",
+    )
+
+    def __init__(self, device, sensor_type) -> None:
+        self.device = device
+        self.sensor_type = sensor_type
+        self.header = SensorFrameHeader(sensor_type)
+        self.raw_header = None
+        self.payload = None
+        # True when header and payload are not views of receive buffers
+        self.owned = False
+        # perf_counter when the frame entered the pipeline
+        self.entered_at = 0.0
+        self.results = {}
+
+    @property
+    def key(self):
+        return (self.device, self.sensor_type)
+
+    @property
+    def image(self):
+        """
+        Zero-copy view of the payload.
+        """
+        return self.header.image_view(self.payload)
+
+    def copy(self):
+        """
+        Copy owning its header and payload, still valid once the receive
+        buffers are reused.
+        """
+        frame = StreamFrame(self.device, self.sensor_type)
+        frame.header.decode(self.header.buffer)
+        frame.raw_header = frame.header.buffer
+        frame.payload = bytearray(self.payload)
+        frame.owned = True
+        frame.entered_at = self.entered_at
+        frame.results = dict(self.results)
+        return frame
+
+
+def _call_stage(function, frame):
+    """
+    :returns: (status, result, seconds spent in `function`), status is "ok",
+        "drop" (DROP_FRAME returned), "stop" (StopStreaming raised) or
+        "error" (result is the error message)
+    """
+    start = time.perf_counter()
+    try:
+        result = function(frame)
+    except StopStreaming:
+        return "stop", None, time.perf_counter() - start
+    except Exception as err:
+        return "error", f"{type(err).__name__}: {err}", time.perf_counter() - start
+    service = time.perf_counter() - start
+    if result is DROP_FRAME:
+        return "drop", None, service
+    return "ok", result, service
+
+
+class Stage:
+    """
+    One step of a Pipeline: a function called with every StreamFrame, on
+    the chosen executor.
+
+    The function follows the AsyncStreamingClient consumer protocol: it takes
+    a StreamFrame, may raise StopStreaming and may define `close()`. A return
+    value other than None is stored in `frame.results[name]` for the later
+    stages, returning DROP_FRAME stops the frame at this stage.
+
+    Executors:
+
+      * inline:  called by the thread handing over the frame, no copy. After
+                 a thread stage, that is one of its workers
+      * thread:  `workers` threads fed through a bounded queue; the frame is
+                 copied once when it leaves the receive buffers
+      * process: `workers` processes reading frames from a shared memory
+                 ring. The function is sent to the workers before the first
+                 frame, so it should open files, threads or windows on its
+                 first call, and its return values are pickled back
+
+    With more than one worker, frames can reach the later stages out of
+    order. When the queue is full, `policy` blocks the previous stage or
+    drops a frame (see BoundedWorkerPool); process stages only keep the
+    queued frames, drop_oldest drops the new frame.
+
+    With `rate`, the stage handles at most that many frames per second of
+    each stream (see RateLimiter); the other frames skip it without being
+    copied and go on to the later stages.
+    """
+
+    def __init__(
+        self,
+        function,
+        name=None,
+        executor="inline",
+        workers=1,
+        queue_size=8,
+        policy="block",
+        slot_size=None,
+        rate=None,
+    ) -> None:
+        """
+        :param slot_size: payload capacity of the process ring slots in
+            bytes, the payload size of the first frame if not set
+        """
+        assert executor in EXECUTORS, f"Unknown executor '{executor}'"
+        assert policy in BACKPRESSURE_POLICIES, f"Unknown policy '{policy}'"
+        assert workers > 0 and queue_size > 0
+        self.function = function
+        self.name = name or getattr(function, "__name__", type(function).__name__)
+        self.executor = executor
+        self.workers = workers
+        self.queue_size = queue_size
+        self.policy = policy
+        self.slot_size = slot_size
+        self.rate = rate
+        self.limiters = {}
+        self.stats = StageStats(self.name)
+        self._lock = threading.Lock()
+        self._runner = None
+        self._forward = None
+        self._stop = None
+
+    def start(self, forward, stop):
+        """
+        :param forward: called with every frame passing the stage, None for
+            the last stage
+        :param stop: called when the function raises StopStreaming
+        """
+        self._forward = forward
+        self._stop = stop
+        if self.executor == "thread":
+            self._runner = _ThreadRunner(self)
+        elif self.executor == "process":
+            self._runner = _ProcessRunner(self)
+
+    def _due(self, frame):
+        limiter = self.limiters.get(frame.key)
+        if limiter is None:
+            limiter = self.limiters[frame.key] = RateLimiter(self.rate)
+        return limiter.due(frame.header.Timestamp)
+
+    def submit(self, frame):
+        if self.rate and not self._due(frame):
+            with self._lock:
+                self.stats.skipped += 1
+            if self._forward is not None:
+                self._forward(frame)
+        elif self._runner is None:
+            self._finish(frame, frame.entered_at, *_call_stage(self.function, frame))
+        else:
+            self._runner.submit(frame)
+
+    def _count_drop(self):
+        with self._lock:
+            self.stats.dropped += 1
+
+    def _finish(self, frame, entered_at, status, result, service):
+        """
+        Account for a processed frame and hand it to the next stage.
+
+        :param frame: None when the frame is not forwarded (last stage)
+        """
+        latency = time.perf_counter() - entered_at
+        with self._lock:
+            if status == "error":
+                self.stats.failed += 1
+            else:
+                self.stats.add(service, latency)
+                if status == "drop":
+                    self.stats.filtered += 1
+        if status == "error":
+            print(f"==> [ERROR] Pipeline stage {self.name} failed!!! ({result})")
+        elif status == "stop":
+            self._stop()
+        elif status == "ok" and self._forward is not None:
+            if result is not None:
+                frame.results[self.name] = result
+            self._forward(frame)
+
+    def close(self):
+        """
+        Process the queued frames, then close the function (in the workers
+        for a process stage).
+        """
+        if self._runner is not None:
+            self._runner.close()
+        close = getattr(self.function, "close", None)
+        if close is not None and self.executor != "process":
+            close()
+
+
+class _ThreadRunner(BoundedWorkerPool):
+    def __init__(self, stage) -> None:
+        self.stage = stage
+        super().__init__(
+            stage.workers, stage.queue_size, stage.policy, name=f"Stage-{stage.name}"
+        )
+
+    def submit(self, frame):
+        self._submit(frame if frame.owned else frame.copy())
+
+    def _count_drop(self):
+        super()._count_drop()
+        self.stage._count_drop()
+
+    def _process(self, frame):
+        self.stage._finish(
+            frame, frame.entered_at, *_call_stage(self.stage.function, frame)
+        )
+
+
+class _ProcessRunner:
+    """
+    Worker processes of a process stage, fed through a SharedFrameRing.
+
+    The ring holds `queue_size + workers` slots, so at most that many frames
+    are queued or being processed. Results come back on a queue read by a
+    collector thread, which releases the slot and forwards the frame.
+    """
+
+    def __init__(self, stage) -> None:
+        self.stage = stage
+        self.num_slots = stage.queue_size + stage.workers
+        self.ring = None
+        self.processes = []
+        self.oversized = 0
+        self._slots = threading.Semaphore(self.num_slots)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._collector = None
+
+    def _start(self, payload_size):
+        from fleet import SharedFrameRing
+
+        self.ring = SharedFrameRing(self.num_slots, payload_size)
+        self._jobs = mp.SimpleQueue()
+        self._done = mp.SimpleQueue()
+        self.processes = [
+            mp.Process(
+                target=_process_stage_worker,
+                args=(
+                    self.stage.function,
+                    self.ring.name,
+                    self.num_slots,
+                    payload_size,
+                    self._jobs,
+                    self._done,
+                ),
+                name=f"Stage-{self.stage.name}-{i}",
+                daemon=True,
+            )
+            for i in range(self.stage.workers)
+        ]
+        for process in self.processes:
+            process.start()
+        self._collector = threading.Thread(
+            target=self._collect, name=f"Stage-{self.stage.name}-collector", daemon=True
+        )
+        self._collector.start()
+
+    def _acquire_slot(self):
+        if self.stage.policy != "block":
+            return self._slots.acquire(blocking=False)
+        while not self._slots.acquire(timeout=1.0):
+            if not any(process.is_alive() for process in self.processes):
+                raise RuntimeError(f"Workers of stage {self.stage.name} exited")
+        return True
+
+    def submit(self, frame):
+        payload_size = len(frame.payload)
+        if self.ring is None:
+            self._start(self.stage.slot_size or payload_size)
+        if payload_size > self.ring.payload_size:
+            if not self.oversized:
+                print(
+                    f"==> [ERROR] {frame.device} {frame.sensor_type} frame of "
+                    f"{payload_size} bytes does not fit the {self.ring.payload_size} "
+                    f"bytes slots of stage {self.stage.name}!!!"
+                )
+            self.oversized += 1
+            self.stage._count_drop()
+            return
+        if not self._acquire_slot():
+            self.stage._count_drop()
+            return
+        with self._lock:
+            slot = self.ring.acquire()
+        header_size = len(frame.raw_header)
+        self.ring.header_view(slot, header_size)[:] = frame.raw_header
+        self.ring.payload_view(slot, payload_size)[:] = frame.payload
+        self.ring.publish(slot)
+        # the last stage only needs the entry time for its stats
+        keep = None
+        if self.stage._forward is not None:
+            keep = frame if frame.owned else frame.copy()
+        self._pending[slot] = (keep, frame.entered_at)
+        self._jobs.put(
+            (
+                slot,
+                frame.device,
+                frame.sensor_type,
+                header_size,
+                payload_size,
+                frame.results,
+            )
+        )
+
+    def _collect(self):
+        while True:
+            message = self._done.get()
+            if message is None:
+                break
+            slot, status, result, service = message
+            frame, entered_at = self._pending.pop(slot)
+            self.ring.release(slot)
+            self._slots.release()
+            self.stage._finish(frame, entered_at, status, result, service)
+
+    def close(self):
+        if self.ring is None:
+            return
+        for _ in self.processes:
+            self._jobs.put(None)
+        for process in self.processes:
+            process.join()
+        self._done.put(None)
+        self._collector.join()
+        self.ring.close()
+        self.ring.unlink()
+
+
+def _process_stage_worker(function, ring_name, num_slots, payload_size, jobs, done):
+    """
+    Process stage worker entry: call `function` with the frames of the ring
+    until the None job.
+    """
+    from fleet import SharedFrameRing
+
+    ring = SharedFrameRing(num_slots, payload_size, name=ring_name)
+    frames = {}
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            slot, device, sensor_type, header_size, size, results = job
+            frame = frames.get((device, sensor_type))
+            if frame is None:
+                frame = frames[(device, sensor_type)] = StreamFrame(device, sensor_type)
+            frame.raw_header = ring.header_view(slot, header_size)
+            frame.header.decode(frame.raw_header)
+            frame.payload = ring.payload_view(slot, size)
+            frame.results = results
+            status, result, service = _call_stage(function, frame)
+            # views of the ring would keep it from closing
+            frame.raw_header = frame.payload = None
+            try:
+                done.put((slot, status, result, service))
+            except Exception as err:
+                done.put((slot, "error", f"result not picklable ({err})", service))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close = getattr(function, "close", None)
+        if close is not None:
+            close()
+        ring.close()
+
+
+class Pipeline:
+    """
+    Chain of stages run on every frame handed to it.
+
+    `run(source)` takes the frames of any iterable of StreamFrames
+    (StreamSource, RecordingSource, FleetIngest.frames()). Calling the
+    pipeline with a frame pushes it instead, so a pipeline is also a
+    consumer of AsyncStreamingClient and FleetIngest.run.
+
+        pipeline = Pipeline([
+            Stage(RecordConsumer(output_folder)),
+            Stage(SaveImageStage(output_folder), executor="process", workers=2),
+        ])
+        pipeline.run(StreamSource(host, "depth"))
+
+    :param stages: Stages, or callables run as inline stages
+    :param report_interval: seconds between stats lines, 0 to disable
+    :param log: callable receiving the stats line, None to stay silent
+    """
+
+    def __init__(self, stages, report_interval=5.0, log=print) -> None:
+        self.stages = [
+            stage if isinstance(stage, Stage) else Stage(stage) for stage in stages
+        ]
+        names = [stage.name for stage in self.stages]
+        assert len(set(names)) == len(names), f"Stage names must be unique {names}"
+        self.report_interval = report_interval
+        self.log = log
+        self.frames = 0
+        self.stopping = False
+        self._entry = None
+        self._next_report = 0.0
+
+    def start(self):
+        if self._entry is not None:
+            return self
+        forward = None
+        for stage in reversed(self.stages):
+            stage.start(forward, self.stop)
+            forward = stage.submit
+        self._entry = forward
+        self._next_report = time.perf_counter() + self.report_interval
+        return self
+
+    def __call__(self, frame):
+        """
+        Push `frame` through the stages.
+        """
+        if self.stopping:
+            raise StopStreaming()
+        self.start()
+        frame.entered_at = now = time.perf_counter()
+        frame.results.clear()
+        self.frames += 1
+        self._entry(frame)
+        if self.report_interval and self.log is not None and now >= self._next_report:
+            self._next_report = now + self.report_interval
+            self.log(self.stats_line())
+
+    def run(self, source):
+        """
+        Push every frame of `source` until it ends, a stage raises
+        StopStreaming or `stop()` is called, then close the stages.
+        """
+        frames = iter(source)
+        try:
+            for frame in frames:
+                self(frame)
+                if self.stopping:
+                    break
+        except (StopStreaming, KeyboardInterrupt):
+            pass
+        finally:
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+            self.close()
+
+    def stop(self):
+        self.stopping = True
+
+    def close(self):
+        """
+        Let the queued frames through, then close the stages in order.
+        """
+        if self._entry is None:
+            return
+        for stage in self.stages:
+            stage.close()
+        self._entry = None
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "stages": {stage.name: stage.stats.to_dict() for stage in self.stages},
+        }
+
+    def stats_line(self):
+        return f"[pipeline] frames={self.frames} " + " | ".join(
+            f"{stage.stats.summary()} ({stage.executor})" for stage in self.stages
+        )
+
+
+class StreamSource:
+    """
+    Blocking receive loop of one sensor stream, iterated as StreamFrames.
+
+    Reconnects with backoff and resynchronizes corrupt headers like the other
+    clients, until `stop()`. The frame object is reused and its payload is a
+    view of the FrameReader ring, valid for `num_slots - 1` more frames.
+    """
+
+    def __init__(
+        self,
+        host,
+        sensor_type,
+        device=None,
+        port=None,
+        timeout=3.0,
+        backoff=None,
+        stats_interval=5.0,
+        rcvbuf=None,
+        busy_poll=None,
+        waitall=False,
+        num_slots=2,
+    ) -> None:
+        self.host = host
+        self.sensor_type = sensor_type
+        self.device = device or host
+        self.port = (
+            SENSOR_FRAME_STRUCTURE[sensor_type]["port"] if port is None else port
+        )
+        self.num_slots = num_slots
+        self.frame = StreamFrame(self.device, sensor_type)
+        self.stats = StreamStats(
+            f"{self.device}/{sensor_type}",
+            report_interval=stats_interval,
+            log=lambda line: print(f"==> [INFO] {line}"),
+        )
+        # Reconnects with backoff and resyncs corrupt headers
+        self.connection = StreamConnection(
+            host,
+            self.port,
+            timeout=timeout,
+            backoff=backoff,
+            stats=self.stats.connection,
+            rcvbuf=rcvbuf,
+            busy_poll=busy_poll,
+            waitall=waitall,
+        )
+        # Duplicate and stale frames are not yielded
+        self.gate = FrameGate(self.stats.gate)
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def __iter__(self):
+        while not self._stopped:
+            sock = self.connection.connect(lambda: self._stopped)
+            if sock is None:
+                break
+            reader = self.connection.create_reader(
+                sock, self.frame.header.size, num_slots=self.num_slots
+            )
+            reason = "stop"
+            try:
+                reason = yield from self._receive_frames(reader)
+            finally:
+                # the socket is closed even when the iteration is abandoned
+                self.connection.disconnect(reason)
+
+    def _receive_frames(self, reader):
+        """
+        :returns: ReadStatus value of the read that ended the connection
+        """
+        frame = self.frame
+        header = frame.header
+        connection = self.connection
+        stats = self.stats
+        while not self._stopped:
+            t = stats.start_frame()
+            syscalls = reader.syscalls
+            header_data = reader.read_header()
+            if header_data is None:
+                print(
+                    f"==> [ERROR] Failed to receive {self.device} {self.sensor_type} "
+                    f"header data!!! ({reader.describe_status()})"
+                )
+                return reader.status.value
+            problem = header.decode(header_data).check()
+            if problem is not None:
+                print(
+                    f"==> [ERROR] Invalid {self.device} {self.sensor_type} header "
+                    f"({problem}), resyncing..."
+                )
+                header_data = connection.resync(reader, header)
+                if header_data is None:
+                    return reader.status.value
+            t = stats.lap("receive_header", t)
+
+            payload = reader.read_payload(header.image_size)
+            if payload is None:
+                print(
+                    f"==> [ERROR] Failed to receive {self.device} {self.sensor_type} "
+                    f"image data!!! ({reader.describe_status()})"
+                )
+                return reader.status.value
+            connection.frame_received(header)
+            t = stats.lap("receive_image", t)
+            if not self.gate.admit(header.Timestamp):
+                continue
+
+            frame.raw_header = header_data
+            frame.payload = payload
+            yield frame
+            stats.lap("pipeline", t)
+            stats.end_frame(
+                header.size + header.image_size,
+                header.Timestamp,
+                reader.syscalls - syscalls,
+            )
+        return "stop"
+
+
+class RecordingSource:
+    """
+    Frames of a `--record` recording as StreamFrames, with header and
+    payload viewing the memory-mapped file.
+
+    :param device: device name of the frames, the file name if not set
+    :param realtime: pace the frames by their Timestamps instead of reading
+        them as fast as the stages take them
+    """
+
+    def __init__(self, file_path, device=None, realtime=False) -> None:
+        self.file_path = file_path
+        self.device = device or os.path.splitext(os.path.basename(file_path))[0]
+        self.realtime = realtime
+
+    def __iter__(self):
+        from frame_recorder import RecordingReader
+
+        reader = RecordingReader(self.file_path)
+        frame = StreamFrame(self.device, reader.sensor_type)
+        start = None
+        try:
+            for i in range(len(reader)):
+                raw_header, payload = reader.raw_frame(i)
+                frame.header.decode(raw_header)
+                if self.realtime:
+                    if start is None:
+                        start = (time.perf_counter(), frame.header.Timestamp)
+                    delay = (
+                        start[0]
+                        + (frame.header.Timestamp - start[1]) * 1e-7
+                        - time.perf_counter()
+                    )
+                    if delay > 0:
+                        time.sleep(delay)
+                frame.raw_header = raw_header
+                frame.payload = payload
+                try:
+                    yield frame
+                finally:
+                    # views of the file map would keep it from closing
+                    frame.raw_header = frame.payload = None
+                    raw_header.release()
+                    payload.release()
+        finally:
+            reader.close()
+
+
+class SaveImageStage:
+    """
+    Write every frame to `<output_folder>/<device>_<sensor_type>/`, JPEG for
+    color and PNG for depth, colorized like `--save_image` unless
+    `raw_depth` (16-bit PNG).
+
+    OpenCV and the folders are only opened on the first frame, so the stage
+    can be sent to the workers of a process stage.
+    """
+
+    def __init__(self, output_folder, raw_depth=False, view_depth_distance=2.0) -> None:
+        self.output_folder = output_folder
+        self.raw_depth = raw_depth
+        self.view_depth_distance = view_depth_distance
+        self.written = 0
+        self._folders = {}
+
+    def _folder(self, frame):
+        folder = self._folders.get(frame.key)
+        if folder is None:
+            from async_client import stream_file_name
+
+            folder = self._folders[frame.key] = os.path.join(
+                self.output_folder, stream_file_name(frame.device, frame.sensor_type)
+            )
+            os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def __call__(self, frame):
+        import cv2
+        from frame_viewer import colorize_depth, depth_colormap_lut
+
+        header = frame.header
+        image = frame.image
+        if header.PixelStride == 2:
+            file_name = f"depth_{header.Timestamp}.png"
+            if not self.raw_depth:
+                lut = depth_colormap_lut(self.view_depth_distance)
+                image = cv2.cvtColor(colorize_depth(image, lut), cv2.COLOR_BGRA2BGR)
+        else:
+            file_name = f"color_{header.Timestamp}.jpg"
+        file_path = os.path.join(self._folder(frame), file_name)
+        ok, encoded = cv2.imencode(os.path.splitext(file_name)[1], image)
+        if not ok:
+            raise RuntimeError(f"Failed to encode {file_path}")
+        with open(file_path, "wb") as f:
+            f.write(encoded)
+        self.written += 1
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--host", help="Host Address to connect", default="192.168.50.210"
+    )
+    parser.add_argument(
+        "--sensor_type",
+        help="Sensor type to receive, depth/color",
+        choices=["color", "depth"],
+        default="depth",
+    )
+    parser.add_argument(
+        "--recording",
+        help="Read frames from a .hl2rec recording instead of the device",
+        default=None,
+    )
+    parser.add_argument(
+        "--realtime",
+        help="Replay --recording at the recorded frame rate",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--display", help="Show the frames", action="store_true", default=False
+    )
+    parser.add_argument(
+        "--record",
+        help="Record raw frames to <output_folder>/<device>_<sensor_type>.hl2rec",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--save_image", help="Save images to local", action="store_true", default=False
+    )
+    parser.add_argument(
+        "--raw_depth",
+        help="Save depth as 16-bit PNG instead of colorized",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--save_executor",
+        help="Where images are encoded and written",
+        choices=EXECUTORS,
+        default="thread",
+    )
+    parser.add_argument(
+        "--save_workers",
+        help="Threads or processes of the save stage",
+        default=2,
+        type=int,
+    )
+    parser.add_argument(
+        "--queue_size", help="Frames queued in front of the save stage", default=8, type=int
+    )
+    parser.add_argument(
+        "--policy",
+        help="What to do when the save queue is full",
+        choices=BACKPRESSURE_POLICIES,
+        default="drop_oldest",
+    )
+    parser.add_argument(
+        "--save_rate",
+        help="Save at most this many frames per second, every frame if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--stats_interval",
+        help="Seconds between stats lines, 0 to disable",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--output_folder",
+        help="Output folder of --record and --save_image",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "output",
+            datetime.now().strftime("%Y%m%d_%H%M%S"),
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stages = []
+    if args.record:
+        from async_client import RecordConsumer
+
+        stages.append(Stage(RecordConsumer(args.output_folder), name="record"))
+    if args.save_image:
+        stages.append(
+            Stage(
+                SaveImageStage(args.output_folder, raw_depth=args.raw_depth),
+                name="save_image",
+                executor=args.save_executor,
+                workers=args.save_workers,
+                queue_size=args.queue_size,
+                policy=args.policy,
+                rate=args.save_rate,
+            )
+        )
+    if args.display:
+        from async_client import DisplayConsumer
+
+        stages.append(Stage(DisplayConsumer(), name="display"))
+
+    if args.recording is not None:
+        source = RecordingSource(args.recording, realtime=args.realtime)
+    else:
+        source = StreamSource(
+            args.host, args.sensor_type, stats_interval=args.stats_interval
+        )
+    pipeline = Pipeline(
+        stages,
+        report_interval=args.stats_interval,
+        log=lambda line: print(f"==> [INFO] {line}"),
+    )
+    pipeline.run(source)
+    print(f"==> [INFO] {pipeline.stats_line()}")
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+# AHaT depth frame size and units
+AHAT_WIDTH = 512
+AHAT_HEIGHT = 512
+DEPTH_SCALE = 1e-3  # millimeters to meters
+# AHaT marks invalid pixels with values of 4090 and above
+AHAT_INVALID_DEPTH = 4090
+
+
+def load_depth_lut(file_path, width=AHAT_WIDTH, height=AHAT_HEIGHT):
+    """
+    Load the `Depth AHaT_lut.bin` file written by the StreamRecorder sample.
+
+    The file holds one float32 (x, y, z) point on the camera unit plane per
+    pixel, row by row.
+
+    :returns: (height, width, 3) float32 array of unit rays
+    """
+    lut = np.fromfile(file_path, dtype=np.float32)
+    if lut.size != width * height * 3:
+        raise ValueError(
+            f"{file_path} holds {lut.size // 3} rays, expected {width}x{height}"
+        )
+    return normalize_rays(lut.reshape(height, width, 3))
+
+
+def pinhole_lut(width=AHAT_WIDTH, height=AHAT_HEIGHT, focal=None):
+    """
+    Unit rays of an ideal pinhole camera, a stand-in for the device LUT
+    when testing with the replay server.
+
+    :param focal: focal length in pixels, defaults to a 120 degree field of view
+    """
+    if focal is None:
+        focal = width / 2 / np.tan(np.radians(60))
+    u, v = np.meshgrid(
+        np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32)
+    )
+    rays = np.stack(
+        ((u - width / 2) / focal, (v - height / 2) / focal, np.ones_like(u)), axis=-1
+    )
+    return normalize_rays(rays)
+
+
+def normalize_rays(rays):
+    norm = np.linalg.norm(rays, axis=-1, keepdims=True)
+    norm[norm == 0] = 1
+    return (rays / norm).astype(np.float32)
+
+
+class DepthUnprojector:
+    """
+    Turn AHaT depth frames into point clouds with a cached LUT.
+
+    The rays of the selected pixels (ROI, then every `stride`-th row and
+    column) are gathered once at construction and kept as x, y, z planes.
+    A frame then costs one (3,3)x(3,N) rotation of the planes, one masked
+    gather per plane and a multiply by the depth. Points are written into a
+    preallocated contiguous float32 (N,3) buffer that can be sent as
+    PointCloud2 data without conversion.
+    """
+
+    def __init__(
+        self,
+        lut,
+        stride=1,
+        roi=None,
+        min_depth=0.0,
+        max_depth=None,
+        depth_scale=DEPTH_SCALE,
+        invalid_depth=AHAT_INVALID_DEPTH,
+    ) -> None:
+        """
+        :param lut: (height, width, 3) unit rays, see `load_depth_lut`
+        :param stride: keep every `stride`-th row and column
+        :param roi: (x, y, width, height) pixel region to keep, None for all
+        :param min_depth: drop points closer than this, in meters
+        :param max_depth: drop points farther than this, in meters
+        :param depth_scale: meters per depth unit
+        :param invalid_depth: raw values from this one up are dropped
+        """
+        self.height, self.width = lut.shape[:2]
+        x, y, w, h = roi if roi is not None else (0, 0, self.width, self.height)
+        self.stride = stride
+        self.roi = (x, y, w, h)
+        self._rows = slice(y, y + h, stride)
+        self._cols = slice(x, x + w, stride)
+        self.rays = np.ascontiguousarray(lut[self._rows, self._cols])
+        self.depth_scale = depth_scale
+
+        # range clip applied on the raw values, avoids scaling dropped pixels
+        self._min_raw = max(int(np.floor(min_depth / depth_scale)), 0)
+        max_raw = invalid_depth
+        if max_depth is not None:
+            max_raw = min(max_raw, int(np.ceil(max_depth / depth_scale)) + 1)
+        self._max_raw = max_raw
+
+        num_rays = self.rays.shape[0] * self.rays.shape[1]
+        # gathering 1-D planes is several times faster than (N,3) rows
+        self._ray_planes = np.ascontiguousarray(self.rays.reshape(num_rays, 3).T)
+        self._rotated_planes = np.empty_like(self._ray_planes)
+        self._points = np.empty((num_rays, 3), dtype=np.float32)
+
+    @property
+    def max_points(self):
+        return len(self._points)
+
+    def unproject(self, depth, transform=None):
+        """
+        :param depth: (height, width[, 1]) uint16 depth image, may be a strided
+            view of the payload
+        :param transform: optional 4x4 camera-to-target transform applied to
+            the points, e.g. rig2world @ depth2rig
+        :returns: (N, 3) float32 view of the internal buffer, valid until the
+            next call
+        """
+        raw = depth[self._rows, self._cols].ravel()
+        valid = (raw > self._min_raw) & (raw < self._max_raw)
+        distances = raw[valid].astype(np.float32)
+        distances *= self.depth_scale
+
+        points = self._points[: len(distances)]
+        planes = self._ray_planes
+        if transform is not None:
+            transform = np.asarray(transform, dtype=np.float32)
+            planes = np.matmul(transform[:3, :3], planes, out=self._rotated_planes)
+        for axis in range(3):
+            column = points[:, axis]
+            np.multiply(planes[axis][valid], distances, out=column)
+            if transform is not None:
+                column += transform[axis, 3]
+        return points
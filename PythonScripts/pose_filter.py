@@ -0,0 +1,214 @@
+import math
+from collections import deque
+import numpy as np
+from pose_utils import slerp, slerp_batch
+
+
+# Poses further apart (hundreds of ns) restart the filter, e.g. after a reconnect
+POSE_MAX_GAP = 5 * 10**6
+
+
+class PoseFilter:
+    """
+    Smoothing and short-horizon prediction of a stream of TF poses.
+
+    The last `window` poses are kept in a ring. With `smoothing` (seconds),
+    the filtered pose is their exponentially weighted average, the weight of
+    a pose decaying with its age: translations are averaged linearly and
+    rotations by chained slerps from the oldest pose to the newest one.
+
+    The average lags behind the newest pose. With `prediction` (seconds,
+    None to disable), the recent smoothed poses are averaged once more, like
+    double exponential smoothing, and the pose is extrapolated from that
+    average through the smoothed pose (slerp past t=1) to the frame Timestamp
+    plus `prediction`. This cancels the lag and predicts ahead from a
+    velocity measured over the whole window; the pose is stamped with the
+    predicted time. Without smoothing the raw poses are extrapolated from the
+    previous one.
+
+    A pose older than the previous one or more than `max_gap` after it
+    restarts the filter. `filter_trajectory` runs the same filter over a
+    whole trajectory.
+    """
+
+    def __init__(
+        self, smoothing=0.0, prediction=None, window=8, max_gap=POSE_MAX_GAP
+    ) -> None:
+        assert window > 0 and smoothing >= 0
+        self.smoothing = smoothing
+        self.prediction = prediction
+        self.window = window
+        self.max_gap = max_gap
+        # (Timestamp, center, translation, quaternion) of the recent raw and
+        # smoothed poses, center being the time the pose stands for in
+        # seconds relative to the Timestamp
+        self.ring = deque(maxlen=window)
+        self.smoothed = deque(maxlen=window)
+
+    def reset(self):
+        self.ring.clear()
+        self.smoothed.clear()
+
+    def _average(self, ring):
+        """
+        :returns: (center, translation, quaternion) of the weighted average,
+            center relative to the newest Timestamp
+        """
+        newest = ring[-1][0]
+        if not self.smoothing or len(ring) == 1:
+            return ring[-1][1:]
+        total = 0.0
+        center = mean = rotation = None
+        for stamp, pose_center, translation, quaternion in ring:
+            age = (newest - stamp) * 1e-7
+            weight = math.exp(-age / self.smoothing)
+            total += weight
+            # incremental weighted mean: move towards the new sample by its
+            # share of the total weight
+            share = weight / total
+            if rotation is None:
+                center, mean, rotation = pose_center - age, translation, quaternion
+                continue
+            center += share * (pose_center - age - center)
+            mean = tuple(a + share * (b - a) for a, b in zip(mean, translation))
+            rotation = slerp(rotation, quaternion, share)
+        return center, mean, rotation
+
+    def update(self, timestamp, translation, quaternion):
+        """
+        Add the pose of a new frame.
+
+        :param timestamp: FILETIME Timestamp of the frame
+        :param translation: (x, y, z), e.g. from `transform_to_tf`
+        :param quaternion: (x, y, z, w)
+        :returns: (FILETIME stamp, (x, y, z), (x, y, z, w)) of the filtered
+            pose
+        """
+        if self.ring and not 0 < timestamp - self.ring[-1][0] <= self.max_gap:
+            self.reset()
+        self.ring.append((timestamp, 0.0, tuple(translation), tuple(quaternion)))
+        center, translation, quaternion = self._average(self.ring)
+        if self.prediction is None:
+            return timestamp, translation, quaternion
+
+        self.smoothed.append((timestamp, center, translation, quaternion))
+        stamp = timestamp + round(self.prediction * 1e7)
+        if self.smoothing:
+            reference = self._average(self.smoothed)
+        elif len(self.smoothed) > 1:
+            previous, _, *pose = self.smoothed[-2]
+            reference = ((previous - timestamp) * 1e-7, *pose)
+        else:
+            return stamp, translation, quaternion
+        span = center - reference[0]
+        if span <= 0:
+            return stamp, translation, quaternion
+        t = (self.prediction - reference[0]) / span
+        translation = tuple(a + t * (b - a) for a, b in zip(reference[1], translation))
+        return stamp, translation, slerp(reference[2], quaternion, t)
+
+
+def _average_batch(timestamps, run_start, poses, smoothing, window):
+    """
+    `PoseFilter._average` at every pose of a trajectory.
+
+    :param poses: (centers, translations, quaternions) arrays
+    """
+    centers, translations, quaternions = poses
+    count = len(timestamps)
+    index = np.arange(count)
+    total = np.zeros(count)
+    center = np.zeros(count)
+    mean = np.zeros((count, 3))
+    rotation = quaternions.copy()
+    for offset in range(window - 1, -1, -1):
+        sample = np.maximum(index - offset, 0)
+        valid = index - offset >= run_start
+        age = (timestamps - timestamps[sample]) * 1e-7
+        weight = np.where(valid, np.exp(-age / smoothing), 0.0)
+        total += weight
+        share = np.divide(weight, total, out=np.zeros(count), where=total > 0)
+        first = (valid & (total == weight))[:, None]
+        center = np.where(
+            first[:, 0],
+            centers[sample] - age,
+            center + share * (centers[sample] - age - center),
+        )
+        mean = np.where(
+            first,
+            translations[sample],
+            mean + share[:, None] * (translations[sample] - mean),
+        )
+        rotation = np.where(
+            first,
+            quaternions[sample],
+            slerp_batch(rotation, quaternions[sample], share),
+        )
+    return center, mean, rotation
+
+
+def filter_trajectory(
+    timestamps,
+    translations,
+    quaternions,
+    smoothing=0.0,
+    prediction=None,
+    window=8,
+    max_gap=POSE_MAX_GAP,
+):
+    """
+    Vectorized PoseFilter over a whole trajectory, e.g. from `trajectory_to_tf`.
+
+    Every pose is filtered at once; the loops only run over the `window`
+    offsets of the ring, so the results match feeding the poses one by one
+    to a PoseFilter.
+
+    :param timestamps: (N,) FILETIME Timestamps
+    :param translations: (N, 3) translations
+    :param quaternions: (N, 4) quaternions
+    :returns: ((N,) int64 stamps, (N, 3) translations, (N, 4) quaternions)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    translations = np.asarray(translations, dtype=np.float64)
+    quaternions = np.asarray(quaternions, dtype=np.float64)
+    count = len(timestamps)
+    index = np.arange(count)
+    steps = np.diff(timestamps)
+    restart = np.concatenate(([True], (steps <= 0) | (steps > max_gap)))
+    # first pose of the filter run each pose belongs to
+    run_start = np.maximum.accumulate(np.where(restart, index, 0))
+
+    smoothed = (np.zeros(count), translations, quaternions)
+    if smoothing:
+        smoothed = _average_batch(timestamps, run_start, smoothed, smoothing, window)
+    center, translations, quaternions = smoothed
+    if prediction is None:
+        return timestamps, translations, quaternions
+
+    if smoothing:
+        reference = _average_batch(timestamps, run_start, smoothed, smoothing, window)
+        extrapolate = np.ones(count, dtype=bool)
+    else:
+        previous = np.maximum(index - 1, 0)
+        reference = (
+            (timestamps[previous] - timestamps) * 1e-7,
+            translations[previous],
+            quaternions[previous],
+        )
+        extrapolate = ~restart
+    span = center - reference[0]
+    extrapolate &= span > 0
+    t = np.divide(
+        prediction - reference[0], span, out=np.ones(count), where=extrapolate
+    )[:, None]
+    translations = np.where(
+        extrapolate[:, None],
+        reference[1] + t * (translations - reference[1]),
+        translations,
+    )
+    quaternions = np.where(
+        extrapolate[:, None],
+        slerp_batch(reference[2], quaternions, t[:, 0]),
+        quaternions,
+    )
+    return timestamps + round(prediction * 1e7), translations, quaternions
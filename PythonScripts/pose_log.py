@@ -0,0 +1,109 @@
+import time
+import numpy as np
+from sensor_protocol import intrinsics_to_camera_matrices
+
+
+POSE_COLUMNS = [f"m{row}{col}" for row in range(4) for col in range(4)]
+INTRINSICS_COLUMNS = ["fx", "fy", "cx", "cy"]
+
+
+class PoseLogWriter:
+    """
+    Incrementally append per-frame poses (and color intrinsics) to a CSV file.
+
+    Rows are staged in preallocated arrays and written every `flush_frames`
+    frames or `flush_interval` seconds, so memory stays bounded and a crash
+    loses at most one batch. Each row holds the Timestamp, the 4x4 transform
+    in column-vector convention flattened row by row, and fx fy cx cy when
+    `with_intrinsics` is set.
+    """
+
+    def __init__(
+        self, file_path, with_intrinsics=False, flush_frames=64, flush_interval=1.0
+    ) -> None:
+        self.file_path = file_path
+        self.with_intrinsics = with_intrinsics
+        self.flush_frames = flush_frames
+        self.flush_interval = flush_interval
+        self.num_frames = 0
+
+        self._timestamps = np.zeros(flush_frames, dtype=np.int64)
+        self._poses = np.zeros((flush_frames, 4, 4), dtype=np.float32)
+        self._intrinsics = np.zeros((flush_frames, 4), dtype=np.float32)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+        columns = ["Timestamp"] + POSE_COLUMNS
+        if with_intrinsics:
+            columns += INTRINSICS_COLUMNS
+        self._row_format = ",".join(["%d"] + ["%.9g"] * (len(columns) - 1)) + "\n"
+        self._file = open(file_path, "w")
+        self._file.write(",".join(columns) + "\n")
+
+    def write(self, timestamp, pose, intrinsics=None):
+        """
+        :param timestamp: frame Timestamp
+        :param pose: 4x4 transform
+        :param intrinsics: fx, fy, cx, cy (required if `with_intrinsics`)
+        """
+        i = self._pending
+        self._timestamps[i] = timestamp
+        self._poses[i] = pose
+        if self.with_intrinsics:
+            self._intrinsics[i] = intrinsics
+        self._pending += 1
+        self.num_frames += 1
+        if (
+            self._pending == self.flush_frames
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        count = self._pending
+        if count:
+            values = self._poses[:count].reshape(count, 16)
+            if self.with_intrinsics:
+                values = np.hstack((values, self._intrinsics[:count]))
+            self._file.writelines(
+                self._row_format % (timestamp, *row)
+                for timestamp, row in zip(
+                    self._timestamps[:count].tolist(), values.tolist()
+                )
+            )
+            self._pending = 0
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+def load_pose_log(file_path):
+    """
+    Load a pose log written by PoseLogWriter.
+
+    :returns: dict with contiguous arrays
+        "timestamps": (N,) int64
+        "poses": (N, 4, 4) float32
+        "intrinsics": (N, 3, 3) float32 camera matrices, only for color logs
+    """
+    with open(file_path, "r") as f:
+        columns = f.readline().strip().split(",")
+    with_intrinsics = columns[-len(INTRINSICS_COLUMNS) :] == INTRINSICS_COLUMNS
+    dtype = [("timestamp", "i8"), ("pose", "f4", (4, 4))]
+    if with_intrinsics:
+        dtype.append(("intrinsics", "f4", (4,)))
+    rows = np.loadtxt(file_path, delimiter=",", skiprows=1, dtype=dtype, ndmin=1)
+
+    trajectory = {
+        "timestamps": np.ascontiguousarray(rows["timestamp"]),
+        "poses": np.ascontiguousarray(rows["pose"]),
+    }
+    if with_intrinsics:
+        trajectory["intrinsics"] = intrinsics_to_camera_matrices(rows["intrinsics"])
+    return trajectory
@@ -0,0 +1,398 @@
+import math
+import argparse
+import numpy as np
+from sensor_protocol import UNIX_EPOCH
+
+
+# Rotate the HoloLens World coordinate system to match ROS World coordinate system
+# HoloLens World coordinate system: x left, y up, z backward
+# ROS World coordinate system: x forward, y left, z up
+HOLO_WORLD_TO_ROS_WORLD = np.array(
+    [[0, 0, -1, 0], [-1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]],
+    dtype=np.float32,
+)
+# Rotate the HoloLens Camera coordinate system to match ROS Camera coordinate system
+# HoloLens Camera coordinate system: x left, y up, z backward
+# ROS Camera coordinate system: x left, y down, z forward
+HOLO_PV_TO_ROS_CAM = np.array(
+    [[1, 0, 0, 0], [0, -1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]],
+    dtype=np.float32,
+)
+
+# rig2depth of the device the tools were developed with, replace it with
+# the extrinsics of your own device (see the README notes)
+DEFAULT_RIG2DEPTH = np.array(
+    [
+        0.022715600207448006,
+        -0.9995700120925903,
+        -0.018523599952459335,
+        -0.05916620045900345,
+        0.9609990119934082,
+        0.026939600706100464,
+        -0.27523499727249146,
+        -0.015487399883568287,
+        0.27561599016189575,
+        -0.011549100279808044,
+        0.9611979722976685,
+        -0.01788480021059513,
+        0.0,
+        0.0,
+        0.0,
+        1.0,
+    ],
+    dtype=np.float32,
+).reshape((4, 4))
+
+TF_CSV_COLUMNS = ["Timestamp", "stamp", "x", "y", "z", "qx", "qy", "qz", "qw"]
+
+
+class PoseChain:
+    """
+    `left @ pose @ right` with constant `left` and `right`, e.g.
+    HoloWorld2RosWorld @ pv2world @ HoloPV2RosCam.
+
+    The factors are converted once and the products are written into
+    preallocated buffers, so `apply` allocates nothing per frame.
+    """
+
+    def __init__(self, left=None, right=None) -> None:
+        eye = np.eye(4, dtype=np.float32)
+        self.left = np.ascontiguousarray(eye if left is None else left, dtype=np.float32)
+        self.right = np.ascontiguousarray(
+            eye if right is None else right, dtype=np.float32
+        )
+        self._partial = np.empty((4, 4), dtype=np.float32)
+        self._result = np.empty((4, 4), dtype=np.float32)
+
+    def apply(self, pose):
+        """
+        :returns: 4x4 buffer owned by the chain, overwritten by the next call
+        """
+        np.matmul(pose, self.right, out=self._partial)
+        return np.matmul(self.left, self._partial, out=self._result)
+
+    def apply_batch(self, poses):
+        """
+        :param poses: (N, 4, 4) transforms
+        :returns: new (N, 4, 4) array
+        """
+        return np.matmul(self.left, np.matmul(poses, self.right))
+
+
+def matrix_to_quaternion(transform):
+    """
+    Rotation part of a 3x3 or 4x4 matrix as an (x, y, z, w) tuple.
+
+    Plain float arithmetic, which beats NumPy and scipy call overhead for a
+    single matrix.
+    """
+    (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = (
+        row[:3] for row in transform[:3].tolist()
+    )
+    trace = m00 + m11 + m22
+    if trace >= m00 and trace >= m11 and trace >= m22:
+        x, y, z, w = m21 - m12, m02 - m20, m10 - m01, 1 + trace
+    elif m00 >= m11 and m00 >= m22:
+        x, y, z, w = 1 - trace + 2 * m00, m01 + m10, m02 + m20, m21 - m12
+    elif m11 >= m22:
+        x, y, z, w = m01 + m10, 1 - trace + 2 * m11, m12 + m21, m02 - m20
+    else:
+        x, y, z, w = m02 + m20, m12 + m21, 1 - trace + 2 * m22, m10 - m01
+    norm = math.sqrt(x * x + y * y + z * z + w * w)
+    return x / norm, y / norm, z / norm, w / norm
+
+
+def matrices_to_quaternions(transforms):
+    """
+    Vectorized `matrix_to_quaternion`.
+
+    :param transforms: (N, 3, 3) or (N, 4, 4) matrices
+    :returns: (N, 4) float64 array of (x, y, z, w)
+    """
+    m = np.asarray(transforms, dtype=np.float64)[:, :3, :3]
+    trace = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+    # same branch selection as matrix_to_quaternion: largest of the trace
+    # and the diagonal, which keeps the divisor away from zero
+    choice = np.argmax(
+        np.stack((trace, m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]), axis=-1), axis=-1
+    )
+    quaternions = np.empty((len(m), 4), dtype=np.float64)
+
+    rows = choice == 0
+    r = m[rows]
+    quaternions[rows] = np.stack(
+        (
+            r[:, 2, 1] - r[:, 1, 2],
+            r[:, 0, 2] - r[:, 2, 0],
+            r[:, 1, 0] - r[:, 0, 1],
+            1 + trace[rows],
+        ),
+        axis=-1,
+    )
+    for axis in range(3):
+        rows = choice == axis + 1
+        r = m[rows]
+        j, k = (axis + 1) % 3, (axis + 2) % 3
+        q = quaternions[rows]
+        q[:, axis] = 1 - trace[rows] + 2 * r[:, axis, axis]
+        q[:, j] = r[:, j, axis] + r[:, axis, j]
+        q[:, k] = r[:, k, axis] + r[:, axis, k]
+        q[:, 3] = r[:, k, j] - r[:, j, k]
+        quaternions[rows] = q
+    quaternions /= np.linalg.norm(quaternions, axis=-1, keepdims=True)
+    return quaternions
+
+
+def quaternion_to_matrix(quaternion):
+    """
+    Inverse of `matrix_to_quaternion`.
+
+    :param quaternion: unit (x, y, z, w) quaternion
+    :returns: 3x3 float64 rotation matrix
+    """
+    x, y, z, w = quaternion
+    return np.array(
+        [
+            [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+            [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+            [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+        ]
+    )
+
+
+def slerp(q0, q1, t):
+    """
+    Spherical linear interpolation of (x, y, z, w) quaternions along the
+    shorter arc. `t` outside [0, 1] extrapolates at the same angular rate.
+    """
+    dot = sum(a * b for a, b in zip(q0, q1))
+    if dot < 0:
+        q1, dot = [-b for b in q1], -dot
+    if dot > 0.9995:
+        # nearly parallel, normalized lerp avoids dividing by sin(~0)
+        q = [a + t * (b - a) for a, b in zip(q0, q1)]
+        norm = math.sqrt(sum(a * a for a in q))
+        return tuple(a / norm for a in q)
+    angle = math.acos(dot)
+    s0 = math.sin((1 - t) * angle) / math.sin(angle)
+    s1 = math.sin(t * angle) / math.sin(angle)
+    return tuple(s0 * a + s1 * b for a, b in zip(q0, q1))
+
+
+def slerp_batch(q0, q1, t):
+    """
+    Vectorized `slerp`.
+
+    :param q0, q1: (N, 4) quaternions
+    :param t: scalar or (N,) fractions
+    :returns: new (N, 4) float64 array
+    """
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.array(q1, dtype=np.float64)
+    t = np.broadcast_to(np.asarray(t, dtype=np.float64), (len(q0),))[:, None]
+    dot = np.einsum("ij,ij->i", q0, q1)[:, None]
+    q1 *= np.where(dot < 0, -1.0, 1.0)
+    dot = np.abs(dot)
+    angle = np.arccos(np.minimum(dot, 1.0))
+    # nearly parallel rows take the normalized lerp, like slerp
+    parallel = dot > 0.9995
+    sin = np.where(parallel, 1.0, np.sin(angle))
+    s0 = np.where(parallel, 1 - t, np.sin((1 - t) * angle) / sin)
+    s1 = np.where(parallel, t, np.sin(t * angle) / sin)
+    q = s0 * q0 + s1 * q1
+    norm = np.linalg.norm(q, axis=-1, keepdims=True)
+    return np.where(parallel, q / norm, q)
+
+
+def interpolate_pose(pose0, pose1, t):
+    """
+    Pose at fraction `t` from `pose0` to `pose1`: linear translation and
+    slerp rotation, extrapolating for `t` outside [0, 1].
+
+    :returns: new 4x4 float32 transform
+    """
+    pose = np.eye(4, dtype=np.float32)
+    pose[:3, :3] = quaternion_to_matrix(
+        slerp(matrix_to_quaternion(pose0), matrix_to_quaternion(pose1), t)
+    )
+    pose[:3, 3] = (1 - t) * pose0[:3, 3] + t * pose1[:3, 3]
+    return pose
+
+
+def transform_to_tf(transform):
+    """
+    :returns: ((x, y, z) translation, (x, y, z, w) quaternion) tuples
+    """
+    return tuple(transform[:3, 3].tolist()), matrix_to_quaternion(transform)
+
+
+def trajectory_to_tf(poses, chain=None):
+    """
+    Convert a whole trajectory in one vectorized pass.
+
+    :param poses: (N, 4, 4) transforms in column-vector convention
+    :param chain: optional PoseChain applied to every pose first
+    :returns: ((N, 3) translations, (N, 4) quaternions)
+    """
+    poses = np.asarray(poses)
+    if chain is not None:
+        poses = chain.apply_batch(poses)
+    return poses[:, :3, 3].astype(np.float64), matrices_to_quaternions(poses)
+
+
+def filetime_stamps(timestamps):
+    """
+    UNIX seconds of FILETIME timestamps, subtracting the epoch in integers
+    first to keep sub-microsecond precision.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    return (timestamps - UNIX_EPOCH * 10**7) * 1e-7
+
+
+def write_tf_csv(file_path, timestamps, translations, quaternions):
+    """
+    Write one row per pose: the device Timestamp, its UNIX time in seconds
+    (ROS stamp), translation and quaternion.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.hstack(
+        (filetime_stamps(timestamps)[:, None], translations, quaternions)
+    )
+    row_format = ",".join(["%d", "%.7f"] + ["%.9g"] * 7) + "\n"
+    with open(file_path, "w") as f:
+        f.write(",".join(TF_CSV_COLUMNS) + "\n")
+        f.writelines(
+            row_format % (timestamp, *row)
+            for timestamp, row in zip(timestamps.tolist(), values.tolist())
+        )
+
+
+def trajectory_to_tf_messages(
+    timestamps, translations, quaternions, reference_frame, child_frame
+):
+    """
+    TransformStamped messages for a converted trajectory, e.g. to write a
+    rosbag. Needs the ROS Python packages but no running master.
+    """
+    import rospy
+    from geometry_msgs.msg import TransformStamped
+
+    messages = []
+    stamps = filetime_stamps(timestamps)
+    for stamp, (tx, ty, tz), (qx, qy, qz, qw) in zip(
+        stamps.tolist(), translations.tolist(), quaternions.tolist()
+    ):
+        msg = TransformStamped()
+        msg.header.stamp = rospy.Time.from_sec(stamp)
+        msg.header.frame_id = reference_frame
+        msg.child_frame_id = child_frame
+        msg.transform.translation.x = tx
+        msg.transform.translation.y = ty
+        msg.transform.translation.z = tz
+        msg.transform.rotation.x = qx
+        msg.transform.rotation.y = qy
+        msg.transform.rotation.z = qz
+        msg.transform.rotation.w = qw
+        messages.append(msg)
+    return messages
+
+
+def ros_camera_chain(sensor_type, rig2depth=None):
+    """
+    PoseChain from the header pose to the ROS camera-to-world transform the
+    publisher sends on TF.
+    """
+    if sensor_type == "color":
+        return PoseChain(HOLO_WORLD_TO_ROS_WORLD, HOLO_PV_TO_ROS_CAM)
+    return PoseChain(HOLO_WORLD_TO_ROS_WORLD, np.linalg.inv(rig2depth))
+
+
+def load_depth_extrinsics_from_yaml(file_path):
+    import yaml
+
+    with open(file_path, "r") as f:
+        data = yaml.load(f, Loader=yaml.SafeLoader)
+    extr = np.array(data["extrinsics"], dtype=np.float32).reshape((4, 4))
+    return extr
+
+
+def load_trajectory(file_path):
+    """
+    Load (timestamps, poses, sensor_type) from a `--record` recording or a
+    PoseLogWriter CSV.
+    """
+    if file_path.endswith(".hl2rec"):
+        from frame_recorder import RecordingReader
+        from sensor_protocol import header_poses
+
+        reader = RecordingReader(file_path)
+        headers = reader.headers()
+        trajectory = (
+            reader.timestamps.copy(),
+            header_poses(headers).copy(),
+            reader.sensor_type,
+        )
+        reader.close()
+        return trajectory
+
+    from pose_log import load_pose_log
+
+    log = load_pose_log(file_path)
+    sensor_type = "color" if "intrinsics" in log else "depth"
+    return log["timestamps"], log["poses"], sensor_type
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Convert a recorded trajectory to ROS TF poses in a CSV file"
+    )
+    parser.add_argument("input", help="Recording (.hl2rec) or pose log (.csv)")
+    parser.add_argument("output", help="Output CSV file")
+    parser.add_argument(
+        "--rig2depth",
+        help="YAML file with the depth extrinsics, required for depth trajectories",
+        default=None,
+    )
+    parser.add_argument(
+        "--smoothing",
+        help="Smooth the poses like the publisher --tf_smoothing (seconds)",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--prediction",
+        help="Predict the poses like the publisher --tf_prediction (seconds)",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--window", help="Recent poses kept for smoothing", default=8, type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    timestamps, poses, sensor_type = load_trajectory(args.input)
+    if sensor_type == "depth" and args.rig2depth is None:
+        raise SystemExit("==> [ERROR] Depth trajectories need --rig2depth!!!")
+    rig2depth = (
+        load_depth_extrinsics_from_yaml(args.rig2depth) if args.rig2depth else None
+    )
+    translations, quaternions = trajectory_to_tf(
+        poses, ros_camera_chain(sensor_type, rig2depth)
+    )
+    if args.smoothing or args.prediction is not None:
+        from pose_filter import filter_trajectory
+
+        timestamps, translations, quaternions = filter_trajectory(
+            timestamps,
+            translations,
+            quaternions,
+            smoothing=args.smoothing,
+            prediction=args.prediction,
+            window=args.window,
+        )
+    write_tf_csv(args.output, timestamps, translations, quaternions)
+    print(f"==> [INFO] Wrote {len(timestamps)} {sensor_type} poses to {args.output}")
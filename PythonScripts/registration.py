@@ -0,0 +1,327 @@
+import os
+import time
+import asyncio
+import argparse
+from datetime import datetime
+import numpy as np
+from point_cloud import (
+    AHAT_INVALID_DEPTH,
+    DEPTH_SCALE,
+    DepthUnprojector,
+    load_depth_lut,
+    pinhole_lut,
+)
+from pose_utils import (
+    DEFAULT_RIG2DEPTH,
+    HOLO_PV_TO_ROS_CAM,
+    load_depth_extrinsics_from_yaml,
+)
+
+# PV frame size streamed by the app
+PV_WIDTH = 640
+PV_HEIGHT = 360
+# z-buffer value of pixels without depth
+NO_DEPTH = np.iinfo(np.uint16).max
+
+
+class DepthRegistration:
+    """
+    Project AHaT depth frames into the PV image.
+
+    Everything that depends only on the calibration is cached: the LUT rays
+    (as a DepthUnprojector), depth2rig, the PV camera axis flip and the
+    output buffers. Per frame, the depth camera to PV camera transform is
+    folded into one 4x4 matrix, so the points are unprojected straight into
+    PV camera space, projected with the header intrinsics and splatted into
+    a z-buffer with `np.minimum.at`.
+    """
+
+    def __init__(
+        self,
+        lut,
+        rig2depth,
+        width=PV_WIDTH,
+        height=PV_HEIGHT,
+        stride=1,
+        splat=1,
+        min_depth=0.0,
+        max_depth=None,
+        depth_scale=DEPTH_SCALE,
+        invalid_depth=AHAT_INVALID_DEPTH,
+    ) -> None:
+        """
+        :param lut: (512, 512, 3) AHaT unit rays, see `load_depth_lut`
+        :param rig2depth: 4x4 depth extrinsics of the device
+        :param width: PV image width
+        :param height: PV image height
+        :param stride: use every `stride`-th depth row and column
+        :param splat: side in PV pixels of the square each depth point
+            covers, larger values close the gaps between sparse depth pixels
+        """
+        self.width = width
+        self.height = height
+        self.splat = splat
+        self.depth_scale = depth_scale
+        self.unprojector = DepthUnprojector(
+            lut,
+            stride=stride,
+            min_depth=min_depth,
+            max_depth=max_depth,
+            depth_scale=depth_scale,
+            invalid_depth=invalid_depth,
+        )
+        self.depth2rig = np.linalg.inv(rig2depth).astype(np.float32)
+        # (row, column) offsets of the splat footprint, centered
+        offsets = np.arange(splat) - (splat - 1) // 2
+        self._splat_offsets = [(dy, dx) for dy in offsets for dx in offsets]
+        self._zbuffer = np.empty(height * width, dtype=np.uint16)
+        self._registered = np.empty((height, width), dtype=np.uint16)
+
+    def depth_to_pv(self, rig2world, pv2world):
+        """
+        :returns: 4x4 transform from the depth camera to the PV camera, in
+            the ROS (OpenCV) camera convention: x right, y down, z forward
+        """
+        world2pv = np.linalg.inv(np.asarray(pv2world, dtype=np.float64))
+        return (
+            HOLO_PV_TO_ROS_CAM
+            @ world2pv
+            @ np.asarray(rig2world, dtype=np.float64)
+            @ self.depth2rig
+        ).astype(np.float32)
+
+    def register(self, depth, rig2world, pv2world, intrinsics):
+        """
+        :param depth: (512, 512[, 1]) uint16 AHaT depth image
+        :param rig2world: depth pose at the PV frame time
+        :param pv2world: PV pose
+        :param intrinsics: PV fx, fy, cx, cy
+        :returns: (height, width) uint16 depth along the PV optical axis, in
+            depth units (millimeters), 0 where no point landed. A buffer
+            owned by this object, overwritten by the next call
+        """
+        fx, fy, cx, cy = (float(value) for value in intrinsics)
+        points = self.unprojector.unproject(
+            depth, self.depth_to_pv(rig2world, pv2world)
+        )
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+
+        in_front = z > 0
+        x, y, z = x[in_front], y[in_front], z[in_front]
+        inv_z = np.reciprocal(z)
+        # pixel centers are at integer coordinates, round by flooring u + 0.5
+        u = x * inv_z
+        u *= fx
+        u += cx + 0.5
+        v = y * inv_z
+        v *= fy
+        v += cy + 0.5
+        inside = (u >= 0) & (u < self.width) & (v >= 0) & (v < self.height)
+        columns = u[inside].astype(np.int32)
+        rows = v[inside].astype(np.int32)
+        values = z[inside]
+        values *= 1 / self.depth_scale
+        values = np.minimum(values, NO_DEPTH - 1).astype(np.uint16)
+
+        zbuffer = self._zbuffer
+        zbuffer.fill(NO_DEPTH)
+        if self.splat == 1:
+            np.minimum.at(zbuffer, rows * self.width + columns, values)
+        else:
+            for dy, dx in self._splat_offsets:
+                r, c = rows + dy, columns + dx
+                keep = (r >= 0) & (r < self.height) & (c >= 0) & (c < self.width)
+                np.minimum.at(zbuffer, r[keep] * self.width + c[keep], values[keep])
+
+        registered = self._registered
+        np.copyto(registered.reshape(-1), zbuffer)
+        registered[registered == NO_DEPTH] = 0
+        return registered
+
+
+class RegistrationOutput:
+    """
+    RGBDSyncConsumer output registering the depth of every pair into its
+    color frame. The registered depth is passed to `callback(pair,
+    registered)`, shown over the color image and/or saved as 16-bit PNG
+    next to the color JPG.
+    """
+
+    def __init__(
+        self,
+        registration,
+        callback=None,
+        output_folder=None,
+        show=True,
+        view_depth_distance=2.0,
+    ) -> None:
+        self.registration = registration
+        self.callback = callback
+        self.output_folder = output_folder
+        self.viewer = None
+        self.image_writer = None
+        self.frames = 0
+        self.register_time = 0.0
+        if show:
+            from frame_viewer import FrameViewer, depth_colormap_lut
+
+            self.viewer = FrameViewer()
+            self.lut = depth_colormap_lut(view_depth_distance)
+        if output_folder is not None:
+            from image_writer import AsyncImageWriter
+
+            os.makedirs(output_folder, exist_ok=True)
+            self.image_writer = AsyncImageWriter()
+
+    def __call__(self, pair):
+        from async_client import StopStreaming
+
+        start = time.perf_counter()
+        registered = self.registration.register(
+            pair.depth_image,
+            pair.rig2world,
+            pair.pv2world,
+            pair.color.header.intrinsics,
+        )
+        self.register_time += time.perf_counter() - start
+        self.frames += 1
+
+        if self.callback is not None:
+            self.callback(pair, registered)
+        if self.image_writer is not None:
+            name = os.path.join(self.output_folder, f"{{}}_{pair.timestamp}")
+            self.image_writer.submit(name.format("color") + ".jpg", pair.color_image)
+            self.image_writer.submit(name.format("registered_depth") + ".png", registered)
+        if self.viewer is not None:
+            from frame_viewer import colorize_depth
+
+            overlay = pair.color_image[:, :, :3].copy()
+            colored = colorize_depth(registered, self.lut)
+            has_depth = registered > 0
+            overlay[has_depth] = overlay[has_depth] // 2 + colored[has_depth, :3] // 2
+            self.viewer.show(f"Hololens2 {pair.device} registered depth", overlay)
+            if self.viewer.stop_requested:
+                raise StopStreaming()
+
+    def close(self):
+        if self.image_writer is not None:
+            self.image_writer.close()
+        if self.viewer is not None:
+            self.viewer.close()
+        if self.frames:
+            print(
+                f"==> [INFO] Registered {self.frames} depth frames, "
+                f"{self.register_time / self.frames * 1e3:.2f} ms/frame"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Register AHaT depth into the PV color frames"
+    )
+    parser.add_argument(
+        "--host",
+        help="Address(es) of the HoloLens device(s) to connect",
+        nargs="+",
+        default=["192.168.50.210"],
+    )
+    parser.add_argument(
+        "--recordings",
+        help="Register a color and a depth recording offline instead of streaming",
+        nargs=2,
+        metavar=("COLOR", "DEPTH"),
+        default=None,
+    )
+    parser.add_argument(
+        "--depth_lut",
+        help="Depth AHaT_lut.bin of the device, an ideal pinhole if not set",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--rig2depth",
+        help="YAML file with the depth extrinsics, the sample device if not set",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--stride",
+        help="Use every n-th depth row and column",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--splat",
+        help="PV pixels (square side) covered by each depth point",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--tolerance_ms",
+        help="Largest color/depth Timestamp difference of a pair",
+        default=15.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--save_image",
+        help="Save color JPGs and registered depth PNGs to <output_folder>",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--headless", help="Do not open viewer windows", action="store_true"
+    )
+    parser.add_argument(
+        "--output_folder",
+        help="Output folder for saved images",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "output",
+            datetime.now().strftime("%Y%m%d_%H%M%S"),
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    from async_client import AsyncStreamingClient, StopStreaming
+    from rgbd_sync import RGBDSyncConsumer, synchronize, recording_frames
+
+    args = parse_args()
+    lut = load_depth_lut(args.depth_lut) if args.depth_lut else pinhole_lut()
+    rig2depth = (
+        load_depth_extrinsics_from_yaml(args.rig2depth)
+        if args.rig2depth
+        else DEFAULT_RIG2DEPTH
+    )
+    output = RegistrationOutput(
+        DepthRegistration(lut, rig2depth, stride=args.stride, splat=args.splat),
+        output_folder=args.output_folder if args.save_image else None,
+        show=not args.headless,
+    )
+
+    if args.recordings:
+        try:
+            for pair in synchronize(
+                recording_frames(*args.recordings),
+                args.tolerance_ms,
+                device="recording",
+                copy=False,
+            ):
+                output(pair)
+        except (StopStreaming, KeyboardInterrupt):
+            pass
+        finally:
+            output.close()
+    else:
+        client = AsyncStreamingClient(
+            consumers=[RGBDSyncConsumer([output], args.tolerance_ms)]
+        )
+        for host in args.host:
+            for sensor_type in ("color", "depth"):
+                client.add_stream(host, sensor_type)
+        try:
+            asyncio.run(client.run())
+        except KeyboardInterrupt:
+            pass
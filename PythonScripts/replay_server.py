@@ -0,0 +1,353 @@
+import socket
+import threading
+import time
+import argparse
+import numpy as np
+from frame_recorder import RecordingReader
+from sensor_protocol import (
+    HEADER_PREFIX_STRUCT,
+    HEADER_STRUCTS,
+    PIXEL_FORMATS,
+    SENSOR_FRAME_STRUCTURE,
+    unix_to_filetime,
+)
+
+
+# Default stream settings of the HoloLens 2 streamer
+SENSOR_DEFAULTS = {
+    "color": {"width": 640, "height": 360, "pixel_stride": 3, "fps": 30.0},
+    "depth": {"width": 512, "height": 512, "pixel_stride": 2, "fps": 45.0},
+}
+
+
+class SyntheticFrameSource:
+    """
+    Generate frames that follow the HoloLens 2 streaming protocol.
+
+    A short cycle of payloads is rendered up front so that serving frames at
+    the maximum rate is not limited by frame generation. The pose orbits the
+    world origin so downstream pose handling sees motion.
+    """
+
+    def __init__(
+        self,
+        sensor_type,
+        width=None,
+        height=None,
+        pixel_stride=None,
+        row_padding=0,
+        num_frames=16,
+    ) -> None:
+        defaults = SENSOR_DEFAULTS[sensor_type]
+        self.sensor_type = sensor_type
+        self.width = width or defaults["width"]
+        self.height = height or defaults["height"]
+        self.pixel_stride = pixel_stride or defaults["pixel_stride"]
+        self.row_stride = self.width * self.pixel_stride + row_padding
+        self.header_struct = HEADER_STRUCTS[sensor_type]
+        self.payloads = [self._render(i, num_frames) for i in range(num_frames)]
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def _render(self, i, num_frames):
+        dtype, channels, _ = PIXEL_FORMATS[self.pixel_stride]
+        phase = 2 * np.pi * i / num_frames
+        rows = np.linspace(0, 1, self.height, dtype=np.float32)[:, None]
+        cols = np.linspace(0, 1, self.width, dtype=np.float32)[None, :]
+        if dtype == np.uint16:
+            # tilted plane 0.5-1.5 m away, AHaT depth in millimeters
+            image = 1000 + 400 * cols + 100 * np.sin(phase + 4 * rows)
+            image = image.astype(np.uint16)[:, :, None]
+        else:
+            image = np.empty((self.height, self.width, channels), dtype=np.uint8)
+            image[:, :, 0] = 255 * cols
+            image[:, :, 1] = 255 * rows
+            image[:, :, 2] = 127 * (1 + np.sin(phase + 6 * cols))
+            if channels == 4:
+                image[:, :, 3] = 255
+
+        payload = bytearray(self.height * self.row_stride)
+        rows_view = np.ndarray(
+            (self.height, self.row_stride), dtype=np.uint8, buffer=payload
+        )
+        rows_view[:, : self.width * self.pixel_stride] = image.view(np.uint8).reshape(
+            self.height, -1
+        )
+        return payload
+
+    def pose(self, seconds):
+        angle = 2 * np.pi * seconds / 10.0
+        pose = np.eye(4, dtype=np.float32)
+        pose[0, 0] = pose[2, 2] = np.cos(angle)
+        pose[0, 2] = np.sin(angle)
+        pose[2, 0] = -np.sin(angle)
+        pose[:3, 3] = (0.5 * np.sin(angle), 1.6, 0.5 * np.cos(angle))
+        return pose
+
+    def frame(self, i, timestamp):
+        """
+        :returns: (raw header, raw payload) of frame `i` stamped `timestamp`
+        """
+        # transforms travel in the HoloLens row-vector convention
+        pose_values = self.pose(timestamp * 1e-7).T.ravel()
+        if self.sensor_type == "color":
+            focal = 0.77 * self.width
+            values = (focal, focal, self.width / 2, self.height / 2, *pose_values)
+        else:
+            values = tuple(pose_values)
+        header = self.header_struct.pack(
+            timestamp,
+            self.width,
+            self.height,
+            self.pixel_stride,
+            self.row_stride,
+            *values,
+        )
+        return header, self.payloads[i % len(self.payloads)]
+
+
+class RecordingFrameSource:
+    """
+    Serve the frames of a recording made with `--record`.
+
+    :param retime: rewrite each Timestamp to the send time, so latency
+        measured by the client reflects the replay rather than the recording
+    """
+
+    def __init__(self, file_path, retime=True) -> None:
+        self.reader = RecordingReader(file_path)
+        self.sensor_type = self.reader.sensor_type
+        self.retime = retime
+
+    def __len__(self):
+        return len(self.reader)
+
+    def frame(self, i, timestamp):
+        header, payload = self.reader.raw_frame(i % len(self.reader))
+        if not self.retime:
+            return header, payload
+        header = bytearray(header)
+        HEADER_PREFIX_STRUCT.pack_into(
+            header, 0, timestamp, *HEADER_PREFIX_STRUCT.unpack_from(header)[1:]
+        )
+        return header, payload
+
+
+class ReplayServer:
+    """
+    Emulate one HoloLens 2 sensor stream on a TCP port.
+
+    Every client gets its own thread and frame sequence. With `fps` set,
+    frames are paced like the device and frames that cannot be sent on time
+    are skipped; with `fps=0` frames are sent back to back ("max rate").
+    `bandwidth` (bytes per second) additionally caps the send rate.
+    """
+
+    def __init__(
+        self,
+        source,
+        host="0.0.0.0",
+        port=None,
+        fps=None,
+        bandwidth=None,
+        max_frames=None,
+        loop=True,
+    ) -> None:
+        self.source = source
+        self.sensor_type = source.sensor_type
+        self.host = host
+        self.port = (
+            SENSOR_FRAME_STRUCTURE[self.sensor_type]["port"] if port is None else port
+        )
+        self.fps = SENSOR_DEFAULTS[self.sensor_type]["fps"] if fps is None else fps
+        self.bandwidth = bandwidth
+        self.max_frames = max_frames
+        self.loop = loop
+
+        self.connections = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen()
+        self.socket.settimeout(0.5)
+        # port 0 lets the OS pick one
+        self.port = self.socket.getsockname()[1]
+
+    @property
+    def address(self):
+        return self.socket.getsockname()
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self._thread = threading.Thread(
+            target=self.serve_forever, name=f"ReplayServer-{self.port}", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.socket.close()
+
+    def serve_forever(self):
+        print(
+            f"==> [INFO] Serving {self.sensor_type} frames on {self.host}:{self.port} "
+            f"({'max rate' if not self.fps else f'{self.fps} FPS'})"
+        )
+        while not self._stop_event.is_set():
+            try:
+                conn, address = self.socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self._lock:
+                self.connections += 1
+            print(f"==> [INFO] Client connected... ({address[0]}:{address[1]})")
+            threading.Thread(
+                target=self._serve_client, args=(conn, address), daemon=True
+            ).start()
+
+    def _serve_client(self, conn, address):
+        period = 1.0 / self.fps if self.fps else 0.0
+        num_frames = self.max_frames
+        if num_frames is None and not self.loop:
+            num_frames = len(self.source)
+        i = 0
+        start = next_time = time.perf_counter()
+        sent_bytes = 0
+        conn.settimeout(None)
+        with conn:
+            while not self._stop_event.is_set() and (num_frames is None or i < num_frames):
+                now = time.perf_counter()
+                if period:
+                    if now < next_time:
+                        time.sleep(next_time - now)
+                    elif now - next_time > period:
+                        # the camera does not wait for a slow client
+                        next_time += period
+                        i += 1
+                        with self._lock:
+                            self.frames_skipped += 1
+                        continue
+                    next_time += period
+                if self.bandwidth:
+                    budget_time = start + sent_bytes / self.bandwidth
+                    if budget_time > now:
+                        time.sleep(budget_time - now)
+
+                header, payload = self.source.frame(i, unix_to_filetime(time.time()))
+                try:
+                    conn.sendall(header)
+                    conn.sendall(payload)
+                except OSError:
+                    print(f"==> [INFO] Client disconnected... ({address[0]}:{address[1]})")
+                    return
+                frame_bytes = len(header) + len(payload)
+                sent_bytes += frame_bytes
+                i += 1
+                with self._lock:
+                    self.frames_sent += 1
+                    self.bytes_sent += frame_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "frames_sent": self.frames_sent,
+                "frames_skipped": self.frames_skipped,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="Address to listen on", default="0.0.0.0")
+    parser.add_argument(
+        "--sensor_type",
+        help="Sensor streams to serve, all/depth/color",
+        choices=["color", "depth", "all"],
+        default="all",
+    )
+    parser.add_argument(
+        "--recording",
+        help="Serve a .hl2rec recording instead of synthetic frames "
+        "(its sensor type overrides --sensor_type)",
+        nargs="*",
+        default=[],
+    )
+    parser.add_argument(
+        "--fps",
+        help="Frame rate, 0 for max rate (default: 30 color, 45 depth)",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--bandwidth", help="Send rate cap per client in MB/s", default=None, type=float
+    )
+    parser.add_argument("--width", help="Synthetic image width", default=None, type=int)
+    parser.add_argument("--height", help="Synthetic image height", default=None, type=int)
+    parser.add_argument(
+        "--pixel_stride",
+        help="Synthetic pixel stride (2: Gray16, 3: Bgr8, 4: Bgra8)",
+        choices=[2, 3, 4],
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--row_padding", help="Synthetic RowStride padding in bytes", default=0, type=int
+    )
+    parser.add_argument(
+        "--max_frames", help="Frames per client before closing", default=None, type=int
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.recording:
+        sources = [RecordingFrameSource(file_path) for file_path in args.recording]
+    else:
+        sensor_types = ["color", "depth"] if args.sensor_type == "all" else [args.sensor_type]
+        sources = [
+            SyntheticFrameSource(
+                sensor_type,
+                width=args.width,
+                height=args.height,
+                pixel_stride=args.pixel_stride,
+                row_padding=args.row_padding,
+            )
+            for sensor_type in sensor_types
+        ]
+
+    servers = [
+        ReplayServer(
+            source,
+            host=args.host,
+            fps=args.fps,
+            bandwidth=args.bandwidth * 1e6 if args.bandwidth else None,
+            max_frames=args.max_frames,
+        ).start()
+        for source in sources
+    ]
+    try:
+        while True:
+            time.sleep(5.0)
+            for server in servers:
+                print(f"==> [INFO] {server.sensor_type}: {server.stats()}")
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
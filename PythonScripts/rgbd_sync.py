@@ -0,0 +1,545 @@
+import os
+import asyncio
+import argparse
+from collections import deque
+from datetime import datetime
+import numpy as np
+from async_client import AsyncStreamingClient, StopStreaming, stream_file_name
+from pose_utils import filetime_stamps, interpolate_pose
+from sensor_protocol import SensorFrameHeader
+
+# Header Timestamps are in hundreds of nanoseconds
+TICKS_PER_MS = 10**4
+# Poses further apart than this are not interpolated, the partner pose is used
+MAX_INTERPOLATION_GAP_MS = 200.0
+
+
+class SyncedFrame:
+    """
+    A frame held by the synchronizer. The decoded header owns a copy of the
+    raw header, the payload is copied unless the caller keeps it alive.
+    """
+
+    __slots__ = ("header", "payload")
+
+    def __init__(self, sensor_type, raw_header, payload, copy=True) -> None:
+        self.header = SensorFrameHeader(sensor_type).decode(raw_header)
+        self.payload = bytes(payload) if copy else payload
+
+    @property
+    def timestamp(self):
+        return self.header.Timestamp
+
+    @property
+    def pose(self):
+        return self.header.pose
+
+    @property
+    def raw_header(self):
+        return self.header.buffer
+
+    @property
+    def image(self):
+        return self.header.image_view(self.payload)
+
+
+class RGBDFrame:
+    """
+    A color frame and the depth frame closest in time.
+
+    `rig2world` is the depth pose interpolated to the color Timestamp and
+    `pv2world_at_depth` the color pose interpolated to the depth Timestamp,
+    so either image can be put in the other's frame of reference.
+    """
+
+    __slots__ = ("device", "color", "depth", "rig2world", "pv2world_at_depth")
+
+    def __init__(self, device, color, depth, rig2world, pv2world_at_depth) -> None:
+        self.device = device
+        self.color = color
+        self.depth = depth
+        self.rig2world = rig2world
+        self.pv2world_at_depth = pv2world_at_depth
+
+    @property
+    def timestamp(self):
+        return self.color.timestamp
+
+    @property
+    def offset_ms(self):
+        """
+        Depth Timestamp minus color Timestamp.
+        """
+        return (self.depth.timestamp - self.color.timestamp) / TICKS_PER_MS
+
+    @property
+    def pv2world(self):
+        return self.color.pose
+
+    @property
+    def color_image(self):
+        return self.color.image
+
+    @property
+    def depth_image(self):
+        return self.depth.image
+
+
+def _interpolate(frame0, frame1, timestamp):
+    """
+    Pose of `frame0`/`frame1` at `timestamp`, a copy of the closest pose if
+    the frames are too far apart.
+    """
+    span = frame1.timestamp - frame0.timestamp
+    if span <= 0 or span > MAX_INTERPOLATION_GAP_MS * TICKS_PER_MS:
+        closest = (
+            frame0
+            if abs(timestamp - frame0.timestamp) <= abs(frame1.timestamp - timestamp)
+            else frame1
+        )
+        return closest.pose.copy()
+    return interpolate_pose(
+        frame0.pose, frame1.pose, (timestamp - frame0.timestamp) / span
+    )
+
+
+class RGBDSynchronizer:
+    """
+    Pair the color and depth frames of one device by header Timestamp.
+
+    Every color frame is matched with the closest depth frame within
+    `tolerance_ms`, as soon as a depth frame at or after its Timestamp has
+    arrived. Each frame enters and leaves a queue once, so pushing a frame
+    is O(1) amortized. Both queues are bounded: when the partner stream
+    stalls, the oldest frames are dropped instead of growing memory, and
+    frames older than the last one of their stream are dropped as stale.
+    """
+
+    def __init__(self, tolerance_ms=15.0, queue_size=16, device=None) -> None:
+        self.tolerance = int(tolerance_ms * TICKS_PER_MS)
+        self.queue_size = queue_size
+        self.device = device
+        self.color_queue = deque()
+        self.depth_queue = deque()
+        # last frames popped from the queues, the lower pose neighbors
+        self.previous_color = None
+        self.previous_depth = None
+
+        self.pairs = 0
+        self.unmatched = 0
+        self.dropped = {"color": 0, "depth": 0}
+        self.stale = 0
+        self.offset_sum = 0.0
+
+    def push(self, sensor_type, raw_header, payload, copy=True):
+        """
+        :param copy: copy the payload, required when it is a receive buffer
+            that will be reused
+        :returns: list of the RGBDFrame pairs completed by this frame
+        """
+        frame = SyncedFrame(sensor_type, raw_header, payload, copy)
+        queue = self.color_queue if sensor_type == "color" else self.depth_queue
+        last = queue[-1] if queue else (
+            self.previous_color if sensor_type == "color" else self.previous_depth
+        )
+        if last is not None and frame.timestamp <= last.timestamp:
+            self.stale += 1
+            return []
+        if len(queue) >= self.queue_size:
+            popped = queue.popleft()
+            self.dropped[sensor_type] += 1
+            if sensor_type == "color":
+                self.previous_color = popped
+            else:
+                self.previous_depth = popped
+        queue.append(frame)
+        return self._match()
+
+    def _match(self):
+        pairs = []
+        colors, depths = self.color_queue, self.depth_queue
+        while colors:
+            color = colors[0]
+            timestamp = color.timestamp
+            # keep only the last depth frame at or before the color frame
+            while len(depths) >= 2 and depths[1].timestamp <= timestamp:
+                self.previous_depth = depths.popleft()
+            if not depths:
+                break
+            if depths[0].timestamp >= timestamp:
+                before, after = self.previous_depth, depths[0]
+            elif len(depths) >= 2:
+                before, after = depths[0], depths[1]
+            else:
+                # a closer depth frame may still come
+                break
+
+            if before is None or after.timestamp - timestamp < timestamp - before.timestamp:
+                depth = after
+            else:
+                depth = before
+            previous_color = self.previous_color
+            self.previous_color = colors.popleft()
+            if abs(depth.timestamp - timestamp) > self.tolerance:
+                self.unmatched += 1
+                continue
+
+            rig2world = (
+                depth.pose.copy()
+                if before is None
+                else _interpolate(before, after, timestamp)
+            )
+            pairs.append(
+                RGBDFrame(
+                    self.device,
+                    color,
+                    depth,
+                    rig2world,
+                    self._color_pose_at(previous_color, color, depth.timestamp),
+                )
+            )
+            self.pairs += 1
+            self.offset_sum += abs(depth.timestamp - timestamp)
+        return pairs
+
+    def _color_pose_at(self, previous, color, timestamp):
+        """
+        pv2world at `timestamp`, between `color` and its previous or next
+        color frame, extrapolated when the next one has not arrived yet.
+        """
+        if timestamp >= color.timestamp and self.color_queue:
+            return _interpolate(color, self.color_queue[0], timestamp)
+        if previous is not None:
+            return _interpolate(previous, color, timestamp)
+        return color.pose.copy()
+
+    def stats(self):
+        return {
+            "pairs": self.pairs,
+            "unmatched_color": self.unmatched,
+            "dropped_color": self.dropped["color"],
+            "dropped_depth": self.dropped["depth"],
+            "stale": self.stale,
+            "offset_ms_avg": round(
+                self.offset_sum / max(self.pairs, 1) / TICKS_PER_MS, 3
+            ),
+            "queued": (len(self.color_queue), len(self.depth_queue)),
+        }
+
+
+def synchronize(frames, tolerance_ms=15.0, queue_size=16, device=None, copy=True):
+    """
+    Iterate the RGBD pairs of a frame sequence.
+
+    :param frames: iterable of (sensor_type, raw header, payload), in
+        arrival order
+    """
+    synchronizer = RGBDSynchronizer(tolerance_ms, queue_size, device)
+    for sensor_type, raw_header, payload in frames:
+        yield from synchronizer.push(sensor_type, raw_header, payload, copy)
+
+
+def recording_frames(color_path, depth_path):
+    """
+    Merge a color and a depth `--record` recording by Timestamp, as
+    (sensor_type, raw header, payload) tuples for `synchronize`.
+    """
+    from frame_recorder import RecordingReader
+
+    readers = [RecordingReader(color_path), RecordingReader(depth_path)]
+    try:
+        sensor_types = [reader.sensor_type for reader in readers]
+        positions = [0, 0]
+        while True:
+            remaining = [i for i in (0, 1) if positions[i] < len(readers[i])]
+            if not remaining:
+                break
+            i = min(remaining, key=lambda i: readers[i].timestamps[positions[i]])
+            raw_header, payload = readers[i].raw_frame(positions[i])
+            positions[i] += 1
+            frame = (sensor_types[i], bytes(raw_header), bytes(payload))
+            # views of the file map would keep it from closing
+            raw_header.release()
+            payload.release()
+            yield frame
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+class RGBDSyncConsumer:
+    """
+    AsyncStreamingClient consumer pairing the color and depth streams of
+    every device and handing each RGBDFrame to the outputs.
+
+    An output is a callable taking an RGBDFrame, may raise StopStreaming and
+    may define `close()`.
+    """
+
+    def __init__(self, outputs, tolerance_ms=15.0, queue_size=16) -> None:
+        self.outputs = list(outputs)
+        self.tolerance_ms = tolerance_ms
+        self.queue_size = queue_size
+        self.synchronizers = {}
+
+    def __call__(self, frame):
+        synchronizer = self.synchronizers.get(frame.device)
+        if synchronizer is None:
+            synchronizer = self.synchronizers[frame.device] = RGBDSynchronizer(
+                self.tolerance_ms, self.queue_size, frame.device
+            )
+        for pair in synchronizer.push(
+            frame.sensor_type, frame.raw_header, frame.payload
+        ):
+            for output in self.outputs:
+                output(pair)
+
+    def close(self):
+        for output in self.outputs:
+            close = getattr(output, "close", None)
+            if close is not None:
+                close()
+        for device, synchronizer in self.synchronizers.items():
+            print(f"==> [INFO] {device} RGBD sync stats: {synchronizer.stats()}")
+
+
+class RGBDRecordOutput:
+    """
+    Record the pairs of every device to `<device>_rgbd_color.hl2rec` and
+    `<device>_rgbd_depth.hl2rec`, frame `i` of one matching frame `i` of
+    the other, plus `<device>_rgbd_pairs.csv` with the offsets and the
+    interpolated poses.
+    """
+
+    def __init__(self, output_folder) -> None:
+        from frame_recorder import FrameRecorder
+
+        self.FrameRecorder = FrameRecorder
+        self.output_folder = output_folder
+        self.devices = {}
+        os.makedirs(output_folder, exist_ok=True)
+
+    def _open(self, device):
+        prefix = os.path.join(self.output_folder, stream_file_name(device, "rgbd"))
+        pairs_file = open(f"{prefix}_pairs.csv", "w")
+        pairs_file.write(
+            ",".join(
+                ["color_timestamp", "depth_timestamp", "offset_ms"]
+                + [f"rig2world_{i}{j}" for i in range(4) for j in range(4)]
+                + [f"pv2world_at_depth_{i}{j}" for i in range(4) for j in range(4)]
+            )
+            + "\n"
+        )
+        return (
+            self.FrameRecorder(f"{prefix}_color.hl2rec", "color"),
+            self.FrameRecorder(f"{prefix}_depth.hl2rec", "depth"),
+            pairs_file,
+        )
+
+    def __call__(self, pair):
+        files = self.devices.get(pair.device)
+        if files is None:
+            files = self.devices[pair.device] = self._open(pair.device)
+        color_recorder, depth_recorder, pairs_file = files
+        color_recorder.write(pair.color.raw_header, pair.color.payload)
+        depth_recorder.write(pair.depth.raw_header, pair.depth.payload)
+        values = np.concatenate(
+            (pair.rig2world.ravel(), pair.pv2world_at_depth.ravel())
+        ).tolist()
+        pairs_file.write(
+            f"{pair.color.timestamp},{pair.depth.timestamp},{pair.offset_ms:.4f},"
+            + ",".join(f"{value:.9g}" for value in values)
+            + "\n"
+        )
+
+    def close(self):
+        for device, (color_recorder, depth_recorder, pairs_file) in self.devices.items():
+            color_recorder.close()
+            depth_recorder.close()
+            pairs_file.close()
+            print(
+                f"==> [INFO] Recorded {color_recorder.num_frames} RGBD pairs of "
+                f"{device} to {self.output_folder}"
+            )
+
+
+class RosRGBDOutput:
+    """
+    Publish the pairs on `/<serial>/rgbd/color/image_raw` and
+    `/<serial>/rgbd/depth/image_raw`. Both images of a pair carry the color
+    stamp, so `message_filters.TimeSynchronizer` pairs them exactly.
+    """
+
+    def __init__(self, serials=None, node_id="hololens2_rgbd_sync") -> None:
+        import rospy
+        from sensor_msgs.msg import Image
+
+        self.rospy = rospy
+        self.Image = Image
+        self.serials = serials or {}
+        self.publishers = {}
+        rospy.init_node(name=node_id, anonymous=False, disable_signals=True)
+
+    def _open(self, device):
+        serial = self.serials.get(device, stream_file_name(device, "hololens2"))
+        publishers = {}
+        for sensor_type in ("color", "depth"):
+            msg = self.Image()
+            msg.header.frame_id = f"{serial}_{sensor_type}_optical_frame"
+            msg.is_bigendian = 0
+            publishers[sensor_type] = (
+                self.rospy.Publisher(
+                    f"/{serial}/rgbd/{sensor_type}/image_raw", self.Image, queue_size=2
+                ),
+                msg,
+            )
+        return publishers
+
+    def __call__(self, pair):
+        publishers = self.publishers.get(pair.device)
+        if publishers is None:
+            publishers = self.publishers[pair.device] = self._open(pair.device)
+        stamp = self.rospy.Time.from_sec(float(filetime_stamps([pair.timestamp])[0]))
+        for frame in (pair.color, pair.depth):
+            publisher, msg = publishers[frame.header.sensor_type]
+            header = frame.header
+            msg.header.stamp = stamp
+            msg.height = header.ImageHeight
+            msg.width = header.ImageWidth
+            msg.encoding = header.encoding
+            msg.step = header.RowStride
+            msg.data = bytes(frame.payload)
+            publisher.publish(msg)
+        if self.rospy.is_shutdown():
+            raise StopStreaming()
+
+
+class RGBDDisplayOutput:
+    """
+    Show the color and depth images of each pair, press "q" to stop.
+    """
+
+    def __init__(self, view_depth_distance=2.0, max_fps=30.0) -> None:
+        from frame_viewer import FrameViewer
+
+        self.viewer = FrameViewer(max_fps, view_depth_distance=view_depth_distance)
+
+    def __call__(self, pair):
+        self.viewer.show(f"Hololens2 {pair.device} RGBD color", pair.color_image)
+        self.viewer.show(
+            f"Hololens2 {pair.device} RGBD depth", pair.depth_image, depth=True
+        )
+        if self.viewer.stop_requested:
+            raise StopStreaming()
+
+    def close(self):
+        self.viewer.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pair color and depth frames by Timestamp"
+    )
+    parser.add_argument(
+        "--host",
+        help="Address(es) of the HoloLens device(s) to connect",
+        nargs="+",
+        default=["192.168.50.210"],
+    )
+    parser.add_argument(
+        "--recordings",
+        help="Pair a color and a depth recording offline instead of streaming",
+        nargs=2,
+        metavar=("COLOR", "DEPTH"),
+        default=None,
+    )
+    parser.add_argument(
+        "--tolerance_ms",
+        help="Largest color/depth Timestamp difference of a pair",
+        default=15.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--queue_size",
+        help="Frames queued per stream while waiting for a partner",
+        default=16,
+        type=int,
+    )
+    parser.add_argument(
+        "--record",
+        help="Record the pairs to <output_folder>/<device>_rgbd_*",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--ros",
+        help="Publish the pairs on /<holo_serial>/rgbd/{color,depth}/image_raw",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--holo_serial",
+        help="HoloLens serial(s) naming the ROS topics, one per host",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "--headless", help="Do not open viewer windows", action="store_true"
+    )
+    parser.add_argument(
+        "--stats_interval",
+        help="Seconds between stats lines, 0 to disable",
+        default=5.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--output_folder",
+        help="Output folder for recorded pairs",
+        default=os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "output",
+            datetime.now().strftime("%Y%m%d_%H%M%S"),
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    devices = ["recording"] if args.recordings else args.host
+    outputs = []
+    if args.record:
+        outputs.append(RGBDRecordOutput(args.output_folder))
+    if args.ros:
+        outputs.append(
+            RosRGBDOutput(dict(zip(devices, args.holo_serial or ["hololens2"])))
+        )
+    if not args.headless:
+        outputs.append(RGBDDisplayOutput())
+    consumer = RGBDSyncConsumer(outputs, args.tolerance_ms, args.queue_size)
+
+    if args.recordings:
+        synchronizer = consumer.synchronizers["recording"] = RGBDSynchronizer(
+            args.tolerance_ms, args.queue_size, "recording"
+        )
+        try:
+            for sensor_type, raw_header, payload in recording_frames(*args.recordings):
+                for pair in synchronizer.push(sensor_type, raw_header, payload, False):
+                    for output in outputs:
+                        output(pair)
+        except (StopStreaming, KeyboardInterrupt):
+            pass
+        finally:
+            consumer.close()
+    else:
+        client = AsyncStreamingClient(
+            consumers=[consumer], stats_interval=args.stats_interval
+        )
+        for host in args.host:
+            for sensor_type in ("color", "depth"):
+                client.add_stream(host, sensor_type)
+        try:
+            asyncio.run(client.run())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,324 @@
+import struct
+from collections import namedtuple
+import numpy as np
+
+
+# Seconds between the FILETIME epoch (1601-01-01) and the Unix epoch.
+# Header Timestamps are FILETIME values in hundreds of nanoseconds.
+UNIX_EPOCH = 11644473600
+
+
+def filetime_to_unix(timestamp):
+    return timestamp * 1e-7 - UNIX_EPOCH
+
+
+def unix_to_filetime(seconds):
+    return int((seconds + UNIX_EPOCH) * 1e7)
+
+
+# Protocol Header Format
+# see https://docs.python.org/3/library/struct.html#format-characters
+SENSOR_FRAME_STRUCTURE = {
+    "color": {
+        "port": 10090,
+        "header_format": "@qIIII20f",
+        "header_data": namedtuple(
+            "SensorFrameStreamHeader",
+            "Timestamp ImageWidth ImageHeight PixelStride RowStride "
+            "fx fy cx cy "
+            "PV2WorldTransformM11 PV2WorldTransformM12 PV2WorldTransformM13 PV2WorldTransformM14 "
+            "PV2WorldTransformM21 PV2WorldTransformM22 PV2WorldTransformM23 PV2WorldTransformM24 "
+            "PV2WorldTransformM31 PV2WorldTransformM32 PV2WorldTransformM33 PV2WorldTransformM34 "
+            "PV2WorldTransformM41 PV2WorldTransformM42 PV2WorldTransformM43 PV2WorldTransformM44 ",
+        ),
+        "pose_field": "PV2WorldTransform",
+    },
+    "depth": {
+        "port": 10091,
+        "header_format": "@qIIII16f",
+        "header_data": namedtuple(
+            "SensorFrameStreamHeader",
+            "Timestamp ImageWidth ImageHeight PixelStride RowStride "
+            "Rig2WorldTransformM11 Rig2WorldTransformM12 Rig2WorldTransformM13 Rig2WorldTransformM14 "
+            "Rig2WorldTransformM21 Rig2WorldTransformM22 Rig2WorldTransformM23 Rig2WorldTransformM24 "
+            "Rig2WorldTransformM31 Rig2WorldTransformM32 Rig2WorldTransformM33 Rig2WorldTransformM34 "
+            "Rig2WorldTransformM41 Rig2WorldTransformM42 Rig2WorldTransformM43 Rig2WorldTransformM44 ",
+        ),
+        "pose_field": "Rig2WorldTransform",
+    },
+}
+
+# Precompiled header layouts
+HEADER_STRUCTS = {
+    sensor_type: struct.Struct(structure["header_format"])
+    for sensor_type, structure in SENSOR_FRAME_STRUCTURE.items()
+}
+# Timestamp ImageWidth ImageHeight PixelStride RowStride, shared by both sensors
+HEADER_PREFIX_STRUCT = struct.Struct("@qIIII")
+
+# NumPy views of the same layouts. Native byte order and the offsets produced
+# by the "@" struct alignment, so a header can be viewed in place. The 4x4
+# transform is stored row by row (M11..M44) and has to be transposed.
+_PREFIX_FIELDS = {
+    "Timestamp": ("=i8", 0),
+    "ImageWidth": ("=u4", 8),
+    "ImageHeight": ("=u4", 12),
+    "PixelStride": ("=u4", 16),
+    "RowStride": ("=u4", 20),
+}
+
+
+def _header_dtype(fields, itemsize):
+    return np.dtype(
+        {
+            "names": list(fields),
+            "formats": [fmt for fmt, _ in fields.values()],
+            "offsets": [offset for _, offset in fields.values()],
+            "itemsize": itemsize,
+        }
+    )
+
+
+HEADER_DTYPES = {
+    "color": _header_dtype(
+        {
+            **_PREFIX_FIELDS,
+            "fx": ("=f4", 24),
+            "fy": ("=f4", 28),
+            "cx": ("=f4", 32),
+            "cy": ("=f4", 36),
+            # fx fy cx cy as one vector, overlapping the scalar fields above
+            "Intrinsics": (("=f4", (4,)), 24),
+            "PV2WorldTransform": (("=f4", (4, 4)), 40),
+        },
+        HEADER_STRUCTS["color"].size,
+    ),
+    "depth": _header_dtype(
+        {
+            **_PREFIX_FIELDS,
+            "Rig2WorldTransform": (("=f4", (4, 4)), 24),
+        },
+        HEADER_STRUCTS["depth"].size,
+    ),
+}
+
+# PixelStride -> (pixel dtype, channels, ROS encoding)
+PIXEL_FORMATS = {
+    2: (np.uint16, 1, "16UC1"),  # depth image: 'Gray16'
+    3: (np.uint8, 3, "bgr8"),  # color image 'Bgr8'
+    4: (np.uint8, 4, "bgra8"),  # color image 'Bgra8'
+}
+
+
+# Header sanity bounds, a header outside them means the stream lost its frame
+# boundaries (the protocol has no sync marker)
+MAX_IMAGE_WIDTH = 4096
+MAX_IMAGE_HEIGHT = 4096
+MAX_ROW_PADDING = 4096
+
+
+def image_view(payload, width, height, pixel_stride, row_stride):
+    """
+    Zero-copy NumPy view of a frame payload.
+
+    Rows are addressed with `row_stride`, so padded rows are skipped without
+    repacking the buffer.
+
+    :returns: (height, width, channels) ndarray backed by `payload`
+    """
+    dtype, channels, _ = PIXEL_FORMATS[pixel_stride]
+    itemsize = np.dtype(dtype).itemsize
+    return np.ndarray(
+        (height, width, channels),
+        dtype=dtype,
+        buffer=payload,
+        strides=(row_stride, pixel_stride, itemsize),
+    )
+
+
+class SensorFrameHeader:
+    """
+    Reusable decoded frame header.
+
+    `decode` copies the raw header into a record owned by this object, so
+    `record`, `pose`, `intrinsics` and `camera_matrix` are allocated once and
+    stay valid (and up to date) across frames.
+    """
+
+    def __init__(self, sensor_type) -> None:
+        self.sensor_type = sensor_type
+        self.struct = HEADER_STRUCTS[sensor_type]
+        self.dtype = HEADER_DTYPES[sensor_type]
+        self.size = self.struct.size
+        self.pose_field = SENSOR_FRAME_STRUCTURE[sensor_type]["pose_field"]
+
+        self.buffer = bytearray(self.size)
+        self.record = np.frombuffer(self.buffer, dtype=self.dtype)
+        # 4x4 transform in column-vector convention, a view of the record
+        self.pose = self.record[self.pose_field][0].T
+        if sensor_type == "color":
+            self.intrinsics = self.record["Intrinsics"][0]
+            self.camera_matrix = np.eye(3, dtype=np.float32)
+        else:
+            self.intrinsics = None
+            self.camera_matrix = None
+
+        self.Timestamp = 0
+        self.ImageWidth = 0
+        self.ImageHeight = 0
+        self.PixelStride = 0
+        self.RowStride = 0
+
+    def decode(self, data):
+        """
+        Decode a raw header (bytes, bytearray or memoryview) in place.
+        """
+        self.buffer[:] = data
+        (
+            self.Timestamp,
+            self.ImageWidth,
+            self.ImageHeight,
+            self.PixelStride,
+            self.RowStride,
+        ) = HEADER_PREFIX_STRUCT.unpack_from(self.buffer)
+        if self.camera_matrix is not None:
+            self.camera_matrix[0, 0] = self.intrinsics[0]
+            self.camera_matrix[1, 1] = self.intrinsics[1]
+            self.camera_matrix[0, 2] = self.intrinsics[2]
+            self.camera_matrix[1, 2] = self.intrinsics[3]
+        return self
+
+    def check(self):
+        """
+        Sanity check the decoded fields against the protocol bounds.
+
+        :returns: None for a plausible header, otherwise what is wrong with it
+        """
+        if self.PixelStride not in PIXEL_FORMATS:
+            return f"PixelStride {self.PixelStride}"
+        if not 0 < self.ImageWidth <= MAX_IMAGE_WIDTH:
+            return f"ImageWidth {self.ImageWidth}"
+        if not 0 < self.ImageHeight <= MAX_IMAGE_HEIGHT:
+            return f"ImageHeight {self.ImageHeight}"
+        row_size = self.ImageWidth * self.PixelStride
+        if not row_size <= self.RowStride <= row_size + MAX_ROW_PADDING:
+            return f"RowStride {self.RowStride}"
+        if self.Timestamp <= 0:
+            return f"Timestamp {self.Timestamp}"
+        return None
+
+    @property
+    def fx(self):
+        return float(self.intrinsics[0])
+
+    @property
+    def fy(self):
+        return float(self.intrinsics[1])
+
+    @property
+    def cx(self):
+        return float(self.intrinsics[2])
+
+    @property
+    def cy(self):
+        return float(self.intrinsics[3])
+
+    @property
+    def image_size(self):
+        return self.ImageHeight * self.RowStride
+
+    @property
+    def encoding(self):
+        return PIXEL_FORMATS[self.PixelStride][2]
+
+    def image_view(self, payload):
+        return image_view(
+            payload,
+            self.ImageWidth,
+            self.ImageHeight,
+            self.PixelStride,
+            self.RowStride,
+        )
+
+    def as_namedtuple(self):
+        return SENSOR_FRAME_STRUCTURE[self.sensor_type]["header_data"](
+            *self.struct.unpack(self.buffer)
+        )
+
+    def __repr__(self):
+        return repr(self.as_namedtuple())
+
+
+def decode_headers(data, sensor_type, count=-1, offset=0):
+    """
+    Decode back-to-back headers in one vectorized call.
+
+    :param data: buffer holding concatenated raw headers
+    :param sensor_type: "color" or "depth"
+    :param count: number of headers to decode, -1 for all
+    :param offset: byte offset of the first header in `data`
+    :returns: structured array of HEADER_DTYPES[sensor_type], a view of `data`
+    """
+    return np.frombuffer(
+        data, dtype=HEADER_DTYPES[sensor_type], count=count, offset=offset
+    )
+
+
+def decode_stream_headers(data, sensor_type):
+    """
+    Decode every header of a raw stream capture (header + payload, repeated).
+
+    Frame boundaries are found by walking the fixed-size header prefix, then
+    all headers are gathered into one structured array in a single copy.
+
+    :returns: (headers, payload_offsets), trailing partial frames are ignored
+    """
+    header_size = HEADER_STRUCTS[sensor_type].size
+    data_size = len(data)
+    header_offsets = []
+    offset = 0
+    while offset + header_size <= data_size:
+        _, _, height, _, row_stride = HEADER_PREFIX_STRUCT.unpack_from(data, offset)
+        frame_end = offset + header_size + height * row_stride
+        if frame_end > data_size:
+            break
+        header_offsets.append(offset)
+        offset = frame_end
+
+    header_offsets = np.asarray(header_offsets, dtype=np.int64)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    gathered = raw[header_offsets[:, None] + np.arange(header_size)]
+    headers = gathered.view(HEADER_DTYPES[sensor_type]).reshape(-1)
+    return headers, header_offsets + header_size
+
+
+def header_poses(headers):
+    """
+    :returns: (N, 4, 4) view of the transforms of decoded headers
+    """
+    for structure in SENSOR_FRAME_STRUCTURE.values():
+        if structure["pose_field"] in headers.dtype.names:
+            return headers[structure["pose_field"]].transpose(0, 2, 1)
+    raise ValueError("Headers carry no transform field")
+
+
+def intrinsics_to_camera_matrices(intrinsics):
+    """
+    :param intrinsics: (N, 4) fx, fy, cx, cy
+    :returns: (N, 3, 3) intrinsic camera matrices
+    """
+    fx, fy, cx, cy = np.asarray(intrinsics).T
+    camera_matrices = np.zeros((len(fx), 3, 3), dtype=np.float32)
+    camera_matrices[:, 0, 0] = fx
+    camera_matrices[:, 1, 1] = fy
+    camera_matrices[:, 0, 2] = cx
+    camera_matrices[:, 1, 2] = cy
+    camera_matrices[:, 2, 2] = 1
+    return camera_matrices
+
+
+def header_camera_matrices(headers):
+    """
+    :returns: (N, 3, 3) intrinsic matrices of decoded color headers
+    """
+    return intrinsics_to_camera_matrices(headers["Intrinsics"])
@@ -0,0 +1,454 @@
+import json
+import time
+from bisect import bisect_left
+from sensor_protocol import filetime_to_unix
+
+
+# Histogram bucket upper bounds in seconds (1-2-5 series, 10us to 100s)
+HISTOGRAM_BOUNDS = [
+    mantissa * 10.0**exponent
+    for exponent in range(-5, 2)
+    for mantissa in (1, 2, 5)
+] + [100.0]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of durations in seconds.
+    """
+
+    def __init__(self) -> None:
+        # last bucket collects everything above HISTOGRAM_BOUNDS[-1]
+        self.counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket holding the `q` quantile (0 < q <= 1).
+        """
+        if not self.count:
+            return 0.0
+        threshold = q * self.count
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS, self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.mean * 1e3, 3),
+            "p50_ms": round(self.percentile(0.5) * 1e3, 3),
+            "p99_ms": round(self.percentile(0.99) * 1e3, 3),
+            "max_ms": round(self.max * 1e3, 3),
+        }
+
+
+class ConnectionStats:
+    """
+    Connection health of one stream: connections, failed attempts,
+    disconnects by cause, header resynchronizations and the time spent
+    without a connection after the first one.
+    """
+
+    def __init__(self) -> None:
+        self.connects = 0
+        self.connect_failures = 0
+        self.disconnects = {}
+        self.desyncs = 0
+        self.resyncs = 0
+        self.bytes_skipped = 0
+        self.downtime = 0.0
+        self.last_downtime = 0.0
+        self._down_since = None
+
+    @property
+    def reconnects(self):
+        return max(self.connects - 1, 0)
+
+    @property
+    def connected(self):
+        return self.connects > 0 and self._down_since is None
+
+    def on_connect(self):
+        self.connects += 1
+        if self._down_since is not None:
+            self.last_downtime = time.perf_counter() - self._down_since
+            self.downtime += self.last_downtime
+            self._down_since = None
+
+    def on_disconnect(self, reason):
+        self.disconnects[reason] = self.disconnects.get(reason, 0) + 1
+        if self._down_since is None:
+            self._down_since = time.perf_counter()
+
+    def current_downtime(self):
+        """
+        Total downtime, including the ongoing outage.
+        """
+        if self._down_since is None:
+            return self.downtime
+        return self.downtime + time.perf_counter() - self._down_since
+
+    def to_dict(self):
+        return {
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "connect_failures": self.connect_failures,
+            "disconnects": dict(self.disconnects),
+            "desyncs": self.desyncs,
+            "resyncs": self.resyncs,
+            "bytes_skipped": self.bytes_skipped,
+            "downtime_s": round(self.current_downtime(), 3),
+            "last_downtime_s": round(self.last_downtime, 3),
+        }
+
+    def to_prometheus(self, prefix, label):
+        lines = [
+            f"# TYPE {prefix}_reconnects_total counter",
+            f"{prefix}_reconnects_total{{{label}}} {self.reconnects}",
+            f"# TYPE {prefix}_connect_failures_total counter",
+            f"{prefix}_connect_failures_total{{{label}}} {self.connect_failures}",
+            f"# TYPE {prefix}_disconnects_total counter",
+        ]
+        for reason, count in self.disconnects.items():
+            lines.append(
+                f'{prefix}_disconnects_total{{{label},reason="{reason}"}} {count}'
+            )
+        lines += [
+            f"# TYPE {prefix}_resyncs_total counter",
+            f"{prefix}_resyncs_total{{{label}}} {self.resyncs}",
+            f"# TYPE {prefix}_skipped_bytes_total counter",
+            f"{prefix}_skipped_bytes_total{{{label}}} {self.bytes_skipped}",
+            f"# TYPE {prefix}_downtime_seconds_total counter",
+            f"{prefix}_downtime_seconds_total{{{label}}} {self.current_downtime():.3f}",
+        ]
+        return lines
+
+
+class GateStats:
+    """
+    Frames filtered by their Timestamp: duplicates of the previous frame,
+    stale frames older than it, gaps in the stream with the number of frames
+    missing in them, and frames skipped by the rate limit of each output.
+    """
+
+    def __init__(self) -> None:
+        self.duplicates = 0
+        self.stale = 0
+        self.gaps = 0
+        self.lost = 0
+        self.skipped = {}
+
+    @property
+    def dropped(self):
+        return self.duplicates + self.stale
+
+    def to_dict(self):
+        return {
+            "duplicates": self.duplicates,
+            "stale": self.stale,
+            "gaps": self.gaps,
+            "lost": self.lost,
+            "skipped": dict(self.skipped),
+        }
+
+    def to_prometheus(self, prefix, label):
+        lines = [
+            f"# TYPE {prefix}_dropped_frames_total counter",
+            f'{prefix}_dropped_frames_total{{{label},reason="duplicate"}} {self.duplicates}',
+            f'{prefix}_dropped_frames_total{{{label},reason="stale"}} {self.stale}',
+            f"# TYPE {prefix}_gaps_total counter",
+            f"{prefix}_gaps_total{{{label}}} {self.gaps}",
+            f"# TYPE {prefix}_lost_frames_total counter",
+            f"{prefix}_lost_frames_total{{{label}}} {self.lost}",
+            f"# TYPE {prefix}_skipped_frames_total counter",
+        ]
+        for output, count in self.skipped.items():
+            lines.append(
+                f'{prefix}_skipped_frames_total{{{label},output="{output}"}} {count}'
+            )
+        return lines
+
+
+class StageStats:
+    """
+    Frames and timings of one pipeline stage.
+
+    `service` is the time spent in the stage function, `latency` the time
+    from the frame entering the pipeline to the end of the stage, queueing
+    in front of the stage included.
+    """
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self.processed = 0
+        # frames the stage function returned DROP_FRAME for
+        self.filtered = 0
+        # frames dropped by the backpressure policy of the stage queue
+        self.dropped = 0
+        # frames above the rate of the stage, passed on without processing
+        self.skipped = 0
+        self.failed = 0
+        self.service = Histogram()
+        self.latency = Histogram()
+
+    def add(self, service, latency):
+        self.processed += 1
+        self.service.add(service)
+        self.latency.add(latency)
+
+    def summary(self):
+        line = (
+            f"{self.name} n={self.processed}"
+            f" service={self.service.mean * 1e3:.2f}ms"
+            f" latency p50={self.latency.percentile(0.5) * 1e3:.1f}ms"
+            f" p99={self.latency.percentile(0.99) * 1e3:.1f}ms"
+        )
+        for name in ("filtered", "dropped", "skipped", "failed"):
+            if getattr(self, name):
+                line += f" {name}={getattr(self, name)}"
+        return line
+
+    def to_dict(self):
+        return {
+            "processed": self.processed,
+            "filtered": self.filtered,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "service": self.service.summary(),
+            "latency": self.latency.summary(),
+        }
+
+
+class StreamStats:
+    """
+    Per-stage timers, FPS/bandwidth counters and device-to-host latency of one
+    stream.
+
+    Stages are timed by chaining perf_counter laps, which keeps the cost to a
+    couple of microseconds per stage:
+
+        t = stats.start_frame()
+        ...receive...
+        t = stats.lap("receive", t)
+        ...parse...
+        t = stats.lap("parse", t)
+        stats.end_frame(nbytes, header.Timestamp)
+
+    Latency compares the header Timestamp (FILETIME, device clock) with the
+    host wall clock, so it is only meaningful when both clocks are synced.
+
+    :param report_interval: seconds between stats lines, 0 to disable
+    :param log: callable receiving the stats line, None to stay silent
+    :param dump_path: file rewritten at every report (see `dump`)
+    """
+
+    def __init__(self, stream, report_interval=5.0, log=print, dump_path=None) -> None:
+        self.stream = stream
+        self.report_interval = report_interval
+        self.log = log
+        self.dump_path = dump_path
+        self.stages = {}
+        self.latency = Histogram()
+        self.connection = ConnectionStats()
+        self.gate = GateStats()
+        self.frames = 0
+        self.bytes = 0
+        self.syscalls = 0
+        self.started_at = time.perf_counter()
+
+        self._window_start = self.started_at
+        self._window_frames = 0
+        self._window_bytes = 0
+        self._window_syscalls = 0
+        self.fps = 0.0
+        self.bandwidth = 0.0
+        self.syscalls_per_frame = 0.0
+
+    def start_frame(self):
+        return time.perf_counter()
+
+    def lap(self, stage, start):
+        """
+        Record the time spent in `stage` since `start`.
+
+        :returns: current perf_counter, the start of the next stage
+        """
+        now = time.perf_counter()
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.add(now - start)
+        return now
+
+    def end_frame(self, nbytes, timestamp=None, syscalls=0):
+        """
+        Count one frame of `nbytes` bytes stamped with the device `timestamp`.
+
+        :param syscalls: receive syscalls spent on the frame, see
+            `FrameReader.syscalls`
+        :returns: True when a periodic report was emitted
+        """
+        self.frames += 1
+        self.bytes += nbytes
+        self.syscalls += syscalls
+        self._window_frames += 1
+        self._window_bytes += nbytes
+        self._window_syscalls += syscalls
+        if timestamp is not None:
+            self.latency.add(time.time() - filetime_to_unix(timestamp))
+
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        if self.report_interval and elapsed >= self.report_interval:
+            self.fps = self._window_frames / elapsed
+            self.bandwidth = self._window_bytes / elapsed
+            self.syscalls_per_frame = self._window_syscalls / max(
+                self._window_frames, 1
+            )
+            self._window_start = now
+            self._window_frames = 0
+            self._window_bytes = 0
+            self._window_syscalls = 0
+            if self.log is not None:
+                self.log(self.stats_line())
+            if self.dump_path is not None:
+                self.dump(self.dump_path)
+            return True
+        return False
+
+    def stats_line(self):
+        stages = " ".join(
+            f"{stage}={histogram.mean * 1e3:.2f}ms"
+            for stage, histogram in self.stages.items()
+        )
+        line = (
+            f"[{self.stream}] {self.fps:.1f} FPS {self.bandwidth / 1e6:.1f} MB/s "
+            f"frames={self.frames} {stages}"
+        )
+        if self.syscalls:
+            line += f" syscalls/frame={self.syscalls_per_frame:.1f}"
+        if self.latency.count:
+            line += (
+                f" latency p50={self.latency.percentile(0.5) * 1e3:.1f}ms"
+                f" p99={self.latency.percentile(0.99) * 1e3:.1f}ms"
+            )
+        connection = self.connection
+        if connection.reconnects or connection.desyncs:
+            line += (
+                f" reconnects={connection.reconnects}"
+                f" downtime={connection.current_downtime():.1f}s"
+                f" resyncs={connection.resyncs}/{connection.desyncs}"
+            )
+        gate = self.gate
+        if gate.dropped or gate.gaps:
+            line += (
+                f" dropped={gate.duplicates}dup/{gate.stale}stale"
+                f" lost={gate.lost} in {gate.gaps} gaps"
+            )
+        return line
+
+    def to_dict(self):
+        return {
+            "stream": self.stream,
+            "uptime_s": round(time.perf_counter() - self.started_at, 3),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "fps": round(self.fps, 3),
+            "bandwidth_MBps": round(self.bandwidth / 1e6, 3),
+            "syscalls": self.syscalls,
+            "syscalls_per_frame": round(self.syscalls_per_frame, 3),
+            "stages": {
+                stage: histogram.summary() for stage, histogram in self.stages.items()
+            },
+            "latency": self.latency.summary(),
+            "connection": self.connection.to_dict(),
+            "gate": self.gate.to_dict(),
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix="hl2"):
+        """
+        Prometheus text exposition format.
+        """
+        label = f'stream="{self.stream}"'
+        lines = [
+            f"# TYPE {prefix}_frames_total counter",
+            f"{prefix}_frames_total{{{label}}} {self.frames}",
+            f"# TYPE {prefix}_bytes_total counter",
+            f"{prefix}_bytes_total{{{label}}} {self.bytes}",
+            f"# TYPE {prefix}_syscalls_total counter",
+            f"{prefix}_syscalls_total{{{label}}} {self.syscalls}",
+            f"# TYPE {prefix}_fps gauge",
+            f"{prefix}_fps{{{label}}} {self.fps:.3f}",
+            f"# TYPE {prefix}_bandwidth_bytes gauge",
+            f"{prefix}_bandwidth_bytes{{{label}}} {self.bandwidth:.0f}",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        for stage, histogram in self.stages.items():
+            lines += _prometheus_histogram(
+                f"{prefix}_stage_seconds", f'{label},stage="{stage}"', histogram
+            )
+        lines.append(f"# TYPE {prefix}_latency_seconds histogram")
+        lines += _prometheus_histogram(f"{prefix}_latency_seconds", label, self.latency)
+        lines += self.connection.to_prometheus(prefix, label)
+        lines += self.gate.to_prometheus(prefix, label)
+        return "\n".join(lines) + "\n"
+
+    def dump(self, file_path):
+        """
+        Write the stats to `file_path`, as Prometheus text for ".prom" files
+        and JSON otherwise.
+        """
+        text = self.to_prometheus() if file_path.endswith(".prom") else self.to_json()
+        with open(file_path, "w") as f:
+            f.write(text)
+
+    def histogram_report(self):
+        rows = [("latency", self.latency)] if self.latency.count else []
+        rows += list(self.stages.items())
+        lines = [f"==> [INFO] {self.stream} timing histograms"]
+        for name, histogram in rows:
+            summary = histogram.summary()
+            lines.append(
+                f"  * {name:<16} n={summary['count']:<8} mean={summary['mean_ms']:.2f}ms "
+                f"p50<={summary['p50_ms']:.2f}ms p99<={summary['p99_ms']:.2f}ms "
+                f"max={summary['max_ms']:.2f}ms"
+            )
+            peak = max(histogram.counts) or 1
+            for bound, count in zip(HISTOGRAM_BOUNDS + [float("inf")], histogram.counts):
+                if count:
+                    bar = "#" * max(1, round(40 * count / peak))
+                    lines.append(f"      <= {bound * 1e3:>9.2f}ms {count:>8} {bar}")
+        return "\n".join(lines)
+
+
+def _prometheus_histogram(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(HISTOGRAM_BOUNDS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.total:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
@@ -0,0 +1,607 @@
+import time
+import asyncio
+import argparse
+import threading
+import numpy as np
+from point_cloud import DepthUnprojector, load_depth_lut, pinhole_lut
+from pose_utils import (
+    DEFAULT_RIG2DEPTH,
+    load_depth_extrinsics_from_yaml,
+    matrix_to_quaternion,
+)
+
+# Voxels per block side, blocks are the unit of allocation
+BLOCK_SIZE = 8
+BLOCK_VOXELS = BLOCK_SIZE**3
+BLOCK_SHIFT = 3
+# Block coordinates are packed into one int64 key, 16 bits per axis (about
+# +-2.6 km at 1 cm voxels). A voxel key appends the 9-bit index of the voxel
+# in its block, and a sample key 4 more bits for the sample along the ray.
+_KEY_BITS = 16
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+_KEY_MASK = (1 << _KEY_BITS) - 1
+_LOCAL_BITS = 3 * BLOCK_SHIFT
+_SAMPLE_BITS = 4
+
+
+def pack_block_keys(blocks):
+    """
+    :param blocks: (N, 3) int64 block coordinates
+    :returns: (N,) int64 keys, ordered like the coordinates (x, y, z)
+    """
+    shifted = blocks + _KEY_OFFSET
+    return (
+        (shifted[:, 0] << (2 * _KEY_BITS)) | (shifted[:, 1] << _KEY_BITS) | shifted[:, 2]
+    )
+
+
+def unpack_block_keys(keys):
+    return (
+        np.stack(
+            (keys >> (2 * _KEY_BITS), (keys >> _KEY_BITS) & _KEY_MASK, keys & _KEY_MASK),
+            axis=-1,
+        )
+        - _KEY_OFFSET
+    )
+
+
+class VoxelBlockGrid:
+    """
+    Sparse TSDF volume made of 8x8x8 voxel blocks.
+
+    Only blocks within the truncation band of an observed surface are
+    allocated, so memory follows the observed surface rather than the
+    bounding box. Block keys are kept sorted next to their pool slots and
+    looked up with `np.searchsorted`, so a whole frame is hashed in a few
+    array operations. The block pool grows by doubling.
+
+    Integration casts every depth ray through the truncation band: samples
+    at voxel spacing around the measured point get the signed distance to
+    the surface (positive in front of it), are averaged per voxel for the
+    frame and then merged into the running weighted average. Working along
+    the rays needs no camera projection model, so the AHaT LUT is used as is.
+    """
+
+    def __init__(
+        self, voxel_size=0.01, truncation=None, max_weight=64.0, initial_blocks=1024
+    ) -> None:
+        """
+        :param voxel_size: voxel side in meters
+        :param truncation: half width of the band around surfaces in meters,
+            defaults to 4 voxels
+        :param max_weight: weight cap, lower values adapt faster to change
+        """
+        self.voxel_size = voxel_size
+        self.truncation = 4 * voxel_size if truncation is None else truncation
+        self.max_weight = max_weight
+        num_samples = int(np.ceil(2 * self.truncation / voxel_size)) + 1
+        self._sample_offsets = np.linspace(
+            -self.truncation, self.truncation, num_samples, dtype=np.float32
+        )
+        # signed distance of each sample in truncation units, positive towards
+        # the camera
+        self._sample_tsdf = -self._sample_offsets / self.truncation
+        if num_samples > 1 << _SAMPLE_BITS:
+            raise ValueError(
+                f"Truncation of {num_samples} samples, at most {1 << _SAMPLE_BITS}"
+            )
+        self._sample_index = np.arange(num_samples, dtype=np.int64)
+
+        self.keys = np.empty(0, dtype=np.int64)
+        self.slots = np.empty(0, dtype=np.int64)
+        self.num_blocks = 0
+        self.tsdf = np.zeros((initial_blocks, BLOCK_VOXELS), dtype=np.float32)
+        self.weight = np.zeros((initial_blocks, BLOCK_VOXELS), dtype=np.float32)
+
+    @property
+    def memory_bytes(self):
+        return (
+            self.tsdf.nbytes + self.weight.nbytes + self.keys.nbytes + self.slots.nbytes
+        )
+
+    def block_coordinates(self):
+        """
+        :returns: (num_blocks, 3) block coordinates, in slot order
+        """
+        coordinates = np.empty((self.num_blocks, 3), dtype=np.int64)
+        coordinates[self.slots] = unpack_block_keys(self.keys)
+        return coordinates
+
+    def lookup(self, keys):
+        """
+        :returns: pool slot of every key, -1 for unallocated blocks
+        """
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.searchsorted(self.keys, keys)
+        positions = np.minimum(positions, len(self.keys) - 1)
+        found = self.keys[positions] == keys
+        return np.where(found, self.slots[positions], -1)
+
+    def allocate(self, keys):
+        """
+        :param keys: unique block keys
+        :returns: pool slot of every key, allocating the missing blocks
+        """
+        slots = self.lookup(keys)
+        missing = slots < 0
+        num_new = int(np.count_nonzero(missing))
+        if num_new:
+            new_slots = np.arange(self.num_blocks, self.num_blocks + num_new)
+            slots[missing] = new_slots
+            self.num_blocks += num_new
+            if self.num_blocks > len(self.tsdf):
+                capacity = max(2 * len(self.tsdf), self.num_blocks)
+                self.tsdf = self._grow(self.tsdf, capacity)
+                self.weight = self._grow(self.weight, capacity)
+            keys = np.concatenate((self.keys, keys[missing]))
+            slots_all = np.concatenate((self.slots, new_slots))
+            order = np.argsort(keys, kind="stable")
+            self.keys = keys[order]
+            self.slots = slots_all[order]
+        return slots
+
+    @staticmethod
+    def _grow(pool, capacity):
+        grown = np.zeros((capacity, BLOCK_VOXELS), dtype=pool.dtype)
+        grown[: len(pool)] = pool
+        return grown
+
+    def integrate_points(self, origin, points):
+        """
+        Fuse one frame of surface points.
+
+        :param origin: (3,) camera center in world coordinates
+        :param points: (N, 3) measured surface points in world coordinates
+        """
+        if not len(points):
+            return
+        scale = 1 / self.voxel_size
+        rays = points - np.asarray(origin, dtype=np.float32)
+        distances = np.sqrt(np.einsum("ij,ij->i", rays, rays))
+        # sample steps along each ray, in voxel units
+        rays *= (scale / distances)[:, None]
+        samples = (points * scale)[:, None, :] + (
+            self._sample_offsets[None, :, None] * rays[:, None, :]
+        )
+        voxels = np.floor(samples.reshape(-1, 3)).astype(np.int64)
+
+        # one sort of the packed (block, voxel, sample) keys groups the
+        # samples by voxel and the voxels by block
+        keys = np.tile(self._sample_index, len(points))
+        for axis, shift in enumerate((2 * _KEY_BITS, _KEY_BITS, 0)):
+            column = voxels[:, axis]
+            keys |= ((column >> BLOCK_SHIFT) + _KEY_OFFSET) << (
+                shift + _LOCAL_BITS + _SAMPLE_BITS
+            )
+            keys |= (column & (BLOCK_SIZE - 1)) << (
+                BLOCK_SHIFT * (2 - axis) + _SAMPLE_BITS
+            )
+        keys.sort()
+        voxel_keys = keys >> _SAMPLE_BITS
+        starts = np.flatnonzero(np.diff(voxel_keys, prepend=-1))
+        counts = np.diff(starts, append=len(keys))
+
+        # average the samples of this frame per voxel
+        frame_tsdf = np.add.reduceat(
+            self._sample_tsdf[keys & ((1 << _SAMPLE_BITS) - 1)], starts
+        )
+        frame_tsdf /= counts
+        voxel_keys = voxel_keys[starts]
+
+        block_keys = voxel_keys >> _LOCAL_BITS
+        block_starts = np.flatnonzero(np.diff(block_keys, prepend=-1))
+        slots = self.allocate(block_keys[block_starts])
+        voxel_slots = np.repeat(slots, np.diff(block_starts, append=len(block_keys)))
+        index = voxel_slots * BLOCK_VOXELS + (voxel_keys & (BLOCK_VOXELS - 1))
+
+        # every observed voxel gets weight 1 for the frame
+        tsdf = self.tsdf.reshape(-1)
+        weight = self.weight.reshape(-1)
+        voxel_weight = weight[index]
+        tsdf[index] = (tsdf[index] * voxel_weight + frame_tsdf) / (voxel_weight + 1)
+        weight[index] = np.minimum(voxel_weight + 1, self.max_weight)
+
+    def voxel_centers(self, slots, local_index):
+        blocks = self.block_coordinates()[slots]
+        local = np.stack(
+            (
+                local_index // (BLOCK_SIZE * BLOCK_SIZE),
+                (local_index // BLOCK_SIZE) % BLOCK_SIZE,
+                local_index % BLOCK_SIZE,
+            ),
+            axis=-1,
+        )
+        return ((blocks * BLOCK_SIZE + local + 0.5) * self.voxel_size).astype(np.float32)
+
+    def extract_points(self, min_weight=1.0):
+        """
+        Voxels closer to the surface than half a voxel.
+
+        :returns: (N, 3) float32 voxel centers in world coordinates
+        """
+        count = self.num_blocks
+        near = np.abs(self.tsdf[:count]) * self.truncation < 0.5 * self.voxel_size
+        near &= self.weight[:count] >= min_weight
+        slots, local_index = np.nonzero(near)
+        return self.voxel_centers(slots, local_index)
+
+    def extract_mesh(self, min_weight=1.0):
+        """
+        Triangle mesh of the zero crossing, by marching cubes over every block
+        and the first voxel layer of its neighbors. Needs scikit-image.
+
+        :returns: ((V, 3) float32 vertices in world coordinates, (F, 3) int32
+            faces)
+        """
+        from skimage.measure import marching_cubes
+
+        if not self.num_blocks:
+            return np.empty((0, 3), np.float32), np.empty((0, 3), np.int32)
+        blocks = self.block_coordinates()
+        # voxel grid of one block plus one layer, as offsets from its origin
+        grid = np.stack(
+            np.meshgrid(*[np.arange(BLOCK_SIZE + 1)] * 3, indexing="ij"), axis=-1
+        ).reshape(-1, 3)
+        voxels = (blocks[:, None, :] * BLOCK_SIZE + grid[None]).reshape(-1, 3)
+        slots = self.lookup(pack_block_keys(voxels >> BLOCK_SHIFT))
+        local = voxels & (BLOCK_SIZE - 1)
+        local_index = (local[:, 0] * BLOCK_SIZE + local[:, 1]) * BLOCK_SIZE + local[:, 2]
+        shape = (len(blocks),) + (BLOCK_SIZE + 1,) * 3
+        tsdf = np.where(slots >= 0, self.tsdf[slots, local_index], 1.0).reshape(shape)
+        weight = np.where(slots >= 0, self.weight[slots, local_index], 0).reshape(shape)
+        # truncated voxels only tell on which side of a surface they are, a
+        # sign change between them is not a surface
+        observed = (weight >= min_weight) & (np.abs(tsdf) < 1.0)
+
+        vertices, faces = [], []
+        num_vertices = 0
+        candidates = np.flatnonzero(
+            np.any(observed & (tsdf < 0), axis=(1, 2, 3))
+            & np.any(observed & (tsdf > 0), axis=(1, 2, 3))
+        )
+        for i in candidates:
+            try:
+                block_vertices, block_faces, _, _ = marching_cubes(tsdf[i], level=0.0)
+            except (ValueError, RuntimeError):
+                continue
+            # keep the triangles whose vertices all lie on an edge between two
+            # observed voxels
+            low = np.floor(block_vertices).astype(np.int64)
+            high = np.ceil(block_vertices).astype(np.int64)
+            valid = observed[i][tuple(low.T)] & observed[i][tuple(high.T)]
+            block_faces = block_faces[valid[block_faces].all(axis=1)]
+            vertices.append(block_vertices + blocks[i] * BLOCK_SIZE)
+            faces.append(block_faces + num_vertices)
+            num_vertices += len(block_vertices)
+        if not faces:
+            return np.empty((0, 3), np.float32), np.empty((0, 3), np.int32)
+
+        # blocks share their border vertices, merge them and drop the
+        # vertices of removed triangles
+        faces = np.concatenate(faces)
+        if not len(faces):
+            return np.empty((0, 3), np.float32), np.empty((0, 3), np.int32)
+        vertices = np.concatenate(vertices)
+        used = np.unique(faces)
+        _, first, inverse = np.unique(
+            np.round(vertices[used] * 1024).astype(np.int64),
+            axis=0,
+            return_index=True,
+            return_inverse=True,
+        )
+        remap = np.zeros(len(vertices), dtype=np.int64)
+        remap[used] = inverse.reshape(-1)
+        vertices = ((vertices[used][first] + 0.5) * self.voxel_size).astype(np.float32)
+        faces = remap[faces].astype(np.int32)
+        return vertices, faces
+
+
+def write_ply(file_path, vertices, faces=None):
+    """
+    Write points, or a triangle mesh, as binary little endian PLY.
+    """
+    vertices = np.ascontiguousarray(vertices, dtype="<f4")
+    header = [
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {len(vertices)}",
+        "property float x",
+        "property float y",
+        "property float z",
+    ]
+    if faces is not None:
+        header += [f"element face {len(faces)}", "property list uchar int vertex_indices"]
+    header.append("end_header")
+    with open(file_path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode())
+        f.write(vertices.tobytes())
+        if faces is not None:
+            records = np.empty(
+                len(faces), dtype=[("count", "u1"), ("indices", "<i4", (3,))]
+            )
+            records["count"] = 3
+            records["indices"] = faces
+            f.write(records.tobytes())
+
+
+class IntegrationPolicy:
+    """
+    Decide which depth frames to integrate.
+
+    Frames are integrated at most `max_fps` times per second. With the
+    keyframe thresholds set, a frame is only integrated once the device has
+    moved `min_translation` meters or turned `min_rotation_deg` degrees
+    since the last integrated frame, or after `max_interval` seconds.
+    """
+
+    def __init__(
+        self, max_fps=15.0, min_translation=0.0, min_rotation_deg=0.0, max_interval=1.0
+    ) -> None:
+        self.min_period = 1e7 / max_fps if max_fps else 0
+        self.min_translation = min_translation
+        self.min_rotation_deg = min_rotation_deg
+        self.max_interval = max_interval * 1e7
+        self.keyframes = min_translation > 0 or min_rotation_deg > 0
+        self.last_timestamp = None
+        self.last_pose = None
+
+    def should_integrate(self, timestamp, pose):
+        if self.last_timestamp is not None:
+            elapsed = timestamp - self.last_timestamp
+            if elapsed < self.min_period:
+                return False
+            if self.keyframes and elapsed < self.max_interval:
+                translation = np.linalg.norm(pose[:3, 3] - self.last_pose[:3, 3])
+                # angle of the relative rotation
+                w = matrix_to_quaternion(self.last_pose[:3, :3].T @ pose[:3, :3])[3]
+                rotation = np.degrees(2 * np.arccos(min(abs(w), 1.0)))
+                if (
+                    translation < self.min_translation
+                    and rotation < self.min_rotation_deg
+                ):
+                    return False
+        self.last_timestamp = timestamp
+        self.last_pose = np.array(pose, dtype=np.float32)
+        return True
+
+
+class TSDFIntegrator:
+    """
+    Fuse AHaT depth frames into a VoxelBlockGrid.
+
+    `submit` applies the IntegrationPolicy and hands the frame to a worker
+    thread. Only the latest frame waits for the worker, so when integration
+    falls behind, frames are dropped instead of delaying the receive loop.
+    """
+
+    def __init__(
+        self, grid, unprojector, rig2depth, policy=None, background=True
+    ) -> None:
+        self.grid = grid
+        self.unprojector = unprojector
+        self.depth2rig = np.linalg.inv(rig2depth).astype(np.float32)
+        self.policy = policy or IntegrationPolicy()
+        self.integrated = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.integrate_time = 0.0
+        self._lock = threading.Lock()
+        self._pending = None
+        self._condition = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(
+                target=self._worker, name="TSDFIntegrator", daemon=True
+            )
+            self._thread.start()
+
+    def integrate(self, depth, rig2world):
+        start = time.perf_counter()
+        cam2world = np.matmul(rig2world, self.depth2rig)
+        points = self.unprojector.unproject(depth, cam2world)
+        self.grid.integrate_points(cam2world[:3, 3], points)
+        with self._lock:
+            self.integrated += 1
+            self.integrate_time += time.perf_counter() - start
+
+    def submit(self, timestamp, depth, rig2world):
+        """
+        :returns: True if the frame will be integrated
+        """
+        if not self.policy.should_integrate(timestamp, rig2world):
+            self.skipped += 1
+            return False
+        if self._thread is None:
+            self.integrate(depth, rig2world)
+            return True
+        job = (depth.copy(), np.array(rig2world, dtype=np.float32))
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = job
+            self._condition.notify()
+        return True
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                job, self._pending = self._pending, None
+            self.integrate(*job)
+
+    def close(self):
+        if self._thread is not None:
+            with self._condition:
+                self._closed = True
+                self._condition.notify()
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "integrated": self.integrated,
+                "skipped": self.skipped,
+                "dropped": self.dropped,
+                "integrate_ms_avg": round(
+                    self.integrate_time / max(self.integrated, 1) * 1e3, 3
+                ),
+                "blocks": self.grid.num_blocks,
+                "memory_mb": round(self.grid.memory_bytes / 1e6, 1),
+            }
+
+
+class TSDFConsumer:
+    """
+    AsyncStreamingClient consumer fusing the depth stream, writing the map
+    to `output` on close.
+    """
+
+    def __init__(self, integrator, output=None, mesh=False) -> None:
+        self.integrator = integrator
+        self.output = output
+        self.mesh = mesh
+
+    def __call__(self, frame):
+        if frame.sensor_type == "depth":
+            header = frame.header
+            self.integrator.submit(header.Timestamp, frame.image, header.pose)
+
+    def close(self):
+        self.integrator.close()
+        print(f"==> [INFO] TSDF stats: {self.integrator.stats()}")
+        if self.output is not None:
+            export_map(self.integrator.grid, self.output, self.mesh)
+
+
+def export_map(grid, file_path, mesh=False):
+    start = time.perf_counter()
+    if mesh:
+        vertices, faces = grid.extract_mesh()
+        write_ply(file_path, vertices, faces)
+        summary = f"{len(vertices)} vertices, {len(faces)} faces"
+    else:
+        points = grid.extract_points()
+        write_ply(file_path, points)
+        summary = f"{len(points)} points"
+    print(
+        f"==> [INFO] Wrote {summary} to {file_path} "
+        f"({(time.perf_counter() - start) * 1e3:.0f} ms)"
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fuse the AHaT depth stream into a TSDF voxel map"
+    )
+    parser.add_argument(
+        "--host", help="IP address of HoloLens.", default="192.168.50.210", type=str
+    )
+    parser.add_argument(
+        "--recording",
+        help="Fuse a depth recording offline instead of streaming",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--depth_lut",
+        help="Depth AHaT_lut.bin of the device, an ideal pinhole if not set",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--rig2depth",
+        help="YAML file with the depth extrinsics, the sample device if not set",
+        default=None,
+        type=str,
+    )
+    parser.add_argument(
+        "--voxel_size", help="Voxel side in meters", default=0.01, type=float
+    )
+    parser.add_argument(
+        "--truncation",
+        help="Truncation distance in meters, 4 voxels if not set",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--stride",
+        help="Use every n-th depth row and column",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--max_depth",
+        help="Ignore depth farther than this (meters)",
+        default=None,
+        type=float,
+    )
+    parser.add_argument(
+        "--max_fps", help="Integrate at most this many frames per second", default=15.0, type=float
+    )
+    parser.add_argument(
+        "--min_translation",
+        help="Keyframe mode: integrate after moving this far (meters)",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--min_rotation",
+        help="Keyframe mode: integrate after turning this far (degrees)",
+        default=0.0,
+        type=float,
+    )
+    parser.add_argument(
+        "--output", help="PLY file written on exit", default="tsdf_map.ply", type=str
+    )
+    parser.add_argument(
+        "--mesh",
+        help="Export a marching cubes mesh (needs scikit-image) instead of points",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    lut = load_depth_lut(args.depth_lut) if args.depth_lut else pinhole_lut()
+    rig2depth = (
+        load_depth_extrinsics_from_yaml(args.rig2depth)
+        if args.rig2depth
+        else DEFAULT_RIG2DEPTH
+    )
+    grid = VoxelBlockGrid(args.voxel_size, args.truncation)
+    unprojector = DepthUnprojector(lut, stride=args.stride, max_depth=args.max_depth)
+    policy = IntegrationPolicy(args.max_fps, args.min_translation, args.min_rotation)
+
+    if args.recording:
+        from frame_recorder import RecordingReader
+        from sensor_protocol import header_poses
+
+        integrator = TSDFIntegrator(grid, unprojector, rig2depth, policy, background=False)
+        with RecordingReader(args.recording) as reader:
+            poses = header_poses(reader.headers())
+            for i in range(len(reader)):
+                integrator.submit(
+                    int(reader.timestamps[i]), reader.frame(i)[1], poses[i]
+                )
+        consumer = TSDFConsumer(integrator, args.output, args.mesh)
+        consumer.close()
+    else:
+        from async_client import AsyncStreamingClient
+
+        integrator = TSDFIntegrator(grid, unprojector, rig2depth, policy)
+        client = AsyncStreamingClient(
+            consumers=[TSDFConsumer(integrator, args.output, args.mesh)]
+        )
+        client.add_stream(args.host, "depth")
+        try:
+            asyncio.run(client.run())
+        except KeyboardInterrupt:
+            pass
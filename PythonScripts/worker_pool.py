@@ -0,0 +1,121 @@
+import queue
+import threading
+
+
+BACKPRESSURE_POLICIES = ["block", "drop_oldest", "drop_newest"]
+
+
+class BoundedWorkerPool:
+    """
+    Pool of worker threads fed through a bounded queue.
+
+    When the queue is full the backpressure policy decides whether `submit`
+    blocks, evicts the oldest queued job or drops the new one. Subclasses
+    implement `_process(job)`; an exception raised there counts the job as
+    failed.
+    """
+
+    def __init__(self, num_workers=2, queue_size=32, policy="block", name="Worker") -> None:
+        assert policy in BACKPRESSURE_POLICIES, f"Unknown policy '{policy}'"
+        assert num_workers > 0 and queue_size > 0
+        self.policy = policy
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Counters, guarded by _lock
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _submit(self, job):
+        """
+        :returns: True if queued, False if dropped
+        """
+        if self._closed:
+            raise RuntimeError(f"{type(self).__name__} is closed")
+
+        if self.policy == "block":
+            self._queue.put(job)
+        elif self.policy == "drop_newest":
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._count_drop()
+                return False
+        else:  # drop_oldest
+            while True:
+                try:
+                    self._queue.put_nowait(job)
+                    break
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self._queue.task_done()
+                        self._count_drop()
+                    except queue.Empty:
+                        pass
+
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return True
+
+    def _count_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+            try:
+                self._process(job)
+            except Exception as err:
+                with self._lock:
+                    self.failed += 1
+                self._report_failure(job, err)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job):
+        raise NotImplementedError
+
+    def _report_failure(self, job, err):
+        print(f"==> [ERROR] {type(self).__name__} job failed!!! ({err})")
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+    def close(self):
+        """
+        Process every queued job, then stop the workers.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()